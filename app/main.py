@@ -1,26 +1,44 @@
 # ./app/main.py
 
 # Importing External Modules
-import time
 import zoneinfo
 from datetime import datetime
 from fastapi import FastAPI, Request, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from typing import Annotated
 from sqlalchemy.orm import Session
 
 # Importing Internal Modules
-from db import create_all_tables, SessionDep
-from .routers import customers, billing, plans
+from db import check_database_schema, SessionDep, engine, read_engine, async_engine, async_read_engine
+from .routers import customers, billing, plans, analytics
 from .utils.utils import hash_password, verify_password 
+from .utils.cache import cache
+from .utils.group_commit import transaction_writer
+from .utils.idempotency import idempotency_store
+from .utils.ratelimit import rate_limiter, RateLimitMiddleware
+from .utils.metrics import metrics, MetricsMiddleware, instrument_engine
 from models import CustomerCreate, Customer
 
-app = FastAPI(lifespan= create_all_tables)
+# orjson serializes every JSON response, hot endpoints also skip response_model revalidation
+app = FastAPI(lifespan= check_database_schema, default_response_class=ORJSONResponse)
 security = HTTPBasic()
 
+# Token buckets per IP, route and account, checked before the body is read
+app.add_middleware(RateLimitMiddleware)
+# Per-route latency, status code, in-flight and DB query metrics, served at /metrics
+app.add_middleware(MetricsMiddleware)
+for instrumented_engine in (engine, read_engine, async_engine.sync_engine, async_read_engine.sync_engine):
+    instrument_engine(instrumented_engine)
+metrics.collectors.append(cache.prometheus_lines)
+metrics.collectors.append(idempotency_store.prometheus_lines)
+metrics.collectors.append(transaction_writer.prometheus_lines)
+metrics.collectors.append(rate_limiter.prometheus_lines)
+
 app.include_router(customers.router, tags=['customers'])
 app.include_router(billing.router, tags=["billing"]) 
 app.include_router(plans.router, tags=["plans"])
+app.include_router(analytics.router, tags=["analytics"])
 
 
 # Endpoint to authenticate the user using HTTP Basic Authentication
@@ -32,25 +50,16 @@ async def root(credentials: Annotated[HTTPBasicCredentials, Depends(security)]):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
 
-@app.middleware("http")
-async def log_request_time(request: Request, call_next):
-    star_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - star_time
-    print(f"Request: {request.url} completed in: {process_time:.4f} seconds")
-    return response
-
-
-@app.middleware("http")
-async def log_request_headers(request: Request, call_next):
-    # Print all headers
-    print("Headers received:")
-    for name, value in request.headers.items():
-        print(f"{name}: {value}")
+# Endpoint to expose read-through cache hit and miss counters
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return cache.stats()
 
-    response = await call_next(request)
-    return response
 
+# Endpoint to expose request, DB and cache metrics in Prometheus text format
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render()
 
 
 # Dictionary mapping ISO country codes to timezone strings
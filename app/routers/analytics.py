@@ -0,0 +1,115 @@
+# ./app/routers/analytics.py
+
+# Importing External Modules
+from datetime import date
+from fastapi import APIRouter, Query
+from fastapi.responses import ORJSONResponse
+from sqlmodel import select, func
+
+# Importing Internal Modules
+from models import (
+    RevenueDaily,
+    RevenueDayTotal,
+    RevenueMonthTotal,
+    RevenueGroupByEnum,
+    CurrentCustomerPlan,
+    Plan,
+    StatusEnum
+)
+from db import AsyncSessionDep
+
+router = APIRouter()
+
+# Transactions don't reference a plan, so plan groups can overlap
+PLAN_ATTRIBUTION_NOTE = (
+    "Each customer's revenue in the range, including revenue from before they subscribed, "
+    "counts towards every plan the customer is active on now. Plan totals can overlap and "
+    "add up to more than the total revenue."
+)
+
+
+def is_month_start(day: date | None) -> bool:
+    return day is None or day.day == 1
+
+
+# Endpoint to report revenue per day, month, customer or plan from the revenue rollups
+@router.get("/analytics/revenue")
+async def get_revenue(
+    session: AsyncSessionDep,
+    group_by: RevenueGroupByEnum = Query(
+        RevenueGroupByEnum.DAY,
+        description="Bucket revenue by day, month, customer or plan. Plan groups count a customer's "
+        "whole revenue towards every plan they are active on now, see the response note"
+    ),
+    start: date | None = Query(None, description="First UTC day included"),
+    end: date | None = Query(None, description="First UTC day excluded"),
+    customer_id: int | None = Query(None, description="Only count this customer's transactions"),
+    limit: int = Query(1000, ge=1, le=10000, description="Number of groups to return")
+):
+    # Never reads the transaction table. Day and month reports over every customer read
+    # one row per bucket, customer filters and groups read revenue_daily (customer and day)
+    if customer_id is None and group_by == RevenueGroupByEnum.MONTH and is_month_start(start) and is_month_start(end):
+        rollup = RevenueMonthTotal
+    elif customer_id is None and group_by in (RevenueGroupByEnum.DAY, RevenueGroupByEnum.MONTH):
+        rollup = RevenueDayTotal
+    else:
+        rollup = RevenueDaily
+
+    revenue = func.sum(rollup.total)
+    transaction_count = func.sum(rollup.transaction_count)
+    if group_by == RevenueGroupByEnum.DAY:
+        keys = [rollup.day]
+        order_by = [rollup.day]
+    elif group_by == RevenueGroupByEnum.MONTH:
+        keys = [rollup.month]
+        order_by = [rollup.month]
+    elif group_by == RevenueGroupByEnum.CUSTOMER:
+        keys = [RevenueDaily.customer_id]
+        order_by = [revenue.desc(), RevenueDaily.customer_id]
+    else:
+        keys = [CurrentCustomerPlan.plan_id, Plan.name]
+        order_by = [revenue.desc(), CurrentCustomerPlan.plan_id]
+
+    query = select(*keys, revenue, transaction_count).group_by(*keys).order_by(*order_by).limit(limit)
+    if group_by == RevenueGroupByEnum.PLAN:
+        query = (
+            query
+            .join(CurrentCustomerPlan, CurrentCustomerPlan.customer_id == RevenueDaily.customer_id)
+            .join(Plan, Plan.id == CurrentCustomerPlan.plan_id)
+            .where(CurrentCustomerPlan.status == StatusEnum.ACTIVE)
+        )
+    if rollup is RevenueMonthTotal:
+        # Both bounds fall on the first of a month, compare "YYYY-MM" keys
+        if start is not None:
+            query = query.where(RevenueMonthTotal.month >= start.strftime("%Y-%m"))
+        if end is not None:
+            query = query.where(RevenueMonthTotal.month < end.strftime("%Y-%m"))
+    else:
+        if start is not None:
+            query = query.where(rollup.day >= start)
+        if end is not None:
+            query = query.where(rollup.day < end)
+    if customer_id is not None:
+        query = query.where(RevenueDaily.customer_id == customer_id)
+    rows = (await session.exec(query)).all()
+
+    if group_by == RevenueGroupByEnum.PLAN:
+        items = [
+            {"plan_id": plan_id, "plan_name": plan_name, "revenue": total, "transaction_count": count}
+            for plan_id, plan_name, total, count in rows
+        ]
+    else:
+        key_name = "customer_id" if group_by == RevenueGroupByEnum.CUSTOMER else group_by.value
+        items = [
+            {key_name: key, "revenue": total, "transaction_count": count}
+            for key, total, count in rows
+        ]
+    response = {
+        "group_by": group_by,
+        "start": start,
+        "end": end,
+        "items": items
+    }
+    if group_by == RevenueGroupByEnum.PLAN:
+        response["note"] = PLAN_ATTRIBUTION_NOTE
+    return ORJSONResponse(response)
@@ -1,53 +1,473 @@
 # ./app/routers/billing.py
 
 # Importing External Modules
-from fastapi import APIRouter, HTTPException, status, Query
-from sqlmodel import select
+import orjson
+import time
+from datetime import datetime
+from itertools import takewhile
+from fastapi import APIRouter, HTTPException, status, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlmodel import select, func, insert, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 # Importing Internal Modules
-from models import Transaction, Invoice, TransactionCreate, Customer
-from db import SessionDep
+from models import (
+    ArchiveSegment,
+    Transaction,
+    Invoice,
+    TransactionCreate,
+    TransactionCreateRow,
+    Customer,
+    CustomerBalance,
+    CountModeEnum,
+    ExportFormatEnum,
+    utc_now
+)
+from db import AsyncReadSessionDep, AsyncSessionDep
+from app.utils.archive import (
+    archived_customer_totals,
+    count_archived_transactions,
+    iter_archived_customer_rows,
+    iter_archived_rows,
+    load_segments,
+    merge_by_id,
+    newest_customer_rows,
+    page_transactions
+)
+from app.utils.balances import apply_transaction_aggregates
+from app.utils.cache import get_customer_cached
+from app.utils.group_commit import TRANSACTION_GROUP_COMMIT, transaction_writer
+from app.utils.idempotency import IdempotencyKeyHeader, run_idempotent
+from app.utils.streaming import export_response, merge_partitions
+from app.utils.utils import iter_request_records, iter_chunks, to_utc_naive
 
 router = APIRouter()
 
+# Rows validated and inserted per executemany batch in the bulk endpoint
+BULK_CHUNK_SIZE = 5000
+# Per-row errors returned in a bulk response, the rest are only counted
+BULK_MAX_ERRORS = 1000
+# Validates bulk rows straight into dicts, no model instance per row
+transaction_row_adapter = TypeAdapter(TransactionCreateRow)
+# Rows fetched per round trip while streaming invoice line items
+INVOICE_FETCH_SIZE = 1000
+# Columns of a transaction list item, in select order
+TRANSACTION_LIST_FIELDS = ("id", "customer_id", "description", "ammount", "created_at")
+
+# Seconds a cached COUNT(*) of the transaction table stays valid
+TRANSACTION_COUNT_TTL = 5.0
+_transaction_count_cache = {"value": None, "expires_at": 0.0}
+
+
+async def count_transactions(session, mode: CountModeEnum) -> int | None:
+    """
+    Returns the total number of transactions using the requested strategy.
+    `exact` runs COUNT(*), `cached` reuses a COUNT(*) for a few seconds and
+    `estimated` reads MAX(id), which is an index lookup instead of a scan.
+    Archived transactions are added from the segment manifest.
+    """
+    if mode == CountModeEnum.NONE:
+        return None
+    if mode == CountModeEnum.ESTIMATED:
+        return (await session.exec(select(func.max(Transaction.id)))).one() or 0
+    if mode == CountModeEnum.CACHED:
+        now = time.monotonic()
+        if _transaction_count_cache["value"] is not None and now < _transaction_count_cache["expires_at"]:
+            return _transaction_count_cache["value"]
+    total = (await session.exec(select(func.count()).select_from(Transaction))).one()
+    total += await count_archived_transactions(session)
+    _transaction_count_cache["value"] = total
+    _transaction_count_cache["expires_at"] = time.monotonic() + TRANSACTION_COUNT_TTL
+    return total
+
 
 # Endpoint to create a transaction
 @router.post("/transactions", status_code=status.HTTP_201_CREATED)
 async def create_transaction(
     transaction_data: TransactionCreate, 
-    session:SessionDep
+    session: AsyncSessionDep,
+    idempotency_key: IdempotencyKeyHeader = None
 ):
     transaction_data_dict = transaction_data.model_dump()
-    customer = session.get(Customer, transaction_data_dict.get('customer_id'))
-    if not customer:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, 
-            detal="Customer dosen't exist"
-        )
-    transaction_db = Transaction.model_validate(transaction_data_dict)
-    session.add(transaction_db)
-    session.commit()
-    session.refresh(transaction_db)
-    return transaction_db
+
+    # Group commit shares one commit between many requests, so keyed requests,
+    # whose stored response must commit with the row, keep the direct path
+    if TRANSACTION_GROUP_COMMIT and idempotency_key is None:
+        # The writer checks customers for the whole batch; the request never checks out
+        # a connection, so it can't hold the writer pool while its batch waits to flush
+        transaction = await transaction_writer.submit(session.bind, transaction_data_dict)
+        return ORJSONResponse(transaction, status_code=status.HTTP_201_CREATED)
+
+    async def insert_transaction():
+        customer = await get_customer_cached(session, transaction_data_dict.get('customer_id'))
+        if not customer:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, 
+                detail="Customer dosen't exist"
+            )
+        transaction_db = Transaction.model_validate(transaction_data_dict)
+        session.add(transaction_db)
+        await session.flush()
+        # Balance and revenue rollup are updated in the same commit as the transaction
+        await apply_transaction_aggregates(session, [(
+            transaction_db.customer_id,
+            transaction_db.ammount,
+            transaction_db.id,
+            transaction_db.created_at
+        )])
+        return transaction_db.model_dump()
+
+    # Retries with the same Idempotency-Key get the first response back instead of a duplicate row
+    return await run_idempotent(
+        session,
+        "POST /transactions",
+        idempotency_key,
+        transaction_data_dict,
+        insert_transaction,
+        status.HTTP_201_CREATED
+    )
+
+
+# Endpoint to create many transactions at once from a JSON array or NDJSON stream
+@router.post("/transactions/bulk", status_code=status.HTTP_201_CREATED)
+async def create_transactions_bulk(
+    request: Request,
+    session: AsyncSessionDep,
+    read_session: AsyncReadSessionDep
+):
+    inserted = 0
+    error_count = 0
+    errors = []
+    index = 0
+
+    async for chunk in iter_chunks(iter_request_records(request), BULK_CHUNK_SIZE):
+        chunk_errors = []
+        rows = []
+        for record in chunk:
+            if isinstance(record, ValueError):
+                chunk_errors.append({"index": index, "detail": "Invalid JSON"})
+            else:
+                try:
+                    rows.append((index, transaction_row_adapter.validate_python(record)))
+                except ValidationError as exc:
+                    chunk_errors.append({
+                        "index": index,
+                        "detail": exc.errors(include_url=False, include_context=False, include_input=False)
+                    })
+            index += 1
+
+        # One set-based lookup per chunk instead of one session.get per row, on
+        # the reader pool so no connection is held while the next chunk streams in
+        customer_ids = {row["customer_id"] for _, row in rows}
+        existing_ids = set((await read_session.exec(
+            select(Customer.id).where(Customer.id.in_(customer_ids))
+        )).all()) if customer_ids else set()
+        await read_session.close()
+
+        values = []
+        for row_index, row in rows:
+            if row["customer_id"] in existing_ids:
+                values.append(row)
+            else:
+                chunk_errors.append({"index": row_index, "detail": "Customer doesn't exist"})
+
+        if values:
+            # One batched INSERT ... RETURNING hands back exactly this chunk's ids in
+            # row order, never rows committed meanwhile by another session
+            created_at = utc_now()
+            for row in values:
+                row["created_at"] = created_at
+            table = Transaction.__table__
+            connection = await session.connection()
+            ids = (await connection.execute(
+                insert(table).returning(table.c.id, sort_by_parameter_order=True), values
+            )).scalars().all()
+            await apply_transaction_aggregates(session, (
+                (row["customer_id"], row["ammount"], transaction_id, created_at)
+                for row, transaction_id in zip(values, ids)
+            ))
+            # Each chunk commits on its own, so the writer isn't held across body reads
+            await session.commit()
+            inserted += len(values)
+
+        chunk_errors.sort(key=lambda error: error["index"])
+        error_count += len(chunk_errors)
+        errors.extend(chunk_errors[:BULK_MAX_ERRORS - len(errors)])
+
+    return {
+        "inserted": inserted,
+        "failed": error_count,
+        "errors": errors
+    }
 
 
 # Endpoint to list transactions with pagination info
 @router.get("/transactions")
 async def list_transaction(
-    session:SessionDep, 
-    skip: int = Query(0, description="Records to skip"),
-    limit: int= Query(10, description="Number of records to return")
+    session: AsyncSessionDep, 
+    skip: int = Query(0, ge=0, description="Records to skip"),
+    limit: int= Query(10, ge=1, le=1000, description="Number of records to return"),
+    after_id: int | None = Query(None, description="Keyset cursor: return records with id greater than this"),
+    count: CountModeEnum = Query(CountModeEnum.EXACT, description="How to compute total_transactions")
 ):
-    transactions_query = session.exec(select(Transaction))
-    transactions = transactions_query.all()
-    total = len(transactions)
+    # LIMIT/OFFSET (or the keyset cursor) run in the database, never in Python
+    query = select(
+        Transaction.id,
+        Transaction.customer_id,
+        Transaction.description,
+        Transaction.ammount,
+        Transaction.created_at
+    ).order_by(Transaction.id)
+    segments = await load_segments(session)
+    if after_id is not None:
+        rows = (await session.exec(query.where(Transaction.id > after_id).limit(limit))).all()
+        if segments:
+            # Archived transactions live in the segment files, each tier stops at `limit` rows
+            rows = merge_by_id(rows, iter_archived_rows(segments, after_id), limit)
+    elif segments:
+        # The offset is split between the tiers using the segment manifest
+        rows = await page_transactions(session, query, segments, skip, limit)
+    else:
+        rows = (await session.exec(query.offset(skip).limit(limit))).all()
 
-    paginated_transactions = transactions[skip:skip + limit]
+    next_after_id = rows[-1][0] if len(rows) == limit else None
 
-    return {
-        "items": paginated_transactions,
-        "total_transactions": total
+    # Row tuples go straight to orjson, which also encodes the datetimes
+    return ORJSONResponse({
+        "items": [dict(zip(TRANSACTION_LIST_FIELDS, row)) for row in rows],
+        "total_transactions": await count_transactions(session, count),
+        "next_after_id": next_after_id
+    })
+
+
+async def transaction_id_bound(session, segments: list[ArchiveSegment]) -> int:
+    """
+    Returns the highest transaction id in either tier. Rows up to it never
+    change again, they only move from the table into archive segments, so
+    a response pinned to it stays consistent however long it streams.
+    """
+    hot_max_id = (await session.exec(select(func.max(Transaction.id)))).one()
+    return max([hot_max_id or 0] + [segment.max_id for segment in segments])
+
+
+def up_to_id(rows, max_id: int):
+    # Archived rows come in id order, so the first one past the bound ends them
+    return takewhile(lambda row: row[0] <= max_id, rows)
+
+
+# Endpoint to stream every transaction as NDJSON or CSV with constant memory
+@router.get("/transactions/export")
+async def export_transactions(
+    session: AsyncSessionDep,
+    format: ExportFormatEnum = Query(ExportFormatEnum.NDJSON)
+):
+    columns = list(TRANSACTION_LIST_FIELDS)
+    max_id = await transaction_id_bound(session, await load_segments(session))
+    query = (
+        select(*(getattr(Transaction, field) for field in columns))
+        .where(Transaction.id <= max_id)
+        .order_by(Transaction.id)
+    )
+
+    async def load_archived_rows(stream_session):
+        return up_to_id(iter_archived_rows(await load_segments(stream_session)), max_id)
+
+    return export_response(session.bind, query, columns, format, "transactions", load_archived_rows)
+
+
+# Endpoint to get a customer's running balance without summing its transactions
+@router.get("/customers/{customer_id}/balance")
+async def get_customer_balance(customer_id: int, session: AsyncSessionDep):
+    balance = await session.get(CustomerBalance, customer_id)
+    if balance is None:
+        if not await get_customer_cached(session, customer_id):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
+        balance = CustomerBalance(customer_id=customer_id)
+    return balance
+
+
+def parse_transaction_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, transaction_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(transaction_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+# Endpoint to list a customer's transactions, newest first, with keyset pagination
+@router.get("/customers/{customer_id}/transactions")
+async def list_customer_transactions(
+    customer_id: int,
+    session: AsyncSessionDep,
+    start: datetime | None = Query(None, description="Only transactions created at or after this time"),
+    end: datetime | None = Query(None, description="Only transactions created before this time"),
+    min_ammount: int | None = Query(None, description="Minimum amount, inclusive"),
+    max_ammount: int | None = Query(None, description="Maximum amount, inclusive"),
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(50, ge=1, le=1000, description="Number of records to return")
+):
+    if not await get_customer_cached(session, customer_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
+
+    # The customer, time range and cursor seek the (customer_id, created_at, id, ammount)
+    # index in order and amount filters are tested on the index entry, so only matching
+    # rows are read from the table for their description
+    query = (
+        select(Transaction.id, Transaction.description, Transaction.ammount, Transaction.created_at)
+        .where(Transaction.customer_id == customer_id)
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(limit)
+    )
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    if start is not None:
+        query = query.where(Transaction.created_at >= start)
+    if end is not None:
+        query = query.where(Transaction.created_at < end)
+    if min_ammount is not None:
+        query = query.where(Transaction.ammount >= min_ammount)
+    if max_ammount is not None:
+        query = query.where(Transaction.ammount <= max_ammount)
+    if cursor is not None:
+        query = query.where(
+            tuple_(Transaction.created_at, Transaction.id) < tuple_(*parse_transaction_cursor(cursor))
+        )
+    rows = (await session.exec(query)).all()
+
+    segments = await load_segments(session)
+    if segments:
+        # Archived segments contribute at most `limit` rows, and none once a full
+        # hot page is newer than everything they hold
+        archived = [
+            (transaction_id, description, ammount, created_at)
+            for transaction_id, _, description, ammount, created_at in newest_customer_rows(
+                segments,
+                customer_id,
+                limit,
+                start,
+                end,
+                before=parse_transaction_cursor(cursor) if cursor is not None else None,
+                keep=lambda row: (min_ammount is None or row[3] >= min_ammount)
+                and (max_ammount is None or row[3] <= max_ammount),
+                floor=(rows[-1][3], rows[-1][0]) if len(rows) == limit else None
+            )
+        ]
+        if archived:
+            rows = sorted(
+                [*rows, *archived], key=lambda row: (row[3], row[0]), reverse=True
+            )[:limit]
+
+    next_cursor = None
+    if len(rows) == limit:
+        last_id, _, _, last_created_at = rows[-1]
+        next_cursor = f"{last_created_at.isoformat()}_{last_id}"
+
+    return ORJSONResponse({
+        "items": [
+            {"id": transaction_id, "description": description, "ammount": ammount, "created_at": created_at}
+            for transaction_id, description, ammount, created_at in rows
+        ],
+        "next_cursor": next_cursor
+    })
+
+
+async def stream_invoice(bind, header: dict, filters: list, load_archived_rows=None):
+    """
+    Writes the invoice header and then its line items as they are fetched in
+    INVOICE_FETCH_SIZE chunks, so memory stays flat however many transactions
+    the invoice covers. `load_archived_rows(session)` adds line items from
+    archive segments in id order, loaded once the query has started so rows
+    archived meanwhile are merged once instead of lost. Uses its own session
+    because the request session is closed before the response body is sent.
+    """
+    yield orjson.dumps(header)[:-1] + b',"transactions":['
+    query = (
+        select(Transaction.id, Transaction.description, Transaction.ammount, Transaction.created_at)
+        .where(*filters)
+        .order_by(Transaction.id)
+        .execution_options(yield_per=INVOICE_FETCH_SIZE)
+    )
+    async with AsyncSession(bind) as session:
+        result = await session.stream(query)
+        partitions = result.partitions()
+        if load_archived_rows is not None:
+            partitions = merge_partitions(partitions, iter(await load_archived_rows(session)))
+        separator = b""
+        async for partition in partitions:
+            if not partition:
+                continue
+            items = [
+                orjson.dumps({
+                    "id": transaction_id,
+                    "description": description,
+                    "ammount": ammount,
+                    "created_at": created_at
+                })
+                for transaction_id, description, ammount, created_at in partition
+            ]
+            yield separator + b",".join(items)
+            separator = b","
+    yield b"]}"
+
+
+# Endpoint to build an invoice for a customer and date range on the server
+@router.get("/customers/{customer_id}/invoice")
+async def generate_invoice(
+    customer_id: int,
+    session: AsyncSessionDep,
+    start: datetime | None = Query(None, description="Include transactions created at or after this time"),
+    end: datetime | None = Query(None, description="Include transactions created before this time")
+):
+    customer = await get_customer_cached(session, customer_id)
+    if not customer:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
+
+    start, end = to_utc_naive(start), to_utc_naive(end)
+    filters = [Transaction.customer_id == customer_id]
+    if start is not None:
+        filters.append(Transaction.created_at >= start)
+    if end is not None:
+        filters.append(Transaction.created_at < end)
+
+    # Totals are aggregated by the database, never by summing rows in Python. Every
+    # number is pinned to the ids that exist now, and if an archive run commits while
+    # the table is read (moving rows into a segment not in the list yet) it is read again
+    segments = await load_segments(session)
+    while True:
+        max_id = await transaction_id_bound(session, segments)
+        total, transaction_count = (await session.exec(
+            select(func.coalesce(func.sum(Transaction.ammount), 0), func.count())
+            .where(*filters, Transaction.id <= max_id)
+        )).one()
+        current_segments = await load_segments(session)
+        if [segment.name for segment in current_segments] == [segment.name for segment in segments]:
+            break
+        segments = current_segments
+    if segments:
+        # Whole segments inside the range are answered from their headers
+        archived_total, archived_count = archived_customer_totals(segments, customer_id, start, end)
+        total += archived_total
+        transaction_count += archived_count
+    filters.append(Transaction.id <= max_id)
+
+    async def load_archived_rows(stream_session):
+        return (
+            (transaction_id, description, ammount, created_at)
+            for transaction_id, _, description, ammount, created_at
+            in up_to_id(iter_archived_customer_rows(await load_segments(stream_session), customer_id, start, end), max_id)
+        )
+
+    header = {
+        "customer": {"id": customer["id"], "name": customer["name"], "email": customer["email"]},
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+        "total": total,
+        "transaction_count": transaction_count
     }
+    return StreamingResponse(
+        stream_invoice(session.bind, header, filters, load_archived_rows),
+        media_type="application/json"
+    )
 
 
 # Endpoint to create an invoice
@@ -1,115 +1,261 @@
 # ./app/routers/customers.py
 
 # Importing External Modules
-from fastapi import APIRouter, status, HTTPException, Query, Depends
-from sqlmodel import select
+from fastapi import APIRouter, status, HTTPException, Query, Depends, Request
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlmodel import select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 # Importing Internal Modules
 from models import (
     Customer,
     CustomerCreate,
+    CustomerPublic,
+    CUSTOMER_PUBLIC_FIELDS,
     CustomerUpdate,
     Plan,
     CustomerPlan,
+    CustomerPlanBatchRow,
+    CurrentCustomerPlan,
     StatusEnum,
-    CustomerLogin
+    CustomerLogin,
+    ExportFormatEnum
 )
-from app.utils.utils import hash_password, verify_password
-from db import SessionDep
+from app.utils.cache import cache, customer_key, get_customer_cached, get_plan_cached
+from app.utils.http_cache import (
+    bump_versions,
+    conditional_headers,
+    customer_plans_version,
+    customer_version,
+    invalidate_versions
+)
+from app.utils.idempotency import IdempotencyKeyHeader, run_idempotent
+from app.utils.ratelimit import rate_limiter, verification_gate
+from app.utils.tokens import TokenClaimsDep, token_signer
+from app.utils.streaming import export_response
+from app.utils.subscriptions import record_plan_status, record_plan_statuses
+from app.utils.utils import iter_chunks, iter_request_records, hash_password_async, verify_password_async, password_needs_rehash
+from db import AsyncReadSessionDep, AsyncSessionDep
 
 router = APIRouter()
 
+EMAIL_CONFLICT_DETAIL = "This email is already registered"
+
+# Subscription changes validated and committed per transaction in the batch endpoint
+SUBSCRIPTION_BATCH_CHUNK_SIZE = 1000
+# Per-item validation errors returned in a batch response, the rest only get a result code
+SUBSCRIPTION_BATCH_MAX_ERRORS = 1000
+customer_plan_row_adapter = TypeAdapter(CustomerPlanBatchRow)
+
+
+async def ensure_email_available(session, email, customer_id=None):
+    """
+    Cheap pre-check on the request's session so a taken email fails before
+    any bcrypt work. The unique index on customer.email remains the source of
+    truth for concurrent inserts, see commit_customer.
+    """
+    query = select(Customer.id).where(Customer.email == email)
+    if customer_id is not None:
+        query = query.where(Customer.id != customer_id)
+    if (await session.exec(query)).first() is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=EMAIL_CONFLICT_DETAIL
+        )
+
+
+def customer_public_response(customer: Customer, status_code: int) -> ORJSONResponse:
+    """
+    Serializes a customer that was just written without revalidating it
+    against the response model.
+    """
+    return ORJSONResponse(
+        customer.model_dump(include=set(CUSTOMER_PUBLIC_FIELDS)),
+        status_code=status_code
+    )
+
+
+async def commit_customer(session, customer):
+    """
+    Commits a new or updated customer and reports a 409 when the unique
+    email index rejects it.
+    """
+    session.add(customer)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=EMAIL_CONFLICT_DETAIL
+        )
+    await session.refresh(customer)
+
 
 # Endpoint para crear un cliente
 @router.post("/customers", 
-             response_model= Customer, 
+             response_model= CustomerPublic, 
              status_code=status.HTTP_201_CREATED
 )
 async def create_customer(
     customer_data: CustomerCreate, 
-    session: SessionDep
+    session: AsyncSessionDep,
+    read_session: AsyncReadSessionDep
 ):
-    hashed_password = hash_password(customer_data.password)
+    # The pre-check runs on the reader pool and is closed before hashing, so
+    # the writer connection isn't held while bcrypt runs
+    await ensure_email_available(read_session, customer_data.email)
+    await read_session.close()
+    hashed_password = await hash_password_async(customer_data.password)
     customer_data_dict = customer_data.model_dump()
     customer_data_dict['password_hash'] = hashed_password
     customer = Customer.model_validate(customer_data_dict)
-    session.add(customer)
-    session.commit()
-    session.refresh(customer)
-    return customer
+    await commit_customer(session, customer)
+    return customer_public_response(customer, status.HTTP_201_CREATED)
 
 
 # Endpoint to list all registered customers
-@router.get("/customers", response_model=list[Customer])
-async def list_customer(session: SessionDep):
-    return session.exec(select(Customer)).all()
+@router.get("/customers", response_model=list[CustomerPublic])
+async def list_customer(session: AsyncSessionDep):
+    # Row tuples go straight to orjson, no model is built or revalidated per customer
+    query = select(*(getattr(Customer, field) for field in CUSTOMER_PUBLIC_FIELDS)).order_by(Customer.id)
+    rows = (await session.exec(query)).all()
+    return ORJSONResponse([dict(zip(CUSTOMER_PUBLIC_FIELDS, row)) for row in rows])
+
+
+# Endpoint to stream every customer as NDJSON or CSV with constant memory
+@router.get("/customers/export")
+async def export_customers(
+    session: AsyncSessionDep,
+    format: ExportFormatEnum = Query(ExportFormatEnum.NDJSON)
+):
+    columns = list(CUSTOMER_PUBLIC_FIELDS)
+    query = select(*(getattr(Customer, field) for field in columns)).order_by(Customer.id)
+    return export_response(session.bind, query, columns, format, "customers")
+
+
+# Endpoint to get the customer that owns the session token
+@router.get("/customers/me", response_model=CustomerPublic)
+async def read_current_customer(claims: TokenClaimsDep, session: AsyncSessionDep):
+    customer = await get_customer_cached(session, claims["sub"])
+    if not customer:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, 
+            detail="Customer not found")
+    return ORJSONResponse(customer)
 
 
 # Endpoint to get a single customer by ID
-@router.get("/customers/{customer_id}", response_model=Customer)
-async def read_customer(customer_id: int, session: SessionDep):
-    customer = session.get(Customer, customer_id)
+@router.get("/customers/{customer_id}", response_model=CustomerPublic)
+async def read_customer(customer_id: int, request: Request, session: AsyncSessionDep):
+    headers, not_modified = await conditional_headers(
+        request, session, customer_version(customer_id), "customer"
+    )
+    customer = await get_customer_cached(session, customer_id)
     if not customer:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Customer not found")
-    return customer
+    if not_modified:
+        return not_modified
+    # The cached dict already holds only public fields
+    return ORJSONResponse(customer, headers=headers)
 
 
 # Endpoint to delete a specific customer by ID
 @router.delete("/customers/{customer_id}")
-async def delete_customer(customer_id: int, session: SessionDep):
-    customer = session.get(Customer, customer_id)
+async def delete_customer(customer_id: int, session: AsyncSessionDep):
+    customer = await session.get(Customer, customer_id)
     if not customer:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Customer not found")
-    session.delete(customer)
-    session.commit()
+    await session.delete(customer)
+    await bump_versions(session, customer_version(customer_id), customer_plans_version(customer_id))
+    await session.commit()
+    await cache.invalidate(customer_key(customer_id))
+    await invalidate_versions(customer_version(customer_id), customer_plans_version(customer_id))
     return {"detal":"ok"}
 
 
 # Endpoint to update an existing customer by ID
 @router.patch(
         "/customers/{customer_id}", 
-        response_model=Customer, 
+        response_model=CustomerPublic, 
         status_code=status.HTTP_201_CREATED, 
         tags=['customers']
 )
 async def update_customer(
     customer_id: int,
     updated_data: CustomerUpdate,
-    session: SessionDep
+    session: AsyncSessionDep
 ):
-    customer = session.get(Customer, customer_id)
+    customer = await session.get(Customer, customer_id)
     if not customer:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Customer not found"
         )
+    if updated_data.email is not None and updated_data.email != customer.email:
+        await ensure_email_available(session, updated_data.email, customer_id)
     # Use sqlmodel_update to update fields in one step
     customer.sqlmodel_update(updated_data.model_dump(exclude_unset=True))
-    session.add(customer)
-    session.commit()
-    session.refresh(customer)
-    return customer
+    await bump_versions(session, customer_version(customer_id))
+    await commit_customer(session, customer)
+    await cache.invalidate(customer_key(customer_id))
+    await invalidate_versions(customer_version(customer_id))
+    return customer_public_response(customer, status.HTTP_201_CREATED)
 
 
 @router.post("/customers/login")
-async def login_customer(login_data: CustomerLogin, session: SessionDep):
-    customer = session.exec(select(Customer).where(Customer.email == login_data.email)).first()
+async def login_customer(
+    login_data: CustomerLogin,
+    session: AsyncSessionDep,
+    read_session: AsyncReadSessionDep
+):
+    # Per-IP and per-route limits already ran in RateLimitMiddleware; the
+    # per-account one needs the body, but still runs before any DB or bcrypt work
+    await rate_limiter.check("login_account", login_data.email.lower())
+    # Looked up on the reader pool and released before bcrypt; the writer is
+    # only checked out for a rehash, after verification
+    customer = (await read_session.exec(select(Customer).where(Customer.email == login_data.email))).first()
+    await read_session.close()
     if not customer:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
-    if not verify_password(login_data.password, customer.password_hash):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid email or password"
-        )
-    return {"message": f"Login successful for {customer.name}"}
+    async with verification_gate.hold(login_data.email.lower()):
+        if not await verify_password_async(login_data.password, customer.password_hash):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid email or password"
+            )
+        # Upgrade hashes created with an outdated cost factor while we know the password
+        if password_needs_rehash(customer.password_hash):
+            password_hash = await hash_password_async(login_data.password)
+            await session.exec(
+                update(Customer).where(Customer.id == customer.id).values(password_hash=password_hash)
+            )
+            await session.commit()
+            await cache.invalidate(customer_key(customer.id))
+    # Later calls send this token instead of the password, so bcrypt runs once per session
+    token, claims = token_signer.issue(customer.id)
+    return {
+        "message": f"Login successful for {customer.name}",
+        "access_token": token,
+        "token_type": "bearer",
+        "expires_in": claims["exp"] - claims["iat"]
+    }
+
+
+# Endpoint to revoke the session token sent with the request
+@router.post("/customers/logout")
+async def logout_customer(claims: TokenClaimsDep):
+    token_signer.revoke(claims)
+    return {"detail": "Logged out"}
 
 
 # Endpoint to subscribe a customer to a plan
@@ -117,60 +263,138 @@ async def login_customer(login_data: CustomerLogin, session: SessionDep):
 async def link_customer_to_plan(
         customer_id: int,
         plan_id: int,
-        session: SessionDep,
-        plan_status:StatusEnum = Query()
+        session: AsyncSessionDep,
+        plan_status:StatusEnum = Query(),
+        idempotency_key: IdempotencyKeyHeader = None
     ):
-    customer_db = session.get(Customer, customer_id)
-    plan_db = session.get(Plan, plan_id)
+    async def subscribe():
+        customer_db = await get_customer_cached(session, customer_id)
+        plan_db = await get_plan_cached(session, plan_id)
+
+        if not customer_db or not plan_db:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                                detail="The customer or plan doesn't exist"
+            )
+        customer_plan_db = await record_plan_status(session, 
+                                                    customer_id,
+                                                    plan_id,
+                                                    plan_status)
+        await bump_versions(session, customer_plans_version(customer_id))
+        return customer_plan_db.model_dump()
+
+    # Retries with the same Idempotency-Key don't append another history row
+    response = await run_idempotent(
+        session,
+        "POST /customers/{customer_id}/plans/{plan_id}",
+        idempotency_key,
+        {"customer_id": customer_id, "plan_id": plan_id, "plan_status": plan_status},
+        subscribe
+    )
+    await invalidate_versions(customer_plans_version(customer_id))
+    return response
 
-    if not customer_db or not plan_db:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                            detail="The customer or plan doesn't exist"
-        )
-    customer_plan_db = CustomerPlan(plan_id=plan_db.id, 
-                                    customer_id=customer_db.id,
-                                    status= plan_status)
 
-    session.add(customer_plan_db)
-    session.commit()
-    session.refresh(customer_plan_db)
-    return customer_plan_db
+# Endpoint to link or change the plan status of many customers from a JSON array or NDJSON stream
+@router.post("/customers/plans/batch", tags=["customers"])
+async def batch_customer_plans(
+    request: Request,
+    session: AsyncSessionDep,
+    read_session: AsyncReadSessionDep
+):
+    # One result code per item, in request order: ok, invalid, customer_not_found or plan_not_found
+    results = []
+    errors = []
+    applied = 0
+
+    async for chunk in iter_chunks(iter_request_records(request), SUBSCRIPTION_BATCH_CHUNK_SIZE):
+        offset = len(results)
+        rows = []
+        for index, record in enumerate(chunk, start=offset):
+            if isinstance(record, ValueError):
+                detail = "Invalid JSON"
+            else:
+                try:
+                    rows.append((index, customer_plan_row_adapter.validate_python(record)))
+                    results.append("ok")
+                    continue
+                except ValidationError as exc:
+                    detail = exc.errors(include_url=False, include_context=False, include_input=False)
+            results.append("invalid")
+            if len(errors) < SUBSCRIPTION_BATCH_MAX_ERRORS:
+                errors.append({"index": index, "detail": detail})
+
+        # Two set-based lookups per chunk instead of two gets per item, on the
+        # reader pool so no connection is held while the next chunk streams in
+        customer_ids = {row["customer_id"] for _, row in rows}
+        plan_ids = {row["plan_id"] for _, row in rows}
+        existing_customers = set((await read_session.exec(
+            select(Customer.id).where(Customer.id.in_(customer_ids))
+        )).all()) if customer_ids else set()
+        existing_plans = set((await read_session.exec(
+            select(Plan.id).where(Plan.id.in_(plan_ids))
+        )).all()) if plan_ids else set()
+        await read_session.close()
+
+        values = []
+        for index, row in rows:
+            if row["customer_id"] not in existing_customers:
+                results[index] = "customer_not_found"
+            elif row["plan_id"] not in existing_plans:
+                results[index] = "plan_not_found"
+            else:
+                values.append(row)
+        if not values:
+            continue
+
+        # Each chunk commits on its own, so a long batch never holds one huge transaction
+        changed = [customer_plans_version(customer_id) for customer_id in {row["customer_id"] for row in values}]
+        await record_plan_statuses(session, values)
+        await bump_versions(session, *changed)
+        await session.commit()
+        await invalidate_versions(*changed)
+        applied += len(values)
+
+    return ORJSONResponse({
+        "applied": applied,
+        "failed": len(results) - applied,
+        "results": results,
+        "errors": errors
+    })
 
 
 # Endpoint to list the current plans for a customer filtered by status
 @router.get("/customers/{customer_id}/plans", tags=["customers"])
 async def get_current_customer_plans(
     customer_id: int,
-    session: SessionDep,
+    request: Request,
+    session: AsyncSessionDep,
     plan_status: StatusEnum = Query(StatusEnum.ACTIVE)  # Default to active
 ):
-
-    customer_db = session.get(Customer, customer_id)
+    headers, not_modified = await conditional_headers(
+        request, session, customer_plans_version(customer_id), "customer_plans"
+    )
+    customer_db = await get_customer_cached(session, customer_id)
     if not customer_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Customer not found")
+    if not_modified:
+        return not_modified
     
-    # Get all CustomerPlan records for this customer
-    query = select(CustomerPlan).where(CustomerPlan.customer_id == customer_id).order_by(CustomerPlan.id.desc())
-    customer_plans = session.exec(query).all()
-
-    # Keep only the latest record for each plan
-    latest_plans = {}
-    for cp in customer_plans:
-        if cp.plan_id not in latest_plans:
-            latest_plans[cp.plan_id] = cp
-
-    result = []
-    for customer_plan in latest_plans.values():
-        if customer_plan.status == plan_status:
-            plan = session.get(Plan, customer_plan.plan_id)
-            if plan:
-                result.append({
-                    "plan_id": plan.id,
-                    "plan_name": plan.name,
-                    "status": customer_plan.status
-                })
-
-    return result
+    # Current state comes from the projection, joined with its plan in one query
+    query = (
+        select(Plan.id, Plan.name, CurrentCustomerPlan.status)
+        .join(CurrentCustomerPlan, CurrentCustomerPlan.plan_id == Plan.id)
+        .where(
+            CurrentCustomerPlan.customer_id == customer_id,
+            CurrentCustomerPlan.status == plan_status
+        )
+        .order_by(CurrentCustomerPlan.customer_plan_id.desc())
+    )
+    rows = (await session.exec(query)).all()
+
+    return ORJSONResponse([
+        {"plan_id": plan_id, "plan_name": plan_name, "status": record_status}
+        for plan_id, plan_name, record_status in rows
+    ], headers=headers)
 
 
 # Endpoint to set the status of a customer's plan (activate or deactivate)
@@ -178,11 +402,11 @@ async def get_current_customer_plans(
 async def set_plan_status_for_customer(
     customer_id: int,
     plan_id: int,
-    session: SessionDep,
+    session: AsyncSessionDep,
     plan_status: StatusEnum = Query()
 ):
-    customer_db = session.get(Customer, customer_id)
-    plan_db = session.get(Plan, plan_id)
+    customer_db = await get_customer_cached(session, customer_id)
+    plan_db = await get_plan_cached(session, plan_id)
 
     if not customer_db or not plan_db:
         raise HTTPException(
@@ -190,30 +414,21 @@ async def set_plan_status_for_customer(
             detail="The customer or plan doesn't exist"
         )
 
-    # Get the latest subscription record for this customer and plan
-    query = select(CustomerPlan).where(
-        CustomerPlan.customer_id == customer_id,
-        CustomerPlan.plan_id == plan_id
-    ).order_by(CustomerPlan.id.desc())
-
-    last_customer_plan = session.exec(query).first()
+    # The projection holds the latest subscription record for this customer and plan
+    current_customer_plan = await session.get(CurrentCustomerPlan, (customer_id, plan_id))
 
-    if not last_customer_plan:
+    if not current_customer_plan:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="This customer is not linked to this plan yet"
         )
 
     # Insert a new record with the new status
-    new_customer_plan = CustomerPlan(
-        customer_id=customer_id,
-        plan_id=plan_id,
-        status=plan_status
-    )
-
-    session.add(new_customer_plan)
-    session.commit()
-    session.refresh(new_customer_plan)
+    new_customer_plan = await record_plan_status(session, customer_id, plan_id, plan_status)
+    await bump_versions(session, customer_plans_version(customer_id))
+    await session.commit()
+    await session.refresh(new_customer_plan)
+    await invalidate_versions(customer_plans_version(customer_id))
 
     return {
         "detail": "Customer plan status updated successfully",
@@ -223,15 +438,15 @@ async def set_plan_status_for_customer(
 
 # Endpoint to get the full history of plan subscriptions for a customer
 @router.get("/customers/{customer_id}/plans/history")
-async def get_customer_plans_history(customer_id: int, session: SessionDep):
-    customer_db = session.get(Customer, customer_id)
+async def get_customer_plans_history(customer_id: int, session: AsyncSessionDep):
+    customer_db = await get_customer_cached(session, customer_id)
     if not customer_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="Customer not found"
         )
     
     query = select(CustomerPlan).where(CustomerPlan.customer_id == customer_id)
-    customer_plans = session.exec(query).all()
+    customer_plans = (await session.exec(query)).all()
 
     history = []
     for record in customer_plans:
@@ -1,26 +1,83 @@
 # ./app/routers/plans.py
 
 # Importing External Modules
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from fastapi.responses import ORJSONResponse
 from sqlmodel import select
 
 # Importing Internal Modules
-from models import Plan
-from db import SessionDep
+from models import Plan, PlanPublic, PLAN_PUBLIC_FIELDS, Customer, CurrentCustomerPlan, StatusEnum
+from db import AsyncSessionDep
+from app.utils.cache import cache, get_plan_cached, plan_key, PLANS_KEY
+from app.utils.http_cache import PLANS_VERSION, bump_versions, conditional_headers, invalidate_versions
 
 router = APIRouter()
 
 
 @router.post("/plans")
-async def create_plan(plan_data:Plan, session: SessionDep):
+async def create_plan(plan_data:Plan, session: AsyncSessionDep):
     plan_db = Plan.model_validate(plan_data.model_dump())
     session.add(plan_db)
-    session.commit()
-    session.refresh(plan_db)
+    await bump_versions(session, PLANS_VERSION)
+    await session.commit()
+    await session.refresh(plan_db)
+    await cache.invalidate(PLANS_KEY, plan_key(plan_db.id))
+    await invalidate_versions(PLANS_VERSION)
     return plan_db
 
 
-@router.get("/plans", response_model=list[Plan])
-async def list_plan(session: SessionDep):
-    plans = session.exec(select(Plan)).all()
-    return plans
+@router.get("/plans", response_model=list[PlanPublic])
+async def list_plan(request: Request, session: AsyncSessionDep):
+    headers, not_modified = await conditional_headers(request, session, PLANS_VERSION, "plans")
+    if not_modified:
+        return not_modified
+
+    async def load_plans():
+        query = select(*(getattr(Plan, field) for field in PLAN_PUBLIC_FIELDS)).order_by(Plan.id)
+        rows = (await session.exec(query)).all()
+        return [dict(zip(PLAN_PUBLIC_FIELDS, row)) for row in rows]
+    # Cached dicts are already in the response shape, skip revalidating them
+    return ORJSONResponse(await cache.get_or_load(PLANS_KEY, load_plans), headers=headers)
+
+
+# Endpoint to get a single plan by ID
+@router.get("/plans/{plan_id}", response_model=PlanPublic)
+async def read_plan(plan_id: int, session: AsyncSessionDep):
+    plan = await get_plan_cached(session, plan_id)
+    if not plan:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Plan not found")
+    return ORJSONResponse(plan)
+
+
+# Endpoint to list the customers currently subscribed to a plan with a given status
+@router.get("/plans/{plan_id}/customers")
+async def list_plan_customers(
+    plan_id: int,
+    session: AsyncSessionDep,
+    plan_status: StatusEnum = Query(StatusEnum.ACTIVE),
+    after_id: int | None = Query(None, description="Return customers with id greater than this"),
+    limit: int = Query(100, ge=1, le=1000, description="Number of records to return")
+):
+    plan_db = await get_plan_cached(session, plan_id)
+    if not plan_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Plan not found")
+
+    # Reads the current_customer_plan projection instead of scanning the history
+    query = (
+        select(Customer.id, Customer.name, Customer.email)
+        .join(CurrentCustomerPlan, CurrentCustomerPlan.customer_id == Customer.id)
+        .where(
+            CurrentCustomerPlan.plan_id == plan_id,
+            CurrentCustomerPlan.status == plan_status
+        )
+        .order_by(Customer.id)
+        .limit(limit)
+    )
+    if after_id is not None:
+        query = query.where(Customer.id > after_id)
+    rows = (await session.exec(query)).all()
+
+    return ORJSONResponse([
+        {"customer_id": customer_id, "name": name, "email": email}
+        for customer_id, name, email in rows
+    ])
@@ -1,5 +1,135 @@
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
 
 def test_client(client):
-    assert type(client) == TestClient
\ No newline at end of file
+    assert type(client) == TestClient
+
+def test_metrics(client):
+    client.get("/plans")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/plans"}' in body
+    assert 'http_responses_total{method="GET",route="/plans",status="200"}' in body
+    assert "db_queries_total" in body
+    assert "cache_misses_total" in body
+
+
+def test_failed_queries_leave_no_timing_behind():
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.exc import IntegrityError
+    from app.utils.metrics import instrument_engine
+
+    engine = create_engine("sqlite://")
+    instrument_engine(engine)
+    with engine.connect() as connection:
+        connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+        connection.execute(text("INSERT INTO item (id) VALUES (1)"))
+        for _ in range(3):
+            with pytest.raises(IntegrityError):
+                connection.execute(text("INSERT INTO item (id) VALUES (1)"))
+        assert connection.info["query_start"] == []
+    engine.dispose()
+
+
+def test_root_rate_limited_per_account(client):
+    credentials = ("indu", "wrong")
+    statuses = [client.get("/", auth=credentials).status_code for _ in range(11)]
+    assert statuses[:10] == [401] * 10
+    assert statuses[10] == 429
+    response = client.get("/", auth=credentials)
+    assert int(response.headers["Retry-After"]) >= 1
+    # Other accounts from the same client still get through until the IP bucket runs out
+    assert client.get("/", auth=("other", "1234")).status_code == 401
+    assert 'rate_limit_requests_total{rule="root_account",result="rejected"} ' in client.get("/metrics").text
+
+
+def test_login_rate_limited_per_account(client):
+    client.post(
+        "/customers",
+        json={"name": "Target", "email": "target@example.com", "age": 40, "password": "secret"},
+    )
+    attempt = {"email": "target@example.com", "password": "guess"}
+    statuses = [client.post("/customers/login", json=attempt).status_code for _ in range(11)]
+    assert statuses == [401] * 10 + [429]
+
+
+def test_token_bucket_stores():
+    import asyncio
+    from app.utils.ratelimit import (
+        ConcurrencyGate, LocalSharedBucketStore, MemoryBucketStore, RateLimitRule
+    )
+
+    rule = RateLimitRule("test", "GET", "/", "ip", 2, 60)
+
+    async def drain(store):
+        return [await store.take("key", rule) for _ in range(3)]
+
+    for store in (MemoryBucketStore(), LocalSharedBucketStore()):
+        first, second, third = asyncio.run(drain(store))
+        assert first == second == 0
+        assert 0 < third <= 30
+
+    # Idle buckets are dropped first once the key limit is reached
+    store = MemoryBucketStore(max_keys=2)
+    fast = RateLimitRule("fast", "GET", "/", "ip", 1, 1e-9)
+
+    async def fill():
+        await store.take("idle", fast)
+        await store.take("busy", rule)
+        await store.take("new", rule)
+        # "busy" kept its bucket: one token left, then it has to wait
+        return [await store.take("busy", rule) for _ in range(2)]
+    second, third = asyncio.run(fill())
+    assert len(store) == 2
+    assert second == 0 and third > 0
+
+    gate = ConcurrencyGate(limit=1)
+
+    async def overlap():
+        async with gate.hold("account"):
+            try:
+                async with gate.hold("account"):
+                    pass
+            except HTTPException as exc:
+                rejected = exc
+            else:
+                raise AssertionError("second verification for the same account was not rejected")
+        # Released slots are reusable
+        async with gate.hold("account"):
+            pass
+        return rejected
+    rejected = asyncio.run(overlap())
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "1"
+
+@pytest.mark.parametrize("backend", ["memory", "local"])
+def test_cache_skips_loads_overlapping_an_invalidation(backend):
+    import asyncio
+    from app.utils.cache import ReadThroughCache, create_backend
+
+    cache = ReadThroughCache(create_backend(backend))
+
+    async def scenario():
+        loading = asyncio.Event()
+        written = asyncio.Event()
+
+        async def stale_load():
+            # Reads the row, then the write commits and invalidates before the load returns
+            loading.set()
+            await written.wait()
+            return {"name": "old"}
+
+        reader = asyncio.create_task(cache.get_or_load("customer:1", stale_load))
+        await loading.wait()
+        await cache.invalidate("customer:1")
+        written.set()
+        assert await reader == {"name": "old"}
+
+        async def fresh_load():
+            return {"name": "new"}
+        return await cache.get_or_load("customer:1", fresh_load)
+
+    assert asyncio.run(scenario()) == {"name": "new"}
@@ -0,0 +1,91 @@
+# app/tests/tests_analytics.py
+
+from datetime import date, timedelta
+
+from fastapi import status
+from sqlmodel import select
+
+
+def create_customer(client, name):
+    return client.post(
+        "/customers",
+        json={
+            "name": name,
+            "email": f"{name.lower()}@example.com",
+            "age": 30,
+            "password": "secret",
+        },
+    ).json()["id"]
+
+
+def test_revenue_rollups(client, session):
+    from app.utils.revenue import rebuild_revenue_daily
+    from models import RevenueDaily, RevenueDayTotal, RevenueMonthTotal, Transaction
+
+    alice = create_customer(client, "Alice")
+    bob = create_customer(client, "Bob")
+    plan_id = client.post(
+        "/plans", json={"name": "Pro", "price": 20, "description": "Pro plan"}
+    ).json()["id"]
+    client.post(f"/customers/{alice}/plans/{plan_id}", params={"plan_status": "active"})
+
+    client.post("/transactions", json={"description": "One", "ammount": 10, "customer_id": alice})
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": "Bulk", "ammount": 5, "customer_id": alice},
+            {"description": "Bulk", "ammount": 7, "customer_id": bob},
+        ],
+    )
+
+    today = session.exec(select(Transaction.created_at)).first().date()
+    response = client.get("/analytics/revenue", params={"group_by": "day"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["items"] == [
+        {"day": today.isoformat(), "revenue": 22, "transaction_count": 3}
+    ]
+
+    items = client.get("/analytics/revenue", params={"group_by": "month"}).json()["items"]
+    assert items == [{"month": today.strftime("%Y-%m"), "revenue": 22, "transaction_count": 3}]
+
+    items = client.get("/analytics/revenue", params={"group_by": "customer"}).json()["items"]
+    assert items == [
+        {"customer_id": alice, "revenue": 15, "transaction_count": 2},
+        {"customer_id": bob, "revenue": 7, "transaction_count": 1},
+    ]
+
+    body = client.get("/analytics/revenue", params={"group_by": "plan"}).json()
+    assert body["items"] == [{"plan_id": plan_id, "plan_name": "Pro", "revenue": 15, "transaction_count": 2}]
+    assert "every plan the customer is active on now" in body["note"]
+
+    # Customer filters read the per customer rollup, mid-month bounds the day totals
+    items = client.get("/analytics/revenue", params={"group_by": "month", "customer_id": bob}).json()["items"]
+    assert items == [{"month": today.strftime("%Y-%m"), "revenue": 7, "transaction_count": 1}]
+    items = client.get(
+        "/analytics/revenue", params={"group_by": "month", "start": today.isoformat()}
+    ).json()["items"]
+    assert items == [{"month": today.strftime("%Y-%m"), "revenue": 22, "transaction_count": 3}]
+
+    tomorrow = today + timedelta(days=1)
+    response = client.get("/analytics/revenue", params={"start": tomorrow.isoformat()})
+    assert response.json()["items"] == []
+
+    # The rollup maintained on insert matches one rebuilt from the transactions
+    def rollups():
+        return (
+            {
+                (row.day, row.customer_id): (row.month, row.total, row.transaction_count)
+                for row in session.exec(select(RevenueDaily)).all()
+            },
+            [(row.day, row.month, row.total, row.transaction_count) for row in session.exec(select(RevenueDayTotal)).all()],
+            [(row.month, row.total, row.transaction_count) for row in session.exec(select(RevenueMonthTotal)).all()],
+        )
+
+    maintained = rollups()
+    assert maintained[1] == [(today, today.strftime("%Y-%m"), 22, 3)]
+    assert maintained[2] == [(today.strftime("%Y-%m"), 22, 3)]
+    assert rebuild_revenue_daily(session) == 2
+    session.expire_all()
+    rebuilt = rollups()
+    assert rebuilt == maintained
+    assert all(isinstance(day, date) for day, _ in rebuilt[0])
@@ -0,0 +1,44 @@
+import asyncio
+
+from app.main import app
+from benchmarks.run import compare_to_baseline, parse_args, run_benchmarks, summarize
+
+
+def test_summarize_percentiles():
+    summary = summarize([0.001 * x for x in range(1, 101)], errors=2, elapsed=2.0)
+    assert summary["requests"] == 100
+    assert summary["errors"] == 2
+    assert summary["rps"] == 50.0
+    assert round(summary["p50_ms"]) == 51
+    assert round(summary["p99_ms"]) == 99
+
+
+def test_compare_to_baseline_flags_regressions():
+    baseline = {"scenarios": {"login": {"p95_ms": 100.0, "rps": 50.0}}}
+    faster = {"scenarios": {"login": {"p95_ms": 110.0, "rps": 45.0}}}
+    slower = {"scenarios": {"login": {"p95_ms": 200.0, "rps": 20.0}}}
+
+    assert compare_to_baseline(faster, baseline, tolerance=0.25) == []
+    assert len(compare_to_baseline(slower, baseline, tolerance=0.25)) == 2
+
+
+def test_benchmark_smoke_run(tmp_path):
+    # Every scenario end to end on a tiny seeded database, login included
+    args = parse_args([
+        "--database", str(tmp_path / "bench.sqlite3"),
+        "--customers", "5",
+        "--plans", "2",
+        "--subscriptions", "5",
+        "--transactions", "60",
+        "--requests", "3",
+        "--login-requests", "2",
+        "--concurrency", "2",
+    ])
+    results = asyncio.run(run_benchmarks(args))
+
+    assert set(results["scenarios"]) == {
+        "list_transactions", "customer_plans", "login", "list_customers", "revenue_by_month", "revenue_by_customer"
+    }
+    assert results["scenarios"]["login"]["requests"] == 2
+    assert all(scenario["errors"] == 0 for scenario in results["scenarios"].values())
+    assert app.dependency_overrides == {}
@@ -1,5 +1,7 @@
 # app/tests/tests_billing.py
 
+import json
+
 from fastapi import status
 
 def test_create_transaction(client):
@@ -10,6 +12,7 @@ def test_create_transaction(client):
             "name": "Test Customer",
             "email": "testcustomer@example.com",
             "age": 30,
+            "password": "secret",
         },
     )
     assert customer_response.status_code == status.HTTP_201_CREATED
@@ -41,3 +44,609 @@ def test_list_transactions(client):
     assert "total_transactions" in response_data
     assert isinstance(response_data["items"], list)
     assert isinstance(response_data["total_transactions"], int)
+
+
+def test_list_transactions_pagination(client):
+    customer_response = client.post(
+        "/customers",
+        json={
+            "name": "Paged Customer",
+            "email": "paged@example.com",
+            "age": 40,
+            "password": "secret",
+        },
+    )
+    assert customer_response.status_code == status.HTTP_201_CREATED
+    customer_id = customer_response.json()["id"]
+
+    for x in range(5):
+        client.post(
+            "/transactions",
+            json={
+                "description": f"Transaction {x}",
+                "ammount": 10 * x,
+                "customer_id": customer_id,
+            },
+        )
+
+    # Offset pagination runs in the database
+    response = client.get("/transactions", params={"skip": 1, "limit": 2})
+    assert response.status_code == status.HTTP_200_OK
+    response_data = response.json()
+    assert response_data["total_transactions"] == 5
+    assert [item["ammount"] for item in response_data["items"]] == [10, 20]
+
+    # Keyset pagination continues from the last id seen
+    next_after_id = response_data["next_after_id"]
+    response = client.get(
+        "/transactions",
+        params={"after_id": next_after_id, "limit": 10, "count": "none"},
+    )
+    response_data = response.json()
+    assert [item["ammount"] for item in response_data["items"]] == [30, 40]
+    assert response_data["total_transactions"] is None
+    assert response_data["next_after_id"] is None
+
+
+def test_create_transactions_bulk(client):
+    customer_response = client.post(
+        "/customers",
+        json={
+            "name": "Bulk Customer",
+            "email": "bulk@example.com",
+            "age": 35,
+            "password": "secret",
+        },
+    )
+    customer_id = customer_response.json()["id"]
+
+    # JSON array body
+    response = client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": "First", "ammount": 10, "customer_id": customer_id},
+            {"description": "Unknown customer", "ammount": 20, "customer_id": 9999},
+            {"description": "Missing amount", "customer_id": customer_id},
+        ],
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    response_data = response.json()
+    assert response_data["inserted"] == 1
+    assert response_data["failed"] == 2
+    assert [error["index"] for error in response_data["errors"]] == [1, 2]
+
+    # Streamed NDJSON body
+    lines = [
+        f'{{"description": "Line {x}", "ammount": {x}, "customer_id": {customer_id}}}'
+        for x in range(3)
+    ]
+    response = client.post(
+        "/transactions/bulk",
+        content="\n".join(lines + ["not json"]),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    response_data = response.json()
+    assert response_data["inserted"] == 3
+    assert response_data["errors"] == [{"index": 3, "detail": "Invalid JSON"}]
+
+    response = client.get("/transactions")
+    assert response.json()["total_transactions"] == 4
+
+
+def test_generate_invoice(client):
+    customer_response = client.post(
+        "/customers",
+        json={
+            "name": "Invoiced Customer",
+            "email": "invoiced@example.com",
+            "age": 50,
+            "password": "secret",
+        },
+    )
+    customer_id = customer_response.json()["id"]
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": f"Item {x}", "ammount": x, "customer_id": customer_id}
+            for x in range(1, 4)
+        ],
+    )
+
+    response = client.get(f"/customers/{customer_id}/invoice")
+    assert response.status_code == status.HTTP_200_OK
+    invoice = response.json()
+    assert invoice["customer"]["id"] == customer_id
+    assert invoice["total"] == 6
+    assert invoice["transaction_count"] == 3
+    assert [item["ammount"] for item in invoice["transactions"]] == [1, 2, 3]
+
+    # A range that ends before the transactions were created is empty
+    response = client.get(
+        f"/customers/{customer_id}/invoice", params={"end": "2000-01-01T00:00:00Z"}
+    )
+    invoice = response.json()
+    assert invoice["total"] == 0
+    assert invoice["transactions"] == []
+
+
+def test_export_transactions(client):
+    customer_response = client.post(
+        "/customers",
+        json={
+            "name": "Exported Customer",
+            "email": "exported@example.com",
+            "age": 28,
+            "password": "secret",
+        },
+    )
+    customer_id = customer_response.json()["id"]
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": f"Item {x}", "ammount": x, "customer_id": customer_id}
+            for x in range(3)
+        ],
+    )
+
+    response = client.get("/transactions/export")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["ammount"] for row in rows] == [0, 1, 2]
+
+    response = client.get("/transactions/export", params={"format": "csv"})
+    lines = response.text.splitlines()
+    assert lines[0] == "id,customer_id,description,ammount,created_at"
+    assert len(lines) == 4
+
+    response = client.get("/customers/export")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert rows[0]["email"] == "exported@example.com"
+    assert "password_hash" not in rows[0]
+
+
+def test_list_customer_transactions(client):
+    customer_ids = []
+    for name in ("Owner", "Other"):
+        response = client.post(
+            "/customers",
+            json={
+                "name": name,
+                "email": f"{name.lower()}@example.com",
+                "age": 30,
+                "password": "secret",
+            },
+        )
+        customer_ids.append(response.json()["id"])
+    owner_id, other_id = customer_ids
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": f"Item {x}", "ammount": x * 10, "customer_id": owner_id}
+            for x in range(1, 6)
+        ] + [{"description": "Not mine", "ammount": 30, "customer_id": other_id}],
+    )
+
+    response = client.get(f"/customers/{owner_id}/transactions", params={"limit": 2})
+    assert response.status_code == status.HTTP_200_OK
+    page = response.json()
+    assert [item["ammount"] for item in page["items"]] == [50, 40]
+
+    response = client.get(
+        f"/customers/{owner_id}/transactions",
+        params={"limit": 2, "cursor": page["next_cursor"]},
+    )
+    assert [item["ammount"] for item in response.json()["items"]] == [30, 20]
+
+    response = client.get(
+        f"/customers/{owner_id}/transactions",
+        params={"min_ammount": 20, "max_ammount": 40},
+    )
+    page = response.json()
+    assert [item["ammount"] for item in page["items"]] == [40, 30, 20]
+    assert page["next_cursor"] is None
+
+    response = client.get(
+        f"/customers/{owner_id}/transactions", params={"end": "2000-01-01T00:00:00Z"}
+    )
+    assert response.json()["items"] == []
+
+    response = client.get(f"/customers/{owner_id}/transactions", params={"cursor": "bad"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_customer_balance(client, session):
+    from sqlmodel import delete
+    from app.utils.balances import reconcile_customer_balances
+    from models import CustomerBalance
+
+    customer_response = client.post(
+        "/customers",
+        json={
+            "name": "Balanced",
+            "email": "balanced@example.com",
+            "age": 45,
+            "password": "secret",
+        },
+    )
+    customer_id = customer_response.json()["id"]
+
+    response = client.get(f"/customers/{customer_id}/balance")
+    assert response.json()["total"] == 0
+
+    client.post(
+        "/transactions",
+        json={"description": "Single", "ammount": 5, "customer_id": customer_id},
+    )
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": f"Item {x}", "ammount": x, "customer_id": customer_id}
+            for x in range(1, 4)
+        ],
+    )
+
+    balance = client.get(f"/customers/{customer_id}/balance").json()
+    assert balance["total"] == 11
+    assert balance["transaction_count"] == 4
+    last_transaction_id = balance["last_transaction_id"]
+    assert last_transaction_id is not None
+
+    # Reconciliation finds nothing to fix, then rebuilds a lost aggregate
+    assert reconcile_customer_balances(session)["drifted"] == 0
+    session.exec(delete(CustomerBalance))
+    session.commit()
+    report = reconcile_customer_balances(session)
+    assert report["drifted"] == 1
+    rebuilt = session.get(CustomerBalance, customer_id)
+    assert (rebuilt.total, rebuilt.transaction_count) == (11, 4)
+    assert rebuilt.last_transaction_id == last_transaction_id
+
+
+def test_create_transaction_unknown_customer(client):
+    response = client.post(
+        "/transactions",
+        json={"description": "Orphan", "ammount": 5, "customer_id": 9999},
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_bulk_row_schema_matches_transaction_create():
+    from models import TransactionCreate, TransactionCreateRow
+
+    assert set(TransactionCreateRow.__annotations__) == set(TransactionCreate.model_fields)
+
+
+def test_create_transaction_idempotency_key(client, session):
+    from sqlmodel import func, select
+    from models import Transaction
+
+    customer_id = client.post(
+        "/customers",
+        json={
+            "name": "Retrying",
+            "email": "retrying@example.com",
+            "age": 33,
+            "password": "secret",
+        },
+    ).json()["id"]
+    payload = {"description": "Charge", "ammount": 7, "customer_id": customer_id}
+    headers = {"Idempotency-Key": "charge-1"}
+
+    first = client.post("/transactions", json=payload, headers=headers)
+    retry = client.post("/transactions", json=payload, headers=headers)
+    assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+    # The stored response also survives a cold in-memory LRU
+    from app.utils.idempotency import idempotency_store
+    idempotency_store.clear()
+    assert client.post("/transactions", json=payload, headers=headers).json() == first.json()
+
+    count = session.exec(select(func.count()).select_from(Transaction)).one()
+    assert count == 1
+    assert client.get(f"/customers/{customer_id}/balance").json()["total"] == 7
+
+    response = client.post(
+        "/transactions", json={**payload, "ammount": 8}, headers=headers
+    )
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_concurrent_idempotent_requests_run_once(client, session):
+    import asyncio
+    import httpx
+    from sqlmodel import select
+    from app.main import app
+    from app.utils.idempotency import idempotency_store
+    from models import CustomerPlan
+
+    customer_id = client.post(
+        "/customers",
+        json={
+            "name": "Concurrent",
+            "email": "concurrent@example.com",
+            "age": 29,
+            "password": "secret",
+        },
+    ).json()["id"]
+    plan_id = client.post(
+        "/plans", json={"name": "Pro", "price": 20, "description": "Pro plan"}
+    ).json()["id"]
+
+    async def subscribe_twice():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(*(
+                async_client.post(
+                    f"/customers/{customer_id}/plans/{plan_id}",
+                    params={"plan_status": "active"},
+                    headers={"Idempotency-Key": "subscribe-1"},
+                )
+                for _ in range(2)
+            ))
+
+    collapsed_before = idempotency_store.collapsed
+    responses = asyncio.run(subscribe_twice())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert responses[0].json() == responses[1].json()
+    assert len(session.exec(select(CustomerPlan)).all()) == 1
+    assert idempotency_store.collapsed == collapsed_before + 1
+
+
+def test_create_transaction_group_commit(pooled_app, monkeypatch):
+    import asyncio
+    import httpx
+    from app.routers import billing
+    from app.utils.group_commit import GroupCommitWriter
+
+    # A cold customer cache on a one-connection writer pool: requests must not hold
+    # the writer connection while their batch waits for the writer task
+    writer = GroupCommitWriter(max_rows=10, max_delay_ms=50, queue_size=15)
+    monkeypatch.setattr(billing, "TRANSACTION_GROUP_COMMIT", True)
+    monkeypatch.setattr(billing, "transaction_writer", writer)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=pooled_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            customer_id = (await client.post(
+                "/customers",
+                json={"name": "Grouped", "email": "grouped@example.com", "age": 52, "password": "secret"},
+            )).json()["id"]
+            responses = await asyncio.gather(*(
+                client.post(
+                    "/transactions",
+                    json={"description": f"Grouped {x}", "ammount": 1, "customer_id": customer_id},
+                )
+                for x in range(20)
+            ))
+            unknown = await client.post(
+                "/transactions", json={"description": "Nobody", "ammount": 1, "customer_id": 999}
+            )
+            balance = (await client.get(f"/customers/{customer_id}/balance")).json()
+            await writer.stop()
+            return responses, unknown, balance
+
+    responses, unknown, balance = asyncio.run(scenario())
+    accepted = [response for response in responses if response.status_code == status.HTTP_201_CREATED]
+    rejected = [response for response in responses if response.status_code != status.HTTP_201_CREATED]
+
+    # Full queue pushes back instead of growing without bound
+    assert rejected and len(accepted) + len(rejected) == 20
+    assert all(response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE for response in rejected)
+    assert rejected[0].headers["Retry-After"] == "1"
+    assert len({response.json()["id"] for response in accepted}) == len(accepted)
+    assert writer.flushed_rows == len(accepted) and writer.rejected == len(rejected)
+    # Many requests share each commit
+    assert writer.flushes < len(accepted)
+    assert unknown.status_code == status.HTTP_404_NOT_FOUND
+    assert (balance["total"], balance["transaction_count"]) == (len(accepted), len(accepted))
+
+
+def test_group_commit_stop_drains_held_row(pooled_app, monkeypatch):
+    import asyncio
+    import httpx
+    from app.routers import billing
+    from app.utils.group_commit import GroupCommitWriter
+
+    # A long delay keeps the first row in the writer's hands, out of the queue
+    writer = GroupCommitWriter(max_rows=10, max_delay_ms=10000)
+    monkeypatch.setattr(billing, "TRANSACTION_GROUP_COMMIT", True)
+    monkeypatch.setattr(billing, "transaction_writer", writer)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=pooled_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            customer_id = (await client.post(
+                "/customers",
+                json={"name": "Draining", "email": "draining@example.com", "age": 52, "password": "secret"},
+            )).json()["id"]
+            request = asyncio.create_task(client.post(
+                "/transactions", json={"description": "Held", "ammount": 3, "customer_id": customer_id}
+            ))
+            while writer.queue is None or not writer.queue.empty() or writer.flushes:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            await asyncio.wait_for(writer.stop(), 5)
+            return await asyncio.wait_for(request, 5)
+
+    response = asyncio.run(scenario())
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["ammount"] == 3
+    assert writer.flushed_rows == 1
+
+
+def test_archived_transactions_stay_visible(client, session, tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from sqlmodel import delete, select, update
+    from app.utils import archive
+    from app.utils.balances import reconcile_customer_balances
+    from app.utils.revenue import rebuild_revenue_daily
+    from models import ArchiveSegment, CustomerBalance, RevenueDaily, Transaction
+
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    # Fewer open segments than segments: lazy readers must keep theirs mapped
+    monkeypatch.setattr(archive, "ARCHIVE_OPEN_SEGMENTS", 1)
+    customer_id = client.post(
+        "/customers",
+        json={"name": "Archived", "email": "archived@example.com", "age": 60, "password": "secret"},
+    ).json()["id"]
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": f"Item {x}", "ammount": x, "customer_id": customer_id}
+            for x in range(1, 8)
+        ],
+    )
+    # The five oldest transactions are backdated past the cutoff
+    old = datetime(2020, 1, 15)
+    session.exec(update(Transaction).where(Transaction.id <= 5).values(created_at=old))
+    session.commit()
+
+    report = archive.archive_transactions(session, datetime(2021, 1, 1), segment_rows=2)
+    assert report == {"segments": 3, "archived": 5, "orphans_removed": 0}
+    assert session.exec(select(Transaction.id).order_by(Transaction.id)).all() == [6, 7]
+    assert session.exec(select(ArchiveSegment.row_count)).all() == [2, 2, 1]
+
+    listing = client.get("/transactions", params={"limit": 4, "skip": 2}).json()
+    assert [item["id"] for item in listing["items"]] == [3, 4, 5, 6]
+    assert listing["total_transactions"] == 7
+    page = client.get("/transactions", params={"after_id": 4, "limit": 10}).json()
+    assert [item["id"] for item in page["items"]] == [5, 6, 7]
+    assert page["items"][0]["created_at"] == old.isoformat()
+
+    lines = client.get("/transactions/export").text.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == list(range(1, 8))
+
+    invoice = client.get(f"/customers/{customer_id}/invoice", params={"end": "2020-02-01T00:00:00"}).json()
+    assert (invoice["total"], invoice["transaction_count"]) == (15, 5)
+    assert [item["id"] for item in invoice["transactions"]] == [1, 2, 3, 4, 5]
+    invoice = client.get(f"/customers/{customer_id}/invoice").json()
+    assert (invoice["total"], invoice["transaction_count"]) == (28, 7)
+
+    history = client.get(f"/customers/{customer_id}/transactions", params={"limit": 4}).json()
+    assert [item["id"] for item in history["items"]] == [7, 6, 5, 4]
+    history = client.get(
+        f"/customers/{customer_id}/transactions", params={"cursor": history["next_cursor"], "min_ammount": 2}
+    ).json()
+    assert [item["id"] for item in history["items"]] == [3, 2]
+
+    # Balances and the revenue rollup rebuild from both tiers
+    session.exec(delete(CustomerBalance))
+    session.commit()
+    reconcile_customer_balances(session)
+    balance = session.get(CustomerBalance, customer_id)
+    assert (balance.total, balance.transaction_count, balance.last_transaction_id) == (28, 7, 7)
+    rebuild_revenue_daily(session)
+    assert session.exec(
+        select(RevenueDaily.total, RevenueDaily.transaction_count).where(RevenueDaily.month == "2020-01")
+    ).all() == [(15, 5)]
+
+    # A segment file without its manifest row is removed by the next run
+    (tmp_path / "transactions-000000000099-000000000100.seg").write_bytes(b"partial")
+    assert archive.archive_transactions(session, datetime(2021, 1, 1))["orphans_removed"] == 1
+
+
+def test_archived_pages_interleave_with_hot_rows(client, session, tmp_path, monkeypatch):
+    from datetime import datetime
+    from sqlmodel import select, update
+    from app.utils import archive
+    from models import ArchiveSegment, Transaction
+
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    monkeypatch.setattr(archive, "ARCHIVE_OPEN_SEGMENTS", 1)
+    customer_id = client.post(
+        "/customers",
+        json={"name": "Mixed", "email": "mixed@example.com", "age": 33, "password": "secret"},
+    ).json()["id"]
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": f"Item {x}", "ammount": x, "customer_id": customer_id}
+            for x in range(1, 11)
+        ],
+    )
+    # Archived ids 1, 2, 4, 5, 7 sit between hot ids 3, 6, 8, 9, 10
+    archived_ids = [1, 2, 4, 5, 7]
+    session.exec(
+        update(Transaction).where(Transaction.id.in_(archived_ids)).values(created_at=datetime(2020, 1, 15))
+    )
+    session.commit()
+    assert archive.archive_transactions(session, datetime(2021, 1, 1), segment_rows=2)["segments"] == 3
+
+    for skip in range(12):
+        items = client.get("/transactions", params={"skip": skip, "limit": 3}).json()["items"]
+        assert [item["id"] for item in items] == list(range(1, 11))[skip:skip + 3]
+
+    # Newest first across both tiers, a page at a time
+    seen = []
+    params = {"limit": 3}
+    while True:
+        page = client.get(f"/customers/{customer_id}/transactions", params=params).json()
+        seen += [item["id"] for item in page["items"]]
+        if page["next_cursor"] is None:
+            break
+        params["cursor"] = page["next_cursor"]
+    assert seen == [10, 9, 8, 6, 3, 7, 5, 4, 2, 1]
+
+    # A short first page only opens the segment it reads from
+    archive.close_segments()
+    for name in session.exec(select(ArchiveSegment.name).order_by(ArchiveSegment.min_id)).all()[1:]:
+        (tmp_path / name).unlink()
+    items = client.get("/transactions", params={"limit": 2}).json()["items"]
+    assert [item["id"] for item in items] == [1, 2]
+    items = client.get("/transactions", params={"after_id": 1, "limit": 1}).json()["items"]
+    assert [item["id"] for item in items] == [2]
+
+
+def test_invoice_and_export_pin_rows_while_they_move(client, session, tmp_path, monkeypatch):
+    from datetime import datetime
+    from sqlmodel import update
+    from app.routers import billing
+    from app.utils import archive
+    from models import Transaction
+
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path))
+    customer_id = client.post(
+        "/customers",
+        json={"name": "Moving", "email": "moving@example.com", "age": 41, "password": "secret"},
+    ).json()["id"]
+    client.post(
+        "/transactions/bulk",
+        json=[
+            {"description": f"Item {x}", "ammount": x, "customer_id": customer_id}
+            for x in range(1, 5)
+        ],
+    )
+
+    def insert_and_archive(archived_ids):
+        # A transaction arrives and older ones move to a segment after the
+        # handler returned, before its response body is streamed
+        session.add(Transaction(description="Late", ammount=100, customer_id=customer_id))
+        session.exec(
+            update(Transaction).where(Transaction.id.in_(archived_ids)).values(created_at=datetime(2020, 1, 15))
+        )
+        session.commit()
+        archive.archive_transactions(session, datetime(2021, 1, 1))
+
+    stream_invoice = billing.stream_invoice
+
+    def stream_invoice_after_changes(*args):
+        insert_and_archive([1, 2])
+        return stream_invoice(*args)
+
+    monkeypatch.setattr(billing, "stream_invoice", stream_invoice_after_changes)
+    invoice = client.get(f"/customers/{customer_id}/invoice").json()
+    assert (invoice["total"], invoice["transaction_count"]) == (10, 4)
+    assert [item["id"] for item in invoice["transactions"]] == [1, 2, 3, 4]
+
+    export_response = billing.export_response
+
+    def export_response_after_changes(*args):
+        insert_and_archive([3, 4])
+        return export_response(*args)
+
+    monkeypatch.setattr(billing, "export_response", export_response_after_changes)
+    lines = client.get("/transactions/export").text.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [1, 2, 3, 4, 5]
@@ -1,4 +1,5 @@
 from fastapi import status
+from sqlmodel import select
 
 
 def test_create_customer(client):
@@ -8,6 +9,7 @@ def test_create_customer(client):
             "name": "Josefina",
             "email": "jesefina@example.com",
             "age": 82,
+            "password": "secret",
         },
     )
     assert response.status_code == status.HTTP_201_CREATED
@@ -20,10 +22,398 @@ def test_read_customer(client):
             "name": "Josefina",
             "email": "jesefina@example.com",
             "age": 82,
+            "password": "secret",
         },
     )
     assert response.status_code == status.HTTP_201_CREATED
     customer_id: int = response.json()["id"]
     response_read = client.get(f"/customers/{customer_id}")
     assert response_read.status_code == status.HTTP_200_OK
-    assert response_read.json()["name"] == "Josefina"
\ No newline at end of file
+    assert response_read.json()["name"] == "Josefina"
+
+def test_login_rehashes_outdated_password(client, session, monkeypatch):
+    from app.utils import utils
+    from models import Customer
+
+    response = client.post(
+        "/customers",
+        json={
+            "name": "Rehash",
+            "email": "rehash@example.com",
+            "age": 30,
+            "password": "secret",
+        },
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    customer_id = response.json()["id"]
+
+    # Raise the cost factor, the next successful login upgrades the stored hash
+    monkeypatch.setattr(utils, "BCRYPT_ROUNDS", utils.BCRYPT_ROUNDS + 1)
+    response = client.post(
+        "/customers/login",
+        json={"email": "rehash@example.com", "password": "secret"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    customer = session.get(Customer, customer_id)
+    assert not utils.password_needs_rehash(customer.password_hash)
+
+
+def test_login_rejected_when_password_pool_is_saturated(client, monkeypatch):
+    from app.utils import utils
+
+    customer = {"name": "Busy", "email": "busy@example.com", "age": 30, "password": "secret"}
+    assert client.post("/customers", json=customer).status_code == status.HTTP_201_CREATED
+
+    monkeypatch.setattr(utils, "BCRYPT_MAX_PENDING", 0)
+    response = client.post(
+        "/customers/login", json={"email": "busy@example.com", "password": "secret"}
+    )
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == utils.BCRYPT_RETRY_AFTER
+
+    # Sign-ups hash through the same pool
+    response = client.post("/customers", json={**customer, "email": "busier@example.com"})
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+def test_create_customer_duplicate_email(client):
+    customer = {
+        "name": "Josefina",
+        "email": "duplicate@example.com",
+        "age": 82,
+        "password": "secret",
+    }
+    response = client.post("/customers", json=customer)
+    assert response.status_code == status.HTTP_201_CREATED
+    customer_id = response.json()["id"]
+
+    response = client.post("/customers", json=customer)
+    assert response.status_code == status.HTTP_409_CONFLICT
+
+    # Re-sending the customer's own email on update is not a conflict
+    response = client.patch(
+        f"/customers/{customer_id}", json={"email": "duplicate@example.com"}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+
+
+def test_get_current_customer_plans(client):
+    response = client.post(
+        "/customers",
+        json={
+            "name": "Subscriber",
+            "email": "subscriber@example.com",
+            "age": 30,
+            "password": "secret",
+        },
+    )
+    customer_id = response.json()["id"]
+    basic_id = client.post(
+        "/plans", json={"name": "Basic", "price": 10, "description": "Basic plan"}
+    ).json()["id"]
+    premium_id = client.post(
+        "/plans", json={"name": "Premium", "price": 50, "description": "Premium plan"}
+    ).json()["id"]
+
+    client.post(f"/customers/{customer_id}/plans/{basic_id}", params={"plan_status": "active"})
+    client.post(f"/customers/{customer_id}/plans/{premium_id}", params={"plan_status": "active"})
+    # Only the latest record of each plan counts
+    client.patch(
+        f"/customers/{customer_id}/plans/{basic_id}/set", params={"plan_status": "inactive"}
+    )
+
+    response = client.get(f"/customers/{customer_id}/plans")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [
+        {"plan_id": premium_id, "plan_name": "Premium", "status": "active"}
+    ]
+
+    response = client.get(
+        f"/customers/{customer_id}/plans", params={"plan_status": "inactive"}
+    )
+    assert [plan["plan_id"] for plan in response.json()] == [basic_id]
+
+
+def test_current_plan_projection(client, session):
+    from models import CurrentCustomerPlan
+    from app.utils.subscriptions import rebuild_current_customer_plans
+
+    customer_ids = []
+    for name in ("First", "Second"):
+        response = client.post(
+            "/customers",
+            json={
+                "name": name,
+                "email": f"{name.lower()}@example.com",
+                "age": 30,
+                "password": "secret",
+            },
+        )
+        customer_ids.append(response.json()["id"])
+    plan_id = client.post(
+        "/plans", json={"name": "Basic", "price": 10, "description": "Basic plan"}
+    ).json()["id"]
+
+    for customer_id in customer_ids:
+        client.post(f"/customers/{customer_id}/plans/{plan_id}", params={"plan_status": "active"})
+    client.patch(
+        f"/customers/{customer_ids[0]}/plans/{plan_id}/set", params={"plan_status": "inactive"}
+    )
+
+    response = client.get(f"/plans/{plan_id}/customers")
+    assert response.status_code == status.HTTP_200_OK
+    assert [customer["customer_id"] for customer in response.json()] == [customer_ids[1]]
+
+    # Rebuilding from history reproduces the incrementally maintained rows
+    before = {
+        (row.customer_id, row.plan_id): (row.status, row.customer_plan_id)
+        for row in session.exec(select(CurrentCustomerPlan)).all()
+    }
+    assert rebuild_current_customer_plans(session) == 2
+    session.expire_all()
+    after = {
+        (row.customer_id, row.plan_id): (row.status, row.customer_plan_id)
+        for row in session.exec(select(CurrentCustomerPlan)).all()
+    }
+    assert after == before
+
+
+def test_customer_cache_invalidated_on_update(client, cache_backend):
+    response = client.post(
+        "/customers",
+        json={
+            "name": "Cached",
+            "email": "cached@example.com",
+            "age": 30,
+            "password": "secret",
+        },
+    )
+    customer_id = response.json()["id"]
+
+    assert client.get(f"/customers/{customer_id}").json()["name"] == "Cached"
+    stats = client.get("/cache/stats").json()
+    assert client.get(f"/customers/{customer_id}").json()["name"] == "Cached"
+    # One hit for the ETag version counter, one for the customer row
+    assert client.get("/cache/stats").json()["hits"] == stats["hits"] + 2
+
+    client.patch(f"/customers/{customer_id}", json={"name": "Renamed"})
+    assert client.get(f"/customers/{customer_id}").json()["name"] == "Renamed"
+
+    client.delete(f"/customers/{customer_id}")
+    response = client.get(f"/customers/{customer_id}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_customer_responses_omit_password_hash(client):
+    created = client.post(
+        "/customers",
+        json={
+            "name": "Josefina",
+            "email": "jesefina@example.com",
+            "age": 82,
+            "password": "secret",
+        },
+    ).json()
+    expected = {
+        "id": created["id"],
+        "name": "Josefina",
+        "description": None,
+        "email": "jesefina@example.com",
+        "age": 82,
+    }
+    assert created == expected
+    assert client.get(f"/customers/{created['id']}").json() == expected
+    assert client.get("/customers").json() == [expected]
+
+    response = client.patch(f"/customers/{created['id']}", json={"age": 83})
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {**expected, "age": 83}
+
+    schema = client.get("/openapi.json").json()["components"]["schemas"]
+    assert "password_hash" not in schema["CustomerPublic"]["properties"]
+
+
+def test_login_token_authenticates_without_password(client, monkeypatch):
+    from app.utils import tokens
+
+    client.post(
+        "/customers",
+        json={
+            "name": "Token",
+            "email": "token@example.com",
+            "age": 31,
+            "password": "secret",
+        },
+    )
+    login = client.post(
+        "/customers/login", json={"email": "token@example.com", "password": "secret"}
+    ).json()
+    assert login["token_type"] == "bearer"
+    headers = {"Authorization": f"Bearer {login['access_token']}"}
+
+    response = client.get("/customers/me", headers=headers)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["email"] == "token@example.com"
+
+    assert client.get("/customers/me").status_code == status.HTTP_401_UNAUTHORIZED
+    tampered = {"Authorization": f"Bearer {login['access_token'][:-2]}xx"}
+    assert client.get("/customers/me", headers=tampered).status_code == status.HTTP_401_UNAUTHORIZED
+    # Non-ASCII signatures are rejected, not a 500
+    non_ascii = {"Authorization": f"Bearer {tokens.token_signer.active_kid}.e30.\xe9".encode("latin-1")}
+    assert client.get("/customers/me", headers=non_ascii).status_code == status.HTTP_401_UNAUTHORIZED
+
+    # Rotation: tokens signed with a retired-but-listed key still verify
+    signer = tokens.token_signer
+    monkeypatch.setattr(signer, "keys", {"next": b"new-key", **signer.keys})
+    monkeypatch.setattr(signer, "active_kid", "next")
+    assert client.get("/customers/me", headers=headers).status_code == status.HTTP_200_OK
+    assert signer.issue(1)[0].startswith("next.")
+
+    assert client.post("/customers/logout", headers=headers).status_code == status.HTTP_200_OK
+    assert client.get("/customers/me", headers=headers).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_conditional_reads_return_304_until_a_write(client, cache_backend):
+    customer_id = client.post(
+        "/customers",
+        json={
+            "name": "Polling",
+            "email": "polling@example.com",
+            "age": 27,
+            "password": "secret",
+        },
+    ).json()["id"]
+    plan_id = client.post(
+        "/plans", json={"name": "Basic", "price": 10, "description": "Basic plan"}
+    ).json()["id"]
+
+    for url in (f"/customers/{customer_id}", f"/customers/{customer_id}/plans", "/plans"):
+        response = client.get(url)
+        etag = response.headers["ETag"]
+        assert response.headers["Cache-Control"]
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+
+    # Never-written resources don't share an ETag, and missing ones are never "not modified"
+    assert client.get(f"/customers/{customer_id}/plans").headers["ETag"] != client.get("/plans").headers["ETag"]
+    for etag in ('"0"', '"customer:999:0"', "*"):
+        response = client.get("/customers/999", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = client.get("/customers/999/plans", headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    etag = client.get(f"/customers/{customer_id}/plans").headers["ETag"]
+    client.post(f"/customers/{customer_id}/plans/{plan_id}", params={"plan_status": "active"})
+    response = client.get(f"/customers/{customer_id}/plans", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert [plan["plan_id"] for plan in response.json()] == [plan_id]
+
+    etag = client.get(f"/customers/{customer_id}").headers["ETag"]
+    client.patch(f"/customers/{customer_id}", json={"name": "Renamed"})
+    response = client.get(f"/customers/{customer_id}", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["name"] == "Renamed"
+
+    etag = client.get("/plans").headers["ETag"]
+    client.post("/plans", json={"name": "Pro", "price": 20, "description": "Pro plan"})
+    assert client.get("/plans", headers={"If-None-Match": etag}).status_code == status.HTTP_200_OK
+
+
+def test_batch_customer_plans(client, cache_backend, session, monkeypatch):
+    from app.routers import customers
+    from app.utils.subscriptions import rebuild_current_customer_plans
+    from models import CurrentCustomerPlan
+
+    customer_ids = [
+        client.post(
+            "/customers",
+            json={"name": name, "email": f"{name.lower()}@example.com", "age": 30, "password": "secret"},
+        ).json()["id"]
+        for name in ("Batch", "Other")
+    ]
+    plan_id = client.post(
+        "/plans", json={"name": "Basic", "price": 10, "description": "Basic plan"}
+    ).json()["id"]
+    # Cached before the batch, so its ETag must change afterwards
+    etag = client.get(f"/customers/{customer_ids[0]}/plans").headers["etag"]
+
+    monkeypatch.setattr(customers, "SUBSCRIPTION_BATCH_CHUNK_SIZE", 2)
+    response = client.post(
+        "/customers/plans/batch",
+        json=[
+            {"customer_id": customer_ids[0], "plan_id": plan_id, "status": "active"},
+            {"customer_id": customer_ids[1], "plan_id": plan_id, "status": "active"},
+            {"customer_id": 999, "plan_id": plan_id, "status": "active"},
+            {"customer_id": customer_ids[0], "plan_id": 999, "status": "active"},
+            {"customer_id": customer_ids[0], "plan_id": plan_id, "status": "paused"},
+            {"customer_id": customer_ids[0], "plan_id": plan_id, "status": "inactive"},
+        ],
+    )
+    assert response.status_code == status.HTTP_200_OK
+    summary = response.json()
+    assert summary["applied"] == 3
+    assert summary["failed"] == 3
+    assert summary["results"] == ["ok", "ok", "customer_not_found", "plan_not_found", "invalid", "ok"]
+    assert [error["index"] for error in summary["errors"]] == [4]
+
+    response = client.get(f"/customers/{customer_ids[0]}/plans", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+    assert [row["customer_id"] for row in client.get(f"/plans/{plan_id}/customers").json()] == [customer_ids[1]]
+    history = client.get(f"/customers/{customer_ids[0]}/plans/history").json()
+    assert [record["status"] for record in history] == ["active", "inactive"]
+
+    # NDJSON bodies work too, and the projection matches a rebuild from history
+    response = client.post(
+        "/customers/plans/batch",
+        content=f'{{"customer_id": {customer_ids[0]}, "plan_id": {plan_id}, "status": "active"}}\nnot json\n',
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.json()["results"] == ["ok", "invalid"]
+    before = {
+        (row.customer_id, row.plan_id): (row.status, row.customer_plan_id)
+        for row in session.exec(select(CurrentCustomerPlan)).all()
+    }
+    rebuild_current_customer_plans(session)
+    session.expire_all()
+    assert before == {
+        (row.customer_id, row.plan_id): (row.status, row.customer_plan_id)
+        for row in session.exec(select(CurrentCustomerPlan)).all()
+    }
+
+
+def test_login_releases_writer_during_bcrypt(pooled_app, monkeypatch):
+    import asyncio
+    import httpx
+    from app.routers import customers
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=pooled_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post(
+                "/customers",
+                json={"name": "Slow", "email": "slow@example.com", "age": 30, "password": "secret"},
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
+            verifying = asyncio.Event()
+            release = asyncio.Event()
+
+            async def slow_verify(plain_password, hashed_password):
+                verifying.set()
+                await release.wait()
+                return True
+            monkeypatch.setattr(customers, "verify_password_async", slow_verify)
+
+            login = asyncio.create_task(client.post(
+                "/customers/login", json={"email": "slow@example.com", "password": "secret"}
+            ))
+            await verifying.wait()
+            # The only writer connection must be free while bcrypt runs
+            plan = await client.post("/plans", json={"name": "Basic", "price": 10, "description": "Basic"})
+            assert plan.status_code == status.HTTP_200_OK
+            release.set()
+            assert (await login).status_code == status.HTTP_200_OK
+
+    asyncio.run(scenario())
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from db import create_database_engine
+
+
+def test_sqlite_engines_are_tuned(tmp_path):
+    url = f"sqlite:///{tmp_path / 'tuned.sqlite3'}"
+    writer = create_database_engine(url, pool_size=1)
+    reader = create_database_engine(url, pool_size=2, read_only=True)
+
+    with writer.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        # NORMAL
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+        connection.commit()
+
+    with reader.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM item")).scalar() == 0
+        with pytest.raises(OperationalError):
+            connection.execute(text("INSERT INTO item (id) VALUES (1)"))
+
+    writer.dispose()
+    reader.dispose()
+
+
+def test_migrations_are_idempotent(tmp_path):
+    from migrations import LATEST_VERSION, check_schema_version, get_schema_version, migrate
+
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'fresh.sqlite3'}", pool_size=1)
+    with pytest.raises(RuntimeError):
+        check_schema_version(engine)
+
+    assert migrate(engine)[-1] == LATEST_VERSION
+    assert migrate(engine) == []
+    check_schema_version(engine)
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == LATEST_VERSION
+    engine.dispose()
+
+
+def test_migrations_upgrade_baseline_schema(tmp_path):
+    from sqlalchemy import inspect
+    from migrations import migrate
+
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'baseline.sqlite3'}", pool_size=1)
+    # Tables as created by the original create_all, without indexes or created_at
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE customer (id INTEGER PRIMARY KEY, name VARCHAR, description VARCHAR, "
+            "email VARCHAR, age INTEGER, password_hash VARCHAR NOT NULL)"
+        ))
+        connection.execute(text(
+            "CREATE TABLE plan (id INTEGER PRIMARY KEY, name VARCHAR, price INTEGER, description VARCHAR)"
+        ))
+        connection.execute(text(
+            "CREATE TABLE customerplan (id INTEGER PRIMARY KEY, plan_id INTEGER, "
+            "customer_id INTEGER, status VARCHAR(8))"
+        ))
+        connection.execute(text(
+            'CREATE TABLE "transaction" (id INTEGER PRIMARY KEY, ammount INTEGER, '
+            "description VARCHAR, customer_id INTEGER)"
+        ))
+        connection.execute(text(
+            "INSERT INTO customerplan (plan_id, customer_id, status) "
+            "VALUES (1, 1, 'ACTIVE'), (1, 1, 'INACTIVE')"
+        ))
+        connection.execute(text(
+            'INSERT INTO "transaction" (ammount, description, customer_id) VALUES (10, \'old\', 1)'
+        ))
+
+    migrate(engine)
+
+    inspector = inspect(engine)
+    assert {index["name"] for index in inspector.get_indexes("transaction")} == {
+        "ix_transaction_customer_id_created_at_id_ammount"
+    }
+    assert "ix_customer_email" in {index["name"] for index in inspector.get_indexes("customer")}
+    with engine.connect() as connection:
+        assert connection.execute(text('SELECT created_at FROM "transaction"')).scalar() is not None
+        assert connection.execute(text("SELECT status FROM current_customer_plan")).scalar() == "INACTIVE"
+    engine.dispose()
@@ -0,0 +1,21 @@
+from fastapi import status
+
+
+def test_plan_cache_invalidated_on_create(client, cache_backend):
+    response = client.get("/plans")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == []
+
+    plan_id = client.post(
+        "/plans", json={"name": "Basic", "price": 10, "description": "Basic plan"}
+    ).json()["id"]
+
+    response = client.get("/plans")
+    assert [plan["name"] for plan in response.json()] == ["Basic"]
+
+    response = client.get(f"/plans/{plan_id}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["price"] == 10
+
+    response = client.get("/plans/9999")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,528 @@
+# ./app/utils/archive.py
+"""
+Cold storage for old transactions.
+
+`archive_transactions` moves transactions created before a cutoff into
+immutable segment files. A segment holds up to ARCHIVE_SEGMENT_ROWS rows in
+id order, one zlib-compressed column each, behind a JSON header with id,
+customer and date ranges, the amount sum and per-customer summaries:
+
+    TXSEG1\\n | header length (uint32) | header JSON | column blobs
+
+Readers memory-map segments and only decompress the columns they need. The
+archive_segment table is the manifest: a segment file only becomes visible
+when its row commits, in the same transaction that deletes the hot rows, so
+a crash never shows a transaction twice or loses it.
+"""
+
+# Importing External Modules
+import heapq
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import chain, islice
+
+import orjson
+from sqlalchemy import inspect
+from sqlmodel import Session, delete, func, select
+
+# Importing Internal Modules
+from models import ArchiveSegment, Transaction
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_SEGMENT_ROWS = int(os.getenv("ARCHIVE_SEGMENT_ROWS", "100000"))
+# Segments kept open (mapped, with their decoded columns) by each process
+ARCHIVE_OPEN_SEGMENTS = int(os.getenv("ARCHIVE_OPEN_SEGMENTS", "16"))
+ARCHIVE_COMPRESSION_LEVEL = 6
+
+SEGMENT_MAGIC = b"TXSEG1\n"
+SEGMENT_SUFFIX = ".seg"
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Order of the row tuples written to and read from segments
+ARCHIVE_FIELDS = ("id", "customer_id", "description", "ammount", "created_at")
+_INTEGER_COLUMNS = ("id", "customer_id", "ammount", "created_at")
+
+
+def _to_micros(value: datetime) -> int:
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def write_segment(path: str, rows: list[tuple]) -> dict:
+    """
+    Writes rows of ARCHIVE_FIELDS, sorted by id, to a new segment file and
+    returns its header. The file is fsynced under a temporary name and then
+    renamed, so a segment is either complete or absent.
+    """
+    columns = {
+        "id": array("q", (row[0] for row in rows)),
+        "customer_id": array("q", (row[1] for row in rows)),
+        "ammount": array("q", (row[3] for row in rows)),
+        "created_at": array("q", (_to_micros(row[4]) for row in rows)),
+    }
+    blobs = {name: zlib.compress(values.tobytes(), ARCHIVE_COMPRESSION_LEVEL) for name, values in columns.items()}
+    blobs["description"] = zlib.compress(orjson.dumps([row[2] for row in rows]), ARCHIVE_COMPRESSION_LEVEL)
+
+    customers = {}
+    for transaction_id, customer_id, _, ammount, created_at in rows:
+        summary = customers.setdefault(str(customer_id), [0, 0, 0, None])
+        summary[0] += 1
+        summary[1] += ammount
+        # Rows are in id order, so the last one seen is the customer's newest
+        summary[2] = transaction_id
+        summary[3] = created_at.isoformat()
+
+    offset = 0
+    layout = {}
+    for name, blob in blobs.items():
+        layout[name] = [offset, len(blob)]
+        offset += len(blob)
+    created = columns["created_at"]
+    header = {
+        "version": 1,
+        "rows": len(rows),
+        "min_id": rows[0][0],
+        "max_id": rows[-1][0],
+        "min_customer_id": min(columns["customer_id"]),
+        "max_customer_id": max(columns["customer_id"]),
+        "min_created_at": _from_micros(min(created)).isoformat(),
+        "max_created_at": _from_micros(max(created)).isoformat(),
+        "total": sum(columns["ammount"]),
+        # customer_id -> [row count, amount sum, newest id, newest created_at]
+        "customers": customers,
+        "columns": layout,
+    }
+    encoded_header = orjson.dumps(header)
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(SEGMENT_MAGIC)
+        file.write(struct.pack("<I", len(encoded_header)))
+        file.write(encoded_header)
+        for blob in blobs.values():
+            file.write(blob)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+    return header
+
+
+class Segment:
+    """
+    A memory-mapped segment file. Columns are decompressed on first use and
+    kept while the segment stays open. `readers` counts lazy readers that
+    are still iterating it, the cache never closes a segment while they do.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.readers = 0
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a transaction segment")
+        header_start = len(SEGMENT_MAGIC) + 4
+        (header_length,) = struct.unpack("<I", self._map[len(SEGMENT_MAGIC):header_start])
+        self.header = orjson.loads(self._map[header_start:header_start + header_length])
+        self._data_start = header_start + header_length
+        self._columns = {}
+
+    def column(self, name: str):
+        values = self._columns.get(name)
+        if values is None:
+            offset, length = self.header["columns"][name]
+            start = self._data_start + offset
+            raw = zlib.decompress(self._map[start:start + length])
+            if name in _INTEGER_COLUMNS:
+                values = array("q")
+                values.frombytes(raw)
+            else:
+                values = orjson.loads(raw)
+            self._columns[name] = values
+        return values
+
+    def row(self, index: int) -> tuple:
+        return (
+            self.column("id")[index],
+            self.column("customer_id")[index],
+            self.column("description")[index],
+            self.column("ammount")[index],
+            _from_micros(self.column("created_at")[index]),
+        )
+
+    def rows_after_id(self, after_id: int | None):
+        ids = self.column("id")
+        start = 0 if after_id is None else bisect_right(ids, after_id)
+        for index in range(start, len(ids)):
+            yield self.row(index)
+
+    def customer_rows(self, customer_id: int, start: datetime | None = None, end: datetime | None = None):
+        if str(customer_id) not in self.header["customers"]:
+            return
+        customer_ids = self.column("customer_id")
+        created = self.column("created_at")
+        low = _to_micros(start) if start is not None else None
+        high = _to_micros(end) if end is not None else None
+        for index, value in enumerate(customer_ids):
+            if value != customer_id:
+                continue
+            if (low is not None and created[index] < low) or (high is not None and created[index] >= high):
+                continue
+            yield self.row(index)
+
+    def close(self):
+        self._columns.clear()
+        self._map.close()
+
+
+_open_segments: OrderedDict[str, Segment] = OrderedDict()
+
+
+def _evict_segments(keep: str | None = None):
+    # Least recently used first, segments with active readers stay open past the limit
+    excess = len(_open_segments) - ARCHIVE_OPEN_SEGMENTS
+    if excess <= 0:
+        return
+    idle = [
+        path for path, segment in _open_segments.items() if segment.readers == 0 and path != keep
+    ][:excess]
+    for path in idle:
+        _open_segments.pop(path).close()
+
+
+def open_segment(name: str) -> Segment:
+    """
+    Returns an open segment for immediate use. Anything that reads it
+    lazily, after other segments may have been opened, goes through
+    _pinned_rows instead.
+    """
+    path = os.path.join(ARCHIVE_DIR, name)
+    segment = _open_segments.get(path)
+    if segment is None:
+        segment = _open_segments[path] = Segment(path)
+    _open_segments.move_to_end(path)
+    _evict_segments(keep=path)
+    return segment
+
+
+def _pinned_rows(name: str, read, *args):
+    """
+    Yields read(segment, *args) while holding the segment open, so merged
+    readers and streamed responses never see it closed under them.
+    """
+    segment = open_segment(name)
+    segment.readers += 1
+    try:
+        yield from read(segment, *args)
+    finally:
+        segment.readers -= 1
+        _evict_segments()
+
+
+def close_segments():
+    while _open_segments:
+        _open_segments.popitem()[1].close()
+
+
+async def load_segments(session) -> list[ArchiveSegment]:
+    """
+    Reads the manifest, one query on a table with a row per segment.
+    """
+    return list((await session.exec(select(ArchiveSegment).order_by(ArchiveSegment.min_id))).all())
+
+
+def load_segments_sync(session: Session) -> list[ArchiveSegment]:
+    # Also called from migrations that run before archive_segment exists
+    if not inspect(session.connection()).has_table("archive_segment"):
+        return []
+    return list(session.exec(select(ArchiveSegment).order_by(ArchiveSegment.min_id)).all())
+
+
+def _first_column(row):
+    return row[0]
+
+
+def _created_id(row):
+    return row[4], row[0]
+
+
+def _segments_in_id_order(segments: list[ArchiveSegment], read, *args):
+    """
+    Yields read(segment, *args) for segments in manifest (min_id) order as
+    one id-ordered stream. A segment is only opened once the rows before it
+    are used up, and only segments whose id ranges overlap are merged row by
+    row, so a short page or a long export holds one run of segments at a time.
+    """
+    run = []
+    run_max_id = 0
+    for segment in chain(segments, [None]):
+        if run and (segment is None or segment.min_id > run_max_id):
+            if len(run) == 1:
+                yield from _pinned_rows(run[0].name, read, *args)
+            else:
+                yield from heapq.merge(
+                    *(_pinned_rows(overlapping.name, read, *args) for overlapping in run), key=_first_column
+                )
+            run = []
+        if segment is not None:
+            run_max_id = max(run_max_id, segment.max_id) if run else segment.max_id
+            run.append(segment)
+
+
+def iter_archived_rows(segments: list[ArchiveSegment], after_id: int | None = None):
+    """
+    Yields archived rows of ARCHIVE_FIELDS in id order across all segments.
+    """
+    return _segments_in_id_order(
+        [segment for segment in segments if after_id is None or segment.max_id > after_id],
+        Segment.rows_after_id,
+        after_id
+    )
+
+
+def iter_archived_customer_rows(
+    segments: list[ArchiveSegment],
+    customer_id: int,
+    start: datetime | None = None,
+    end: datetime | None = None
+):
+    """
+    Yields one customer's archived rows in id order, skipping segments whose
+    customer or date range rules them out without opening them.
+    """
+    return _segments_in_id_order(
+        [
+            segment for segment in segments
+            if segment.min_customer_id <= customer_id <= segment.max_customer_id
+            and (start is None or segment.max_created_at >= start)
+            and (end is None or segment.min_created_at < end)
+        ],
+        Segment.customer_rows,
+        customer_id,
+        start,
+        end
+    )
+
+
+def merge_by_id(hot_rows, archived_rows, limit: int, skip: int = 0) -> list[tuple]:
+    """
+    Merges two id-ordered row sequences whose first column is the id.
+    """
+    return list(islice(heapq.merge(hot_rows, archived_rows, key=_first_column), skip, skip + limit))
+
+
+async def page_transactions(session, query, segments: list[ArchiveSegment], skip: int, limit: int) -> list:
+    """
+    Returns rows skip..skip+limit of both tiers in id order. `query` selects
+    the hot transactions in id order with the id first and no offset or
+    limit. Whole segments, and the hot rows up to their last id, are skipped
+    by counting: row_count from the manifest and a COUNT over the id range.
+    Only the range where the page starts is merged row by row, hot rows
+    after the last segment get a plain OFFSET.
+    """
+    position = 0
+    after_id = 0
+    for segment in segments:
+        hot_count = (await session.exec(
+            select(func.count()).select_from(Transaction)
+            .where(Transaction.id > after_id, Transaction.id <= segment.max_id)
+        )).one()
+        if position + hot_count + segment.row_count > skip:
+            break
+        position += hot_count + segment.row_count
+        after_id = segment.max_id
+    else:
+        return (await session.exec(
+            query.where(Transaction.id > after_id).offset(skip - position).limit(limit)
+        )).all()
+    skip -= position
+    hot_rows = (await session.exec(query.where(Transaction.id > after_id).limit(skip + limit))).all()
+    return merge_by_id(hot_rows, iter_archived_rows(segments, after_id), limit, skip)
+
+
+def newest_customer_rows(
+    segments: list[ArchiveSegment],
+    customer_id: int,
+    limit: int,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    before: tuple[datetime, int] | None = None,
+    keep=None,
+    floor: tuple[datetime, int] | None = None
+) -> list[tuple]:
+    """
+    Returns up to `limit` archived rows of a customer, newest (created_at,
+    id) first, that are older than the `before` cursor and pass `keep`.
+    Segments are visited newest first and the walk stops once a segment
+    can't beat the rows found so far or `floor` (the oldest row of a full
+    hot page), so at most `limit` rows are kept at any time.
+    """
+    candidates = sorted(
+        (
+            segment for segment in segments
+            if segment.min_customer_id <= customer_id <= segment.max_customer_id
+            and (start is None or segment.max_created_at >= start)
+            and (end is None or segment.min_created_at < end)
+            and (before is None or segment.min_created_at <= before[0])
+        ),
+        key=lambda segment: segment.max_created_at,
+        reverse=True
+    )
+    newest = []
+    for segment in candidates:
+        bound = _created_id(newest[-1]) if len(newest) >= limit else floor
+        if bound is not None and segment.max_created_at < bound[0]:
+            break
+        rows = _pinned_rows(segment.name, Segment.customer_rows, customer_id, start, end)
+        if before is not None:
+            rows = (row for row in rows if _created_id(row) < before)
+        if keep is not None:
+            rows = filter(keep, rows)
+        newest = heapq.nlargest(limit, chain(newest, rows), key=_created_id)
+    return newest
+
+
+def archived_customer_totals(
+    segments: list[ArchiveSegment],
+    customer_id: int,
+    start: datetime | None = None,
+    end: datetime | None = None
+) -> tuple[int, int]:
+    """
+    Returns the archived (amount sum, row count) of a customer in a date
+    range. Segments that lie entirely inside the range answer from their
+    header; only segments straddling a range boundary are scanned.
+    """
+    total = 0
+    count = 0
+    for segment in segments:
+        if not segment.min_customer_id <= customer_id <= segment.max_customer_id:
+            continue
+        if (start is not None and segment.max_created_at < start) or (end is not None and segment.min_created_at >= end):
+            continue
+        opened = open_segment(segment.name)
+        summary = opened.header["customers"].get(str(customer_id))
+        if summary is None:
+            continue
+        if (start is None or segment.min_created_at >= start) and (end is None or segment.max_created_at < end):
+            count += summary[0]
+            total += summary[1]
+            continue
+        for row in opened.customer_rows(customer_id, start, end):
+            count += 1
+            total += row[3]
+    return total, count
+
+
+def archived_customer_summaries(segments: list[ArchiveSegment]) -> dict[int, dict]:
+    """
+    Folds the per-customer header summaries of every segment into balance
+    shaped dicts, read by the balance reconciliation.
+    """
+    balances = {}
+    for segment in segments:
+        for customer_id, (count, total, last_id, last_created_at) in open_segment(segment.name).header["customers"].items():
+            balance = balances.setdefault(int(customer_id), {
+                "customer_id": int(customer_id),
+                "total": 0,
+                "transaction_count": 0,
+                "last_transaction_id": None,
+                "last_transaction_at": None,
+            })
+            balance["total"] += total
+            balance["transaction_count"] += count
+            if balance["last_transaction_id"] is None or last_id > balance["last_transaction_id"]:
+                balance["last_transaction_id"] = last_id
+                balance["last_transaction_at"] = datetime.fromisoformat(last_created_at)
+    return balances
+
+
+def remove_orphan_segments(session: Session, directory: str) -> int:
+    """
+    Deletes segment files whose manifest row never committed (the job stopped
+    between writing the file and committing). Run by the archive job only,
+    never while another archive job is running.
+    """
+    registered = set(session.exec(select(ArchiveSegment.name)).all())
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.name.endswith((SEGMENT_SUFFIX, SEGMENT_SUFFIX + ".tmp")) and entry.name not in registered:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+def archive_transactions(
+    session: Session,
+    cutoff: datetime,
+    segment_rows: int = ARCHIVE_SEGMENT_ROWS,
+    directory: str | None = None
+) -> dict:
+    """
+    Moves transactions created before `cutoff` into segment files of up to
+    `segment_rows` rows, one database transaction per segment. Balances and revenue rollups already include
+    the rows and stay as they are.
+    """
+    directory = directory or ARCHIVE_DIR
+    os.makedirs(directory, exist_ok=True)
+    removed = remove_orphan_segments(session, directory)
+    columns = [getattr(Transaction, field) for field in ARCHIVE_FIELDS]
+    # The newest row always stays hot: SQLite hands out MAX(rowid) + 1, so
+    # archiving it would let a new transaction reuse an archived id
+    newest_id = session.exec(select(func.max(Transaction.id))).one() or 0
+    segments = 0
+    archived = 0
+    last_id = 0
+    while True:
+        rows = session.exec(
+            select(*columns)
+            .where(Transaction.created_at < cutoff, Transaction.id > last_id, Transaction.id < newest_id)
+            .order_by(Transaction.id)
+            .limit(segment_rows)
+        ).all()
+        if not rows:
+            break
+        first_id, last_id = rows[0][0], rows[-1][0]
+        name = f"transactions-{first_id:012d}-{last_id:012d}{SEGMENT_SUFFIX}"
+        path = os.path.join(directory, name)
+        header = write_segment(path, rows)
+        result = session.exec(
+            delete(Transaction).where(
+                Transaction.id >= first_id, Transaction.id <= last_id, Transaction.created_at < cutoff
+            )
+        )
+        if result.rowcount != len(rows):
+            # Rows changed while the segment was written, leave them hot
+            session.rollback()
+            os.remove(path)
+            raise RuntimeError(f"Transactions {first_id}-{last_id} changed during archiving, try again")
+        session.add(ArchiveSegment(
+            name=name,
+            min_id=header["min_id"],
+            max_id=header["max_id"],
+            min_customer_id=header["min_customer_id"],
+            max_customer_id=header["max_customer_id"],
+            min_created_at=datetime.fromisoformat(header["min_created_at"]),
+            max_created_at=datetime.fromisoformat(header["max_created_at"]),
+            row_count=header["rows"],
+            total=header["total"],
+        ))
+        session.commit()
+        segments += 1
+        archived += len(rows)
+    return {"segments": segments, "archived": archived, "orphans_removed": removed}
+
+
+async def count_archived_transactions(session) -> int:
+    return (await session.exec(select(func.coalesce(func.sum(ArchiveSegment.row_count), 0)))).one()
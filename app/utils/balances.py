@@ -0,0 +1,173 @@
+# ./app/utils/balances.py
+
+# Importing External Modules
+from sqlalchemy import case
+from sqlmodel import Session, func, select
+
+# Importing Internal Modules
+from models import Customer, CustomerBalance, Transaction
+from app.utils.archive import archived_customer_summaries, load_segments_sync
+from app.utils.revenue import aggregate_revenue, apply_revenue_deltas
+from app.utils.utils import dialect_insert
+
+# Customers whose balances are recomputed per reconciliation query
+RECONCILE_CHUNK_SIZE = 1000
+
+
+def aggregate_transactions(rows) -> list[dict]:
+    """
+    Folds inserted transaction rows (customer_id, ammount, id, created_at)
+    into one balance delta per customer.
+    """
+    deltas = {}
+    for customer_id, ammount, transaction_id, created_at in rows:
+        delta = deltas.get(customer_id)
+        if delta is None:
+            deltas[customer_id] = {
+                "customer_id": customer_id,
+                "total": ammount,
+                "transaction_count": 1,
+                "last_transaction_id": transaction_id,
+                "last_transaction_at": created_at,
+            }
+            continue
+        delta["total"] += ammount
+        delta["transaction_count"] += 1
+        if transaction_id > delta["last_transaction_id"]:
+            delta["last_transaction_id"] = transaction_id
+            delta["last_transaction_at"] = created_at
+    return list(deltas.values())
+
+
+async def apply_balance_deltas(session, deltas: list[dict]):
+    """
+    Adds per-customer deltas to customer_balance with one upsert, inside the
+    session's transaction so balances commit together with the transactions.
+    """
+    if not deltas:
+        return
+    table = CustomerBalance.__table__
+    statement = dialect_insert(session)(table)
+    newer = statement.excluded.last_transaction_id > func.coalesce(table.c.last_transaction_id, 0)
+    statement = statement.on_conflict_do_update(
+        index_elements=["customer_id"],
+        set_={
+            "total": table.c.total + statement.excluded.total,
+            "transaction_count": table.c.transaction_count + statement.excluded.transaction_count,
+            "last_transaction_id": case(
+                (newer, statement.excluded.last_transaction_id), else_=table.c.last_transaction_id
+            ),
+            "last_transaction_at": case(
+                (newer, statement.excluded.last_transaction_at), else_=table.c.last_transaction_at
+            ),
+        },
+    )
+    connection = await session.connection()
+    await connection.execute(statement, deltas)
+
+
+async def apply_transaction_aggregates(session, rows):
+    """
+    Updates everything maintained next to the transaction table (balances
+    and the revenue_daily rollup) for inserted rows of
+    (customer_id, ammount, id, created_at), in the session's transaction.
+    """
+    rows = list(rows)
+    await apply_balance_deltas(session, aggregate_transactions(rows))
+    await apply_revenue_deltas(session, aggregate_revenue(rows))
+
+
+def _actual_balances(session: Session, first_id: int, last_id: int) -> dict[int, dict]:
+    totals = session.exec(
+        select(
+            Transaction.customer_id,
+            func.sum(Transaction.ammount),
+            func.count(),
+            func.max(Transaction.id),
+        )
+        .where(Transaction.customer_id >= first_id, Transaction.customer_id <= last_id)
+        .group_by(Transaction.customer_id)
+    ).all()
+    last_ids = [last_transaction_id for _, _, _, last_transaction_id in totals]
+    created_at = dict(session.exec(
+        select(Transaction.id, Transaction.created_at).where(Transaction.id.in_(last_ids))
+    ).all()) if last_ids else {}
+    return {
+        customer_id: {
+            "customer_id": customer_id,
+            "total": total,
+            "transaction_count": transaction_count,
+            "last_transaction_id": last_transaction_id,
+            "last_transaction_at": created_at.get(last_transaction_id),
+        }
+        for customer_id, total, transaction_count, last_transaction_id in totals
+    }
+
+
+def _add_archived_balance(actual: dict[int, dict], archived: dict):
+    balance = actual.get(archived["customer_id"])
+    if balance is None:
+        actual[archived["customer_id"]] = dict(archived)
+        return
+    balance["total"] += archived["total"]
+    balance["transaction_count"] += archived["transaction_count"]
+    if archived["last_transaction_id"] > balance["last_transaction_id"]:
+        balance["last_transaction_id"] = archived["last_transaction_id"]
+        balance["last_transaction_at"] = archived["last_transaction_at"]
+
+
+def reconcile_customer_balances(session: Session, fix: bool = True, chunk_size: int = RECONCILE_CHUNK_SIZE) -> dict:
+    """
+    Recomputes balances from the transaction table and the archive segments
+    for chunks of customer ids, reports customers whose stored balance
+    drifted and, with `fix`, replaces them. Each chunk commits on its own so
+    the job can run on a live database.
+    """
+    fields = ("total", "transaction_count", "last_transaction_id", "last_transaction_at")
+    # Archived rows never change, their per-customer sums come from segment headers
+    archived = archived_customer_summaries(load_segments_sync(session))
+    checked = 0
+    drifted = []
+    last_seen = 0
+    while True:
+        customer_ids = session.exec(
+            select(Customer.id).where(Customer.id > last_seen).order_by(Customer.id).limit(chunk_size)
+        ).all()
+        if not customer_ids:
+            break
+        first_id, last_seen = customer_ids[0], customer_ids[-1]
+        actual = _actual_balances(session, first_id, last_seen)
+        for customer_id in customer_ids:
+            if customer_id in archived:
+                _add_archived_balance(actual, archived[customer_id])
+        stored = {
+            balance.customer_id: balance
+            for balance in session.exec(
+                select(CustomerBalance).where(
+                    CustomerBalance.customer_id >= first_id, CustomerBalance.customer_id <= last_seen
+                )
+            ).all()
+        }
+        for customer_id in customer_ids:
+            expected = actual.get(customer_id, {
+                "customer_id": customer_id,
+                "total": 0,
+                "transaction_count": 0,
+                "last_transaction_id": None,
+                "last_transaction_at": None,
+            })
+            balance = stored.get(customer_id)
+            current = {field: getattr(balance, field) for field in fields} if balance else None
+            if current is None and expected["transaction_count"] == 0:
+                continue
+            if current != {field: expected[field] for field in fields}:
+                drifted.append({
+                    "customer_id": customer_id,
+                    "stored_total": current["total"] if current else None,
+                    "actual_total": expected["total"],
+                })
+                if fix:
+                    session.merge(CustomerBalance(**expected))
+        checked += len(customer_ids)
+        session.commit()
+    return {"customers_checked": checked, "drifted": len(drifted), "fixed": fix, "drift": drifted[:100]}
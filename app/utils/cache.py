@@ -0,0 +1,215 @@
+# ./app/utils/cache.py
+import json
+import os
+import time
+from collections import OrderedDict
+
+# Importing Internal Modules
+from models import Customer, Plan, CUSTOMER_PUBLIC_FIELDS
+
+# "memory" (per process), "local" (serializing stand-in for tests) or "redis"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+# Upper bound on staleness across workers, writes in this process invalidate at once
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_KEY_PREFIX = "cache:"
+
+
+class MemoryBackend:
+    """
+    In-process LRU cache with a TTL per entry. Values are stored as-is, so
+    callers must treat what they get back as read-only.
+    """
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class LocalSharedBackend:
+    """
+    Stand-in for an out-of-process cache: values go through JSON like they
+    would over the wire, so tests catch anything that doesn't serialize.
+    """
+    name = "local"
+
+    def __init__(self, ttl: float = CACHE_TTL):
+        self.ttl = ttl
+        self._entries: dict[str, tuple[float, str]] = {}
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return json.loads(entry[1])
+
+    async def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, json.dumps(value))
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    """
+    Cache shared by every worker. Needs the optional `redis` package.
+    """
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_URL, ttl: float = CACHE_TTL):
+        try:
+            import redis.asyncio as redis
+        except ImportError as exc:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package") from exc
+        self.ttl = ttl
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str):
+        raw = await self._client.get(CACHE_KEY_PREFIX + key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value):
+        await self._client.set(CACHE_KEY_PREFIX + key, json.dumps(value), ex=int(self.ttl))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._client.delete(*(CACHE_KEY_PREFIX + key for key in keys))
+
+    async def clear(self):
+        async for key in self._client.scan_iter(match=CACHE_KEY_PREFIX + "*"):
+            await self._client.delete(key)
+
+
+class ReadThroughCache:
+    """
+    Read-through wrapper around a backend that counts hits and misses.
+    Missing rows (None) are never cached, so new rows show up immediately.
+    A load that overlaps an invalidation of its key is returned but not
+    stored, so a row read before a write can't be cached after it.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # key -> [generation, loads in flight], only while a load is running
+        self._loads: dict[str, list[int]] = {}
+
+    async def get_or_load(self, key: str, loader):
+        value = await self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        load = self._loads.setdefault(key, [0, 0])
+        generation = load[0]
+        load[1] += 1
+        try:
+            value = await loader()
+        finally:
+            load[1] -= 1
+            if load[1] == 0:
+                del self._loads[key]
+        if value is not None and load[0] == generation:
+            await self.backend.set(key, value)
+        return value
+
+    async def invalidate(self, *keys: str):
+        for key in keys:
+            load = self._loads.get(key)
+            if load is not None:
+                load[0] += 1
+        await self.backend.delete(*keys)
+
+    async def clear(self):
+        for load in self._loads.values():
+            load[0] += 1
+        await self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def prometheus_lines(self) -> list[str]:
+        return [
+            "# HELP cache_hits_total Read-through cache hits.",
+            "# TYPE cache_hits_total counter",
+            f"cache_hits_total {self.hits}",
+            "# HELP cache_misses_total Read-through cache misses.",
+            "# TYPE cache_misses_total counter",
+            f"cache_misses_total {self.misses}",
+        ]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+def create_backend(name: str = CACHE_BACKEND):
+    if name == "redis":
+        return RedisBackend()
+    if name == "local":
+        return LocalSharedBackend()
+    return MemoryBackend()
+
+
+cache = ReadThroughCache(create_backend())
+
+PLANS_KEY = "plans"
+
+
+def plan_key(plan_id: int) -> str:
+    return f"plan:{plan_id}"
+
+
+def customer_key(customer_id: int) -> str:
+    return f"customer:{customer_id}"
+
+
+async def get_plan_cached(session, plan_id: int) -> dict | None:
+    async def load():
+        plan = await session.get(Plan, plan_id)
+        return plan.model_dump() if plan else None
+    return await cache.get_or_load(plan_key(plan_id), load)
+
+
+async def get_customer_cached(session, customer_id: int) -> dict | None:
+    async def load():
+        customer = await session.get(Customer, customer_id)
+        # Only public fields are cached, password_hash never leaves the database layer
+        return customer.model_dump(include=set(CUSTOMER_PUBLIC_FIELDS)) if customer else None
+    return await cache.get_or_load(customer_key(customer_id), load)
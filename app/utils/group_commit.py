@@ -0,0 +1,201 @@
+# ./app/utils/group_commit.py
+import asyncio
+import os
+import time
+
+from fastapi import HTTPException, status
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Importing Internal Modules
+from models import Customer, Transaction
+from app.utils.balances import apply_transaction_aggregates
+
+# "1" makes POST /transactions go through the group-commit writer
+TRANSACTION_GROUP_COMMIT = os.getenv("TRANSACTION_GROUP_COMMIT", "0") == "1"
+# A batch is committed once it holds this many rows or has waited this long
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "500"))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "5"))
+# Transactions allowed to wait for a flush before new ones get a 503
+GROUP_COMMIT_QUEUE_SIZE = int(os.getenv("GROUP_COMMIT_QUEUE_SIZE", "10000"))
+GROUP_COMMIT_RETRY_AFTER = os.getenv("GROUP_COMMIT_RETRY_AFTER", "1")
+
+# Upper bounds of the flush size histogram
+FLUSH_SIZE_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000)
+# Queued by stop() behind every submitted row, the writer task exits when it reads it
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    Single writer task that inserts queued transactions in batches, one
+    commit (one fsync on SQLite) per batch, balances and rollups included. Each request awaits a future
+    resolved with its inserted row. Customers are checked by the task with
+    one query per batch, so requests never touch a connection themselves.
+    The task is started on first use and restarted if the event loop changes.
+    """
+
+    def __init__(
+        self,
+        max_rows: int = GROUP_COMMIT_MAX_ROWS,
+        max_delay_ms: float = GROUP_COMMIT_MAX_DELAY_MS,
+        queue_size: int = GROUP_COMMIT_QUEUE_SIZE
+    ):
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.queue_size = queue_size
+        self.queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._loop = None
+        self._batch_full: asyncio.Event | None = None
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_size_counts = [0] * len(FLUSH_SIZE_BUCKETS)
+        self.commit_seconds = 0.0
+        self.rejected = 0
+        self.failed = 0
+
+    def _ensure_started(self, bind):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._batch_full = asyncio.Event()
+        self._task = loop.create_task(self._run(bind))
+
+    async def submit(self, bind, row: dict) -> dict:
+        """
+        Queues a validated transaction and waits until its batch commits.
+        Raises a 503 with Retry-After when the queue is full.
+        """
+        self._ensure_started(bind)
+        future = self._loop.create_future()
+        try:
+            self.queue.put_nowait((row, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many transactions waiting to be written, try again later",
+                headers={"Retry-After": GROUP_COMMIT_RETRY_AFTER}
+            )
+        if self.queue.qsize() >= self.max_rows:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self, bind):
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = False
+            if self.queue.qsize() + 1 < self.max_rows:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.max_rows and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(bind, batch)
+            if stopping:
+                return
+
+    async def _flush(self, bind, batch: list):
+        started = time.perf_counter()
+        try:
+            async with AsyncSession(bind, expire_on_commit=False) as session:
+                customer_ids = {row["customer_id"] for row, _ in batch}
+                existing_ids = set((await session.exec(
+                    select(Customer.id).where(Customer.id.in_(customer_ids))
+                )).all())
+                for row, future in batch:
+                    if row["customer_id"] not in existing_ids and not future.done():
+                        future.set_exception(HTTPException(
+                            status_code=status.HTTP_404_NOT_FOUND,
+                            detail="Customer dosen't exist"
+                        ))
+                batch = [(row, future) for row, future in batch if row["customer_id"] in existing_ids]
+                if not batch:
+                    return
+                transactions = [Transaction.model_validate(row) for row, _ in batch]
+                session.add_all(transactions)
+                await session.flush()
+                await apply_transaction_aggregates(session, (
+                    (transaction.customer_id, transaction.ammount, transaction.id, transaction.created_at)
+                    for transaction in transactions
+                ))
+                await session.commit()
+        except Exception as exc:
+            # The whole batch shares one transaction, so every request in it fails
+            self.failed += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        self._record_flush(len(batch), time.perf_counter() - started)
+        for transaction, (_, future) in zip(transactions, batch):
+            if not future.done():
+                future.set_result(transaction.model_dump())
+
+    def _record_flush(self, size: int, seconds: float):
+        self.flushes += 1
+        self.flushed_rows += size
+        self.commit_seconds += seconds
+        for index, bound in enumerate(FLUSH_SIZE_BUCKETS):
+            if size <= bound:
+                self.flush_size_counts[index] += 1
+
+    async def stop(self):
+        if self._task is not None and not self._task.done() and self._loop is asyncio.get_running_loop():
+            # The stop marker queues behind every submitted row, including one the
+            # task already holds while it waits for its batch to fill, so all of
+            # them commit before the engines are disposed
+            await self.queue.put(_STOP)
+            self._batch_full.set()
+            await self._task
+            # Rows submitted while the writer was stopping are refused
+            while not self.queue.empty():
+                _, future = self.queue.get_nowait()
+                if not future.done():
+                    future.set_exception(HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="Transaction writer is shutting down, try again later",
+                        headers={"Retry-After": GROUP_COMMIT_RETRY_AFTER}
+                    ))
+        self._task = None
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# HELP group_commit_queue_depth Transactions waiting for the group-commit writer.",
+            "# TYPE group_commit_queue_depth gauge",
+            f"group_commit_queue_depth {self.queue.qsize() if self.queue is not None else 0}",
+            "# HELP group_commit_flush_size Rows committed per group-commit flush.",
+            "# TYPE group_commit_flush_size histogram",
+        ]
+        for bound, count in zip(FLUSH_SIZE_BUCKETS, self.flush_size_counts):
+            lines.append(f'group_commit_flush_size_bucket{{le="{bound}"}} {count}')
+        lines += [
+            f'group_commit_flush_size_bucket{{le="+Inf"}} {self.flushes}',
+            f"group_commit_flush_size_sum {self.flushed_rows}",
+            f"group_commit_flush_size_count {self.flushes}",
+            "# HELP group_commit_flush_seconds_total Time spent inserting and committing batches.",
+            "# TYPE group_commit_flush_seconds_total counter",
+            f"group_commit_flush_seconds_total {self.commit_seconds}",
+            "# HELP group_commit_rejected_total Transactions refused because the queue was full.",
+            "# TYPE group_commit_rejected_total counter",
+            f"group_commit_rejected_total {self.rejected}",
+            "# HELP group_commit_failed_total Transactions in batches that failed to commit.",
+            "# TYPE group_commit_failed_total counter",
+            f"group_commit_failed_total {self.failed}",
+        ]
+        return lines
+
+
+transaction_writer = GroupCommitWriter()
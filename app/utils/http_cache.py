@@ -0,0 +1,87 @@
+# ./app/utils/http_cache.py
+import os
+
+from fastapi import Request, Response, status
+
+# Importing Internal Modules
+from models import ResourceVersion
+from app.utils.cache import cache
+from app.utils.utils import dialect_insert
+
+# Cache-Control sent with each conditional route, override per route from the environment
+CACHE_CONTROL = {
+    "plans": os.getenv("CACHE_CONTROL_PLANS", "public, max-age=30"),
+    "customer": os.getenv("CACHE_CONTROL_CUSTOMER", "private, no-cache"),
+    "customer_plans": os.getenv("CACHE_CONTROL_CUSTOMER_PLANS", "private, no-cache"),
+}
+
+PLANS_VERSION = "plans"
+
+
+def customer_version(customer_id: int) -> str:
+    return f"customer:{customer_id}"
+
+
+def customer_plans_version(customer_id: int) -> str:
+    return f"customer_plans:{customer_id}"
+
+
+def _cache_key(version_key: str) -> str:
+    return f"version:{version_key}"
+
+
+async def bump_versions(session, *version_keys: str):
+    """
+    Increments version counters inside the session's transaction, so they
+    change in the same commit as the rows they describe. Call
+    invalidate_versions after the commit.
+    """
+    if not version_keys:
+        return
+    table = ResourceVersion.__table__
+    statement = dialect_insert(session)(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"version": table.c.version + 1},
+    )
+    connection = await session.connection()
+    await connection.execute(statement, [{"key": key, "version": 1} for key in version_keys])
+
+
+async def invalidate_versions(*version_keys: str):
+    await cache.invalidate(*(_cache_key(key) for key in version_keys))
+
+
+async def get_version(session, version_key: str) -> int:
+    async def load():
+        version = await session.get(ResourceVersion, version_key)
+        return version.version if version else 0
+    return await cache.get_or_load(_cache_key(version_key), load)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def conditional_headers(
+    request: Request, session, version_key: str, route: str
+) -> tuple[dict, Response | None]:
+    """
+    Returns the ETag and Cache-Control headers of a read, plus a 304 response
+    when the client already holds the current version. Only the version
+    counter is read, and it usually comes from the cache, so a 304 serializes
+    nothing. Read the version before the rows: a write landing in between
+    then only costs the client one extra full response. A missing counter
+    reads as 0, so callers must confirm the resource exists before returning
+    the 304, otherwise `*` or "...:0" would match resources that don't.
+    """
+    version = await get_version(session, version_key)
+    # The key keeps ETags of different resources apart, "0" alone would match them all
+    headers = {"ETag": f'"{version_key}:{version}"', "Cache-Control": CACHE_CONTROL[route]}
+    if etag_matches(request, headers["ETag"]):
+        return headers, Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return headers, None
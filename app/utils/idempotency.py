@@ -0,0 +1,209 @@
+# ./app/utils/idempotency.py
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Annotated, Awaitable, Callable, NamedTuple
+
+import orjson
+from fastapi import Header, HTTPException, Response, status
+from sqlmodel import delete
+
+# Importing Internal Modules
+from models import IdempotencyKey, utc_now
+from app.utils.utils import dialect_insert
+
+# Seconds a stored response is replayed for, retries after that run again
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Expired keys are deleted once every this many stored responses
+IDEMPOTENCY_PURGE_EVERY = int(os.getenv("IDEMPOTENCY_PURGE_EVERY", "100"))
+IDEMPOTENCY_REPLAYED_HEADER = "Idempotent-Replayed"
+
+IdempotencyKeyHeader = Annotated[str | None, Header(alias="Idempotency-Key", max_length=255)]
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    status_code: int
+    body: bytes
+    expires_at: datetime
+
+
+class IdempotencyStore:
+    """
+    Hot LRU of stored responses and the keyed requests currently running in
+    this process. The idempotency_key table is the source of truth across
+    workers, the LRU only saves its lookup on replays.
+    """
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple[str, str], StoredResponse] = OrderedDict()
+        self.in_flight: dict[tuple[str, str], asyncio.Future] = {}
+        self.stored = 0
+        self.replays = 0
+        self.collapsed = 0
+
+    def get(self, cache_key: tuple[str, str]) -> StoredResponse | None:
+        stored = self.entries.get(cache_key)
+        if stored is None:
+            return None
+        if stored.expires_at <= utc_now():
+            del self.entries[cache_key]
+            return None
+        self.entries.move_to_end(cache_key)
+        return stored
+
+    def put(self, cache_key: tuple[str, str], stored: StoredResponse):
+        self.entries[cache_key] = stored
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.in_flight.clear()
+
+    def prometheus_lines(self) -> list[str]:
+        return [
+            "# HELP idempotency_stored_total Responses stored under an Idempotency-Key.",
+            "# TYPE idempotency_stored_total counter",
+            f"idempotency_stored_total {self.stored}",
+            "# HELP idempotency_replays_total Retries answered with a stored response.",
+            "# TYPE idempotency_replays_total counter",
+            f"idempotency_replays_total {self.replays}",
+            "# HELP idempotency_collapsed_total Concurrent duplicates that waited for the first request.",
+            "# TYPE idempotency_collapsed_total counter",
+            f"idempotency_collapsed_total {self.collapsed}",
+        ]
+
+
+idempotency_store = IdempotencyStore()
+
+
+def request_fingerprint(payload) -> str:
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+async def load_stored_response(session, scope: str, key: str) -> StoredResponse | None:
+    cache_key = (scope, key)
+    stored = idempotency_store.get(cache_key)
+    if stored is not None:
+        return stored
+    record = await session.get(IdempotencyKey, cache_key)
+    if record is None or record.expires_at <= utc_now():
+        return None
+    stored = StoredResponse(
+        record.request_hash, record.status_code, record.response_body.encode(), record.expires_at
+    )
+    idempotency_store.put(cache_key, stored)
+    return stored
+
+
+async def save_stored_response(session, scope: str, key: str, stored: StoredResponse) -> bool:
+    """
+    Writes the response inside the session's transaction, so it commits
+    together with the business rows. Returns False when another worker holds
+    a live record for the same key; an expired record is overwritten.
+    """
+    now = utc_now()
+    table = IdempotencyKey.__table__
+    statement = dialect_insert(session)(table).values(
+        scope=scope,
+        key=key,
+        request_hash=stored.request_hash,
+        status_code=stored.status_code,
+        response_body=stored.body.decode(),
+        created_at=now,
+        expires_at=stored.expires_at,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=["scope", "key"],
+        set_={
+            column: statement.excluded[column]
+            for column in ("request_hash", "status_code", "response_body", "created_at", "expires_at")
+        },
+        where=table.c.expires_at <= now,
+    )
+    connection = await session.connection()
+    if (await connection.execute(statement)).rowcount != 1:
+        return False
+    idempotency_store.stored += 1
+    if idempotency_store.stored % IDEMPOTENCY_PURGE_EVERY == 0:
+        await connection.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now))
+    return True
+
+
+def replay_response(stored: StoredResponse | None, request_hash: str) -> Response:
+    if stored is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is already being processed"
+        )
+    if stored.request_hash != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="This Idempotency-Key was already used with a different request"
+        )
+    idempotency_store.replays += 1
+    return Response(
+        stored.body,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={IDEMPOTENCY_REPLAYED_HEADER: "true"}
+    )
+
+
+async def run_idempotent(
+    session,
+    scope: str,
+    key: str | None,
+    payload,
+    handler: Callable[[], Awaitable],
+    status_code: int = status.HTTP_200_OK
+) -> Response:
+    """
+    Runs `handler`, which writes through `session` without committing and
+    returns the JSON body, then commits. With a key, the response is stored
+    in the same commit and retries get it back without running the handler;
+    duplicates arriving while the first request runs wait for it instead of
+    doing the work twice. Failed requests store nothing and can be retried.
+    """
+    if key is None:
+        body = orjson.dumps(await handler())
+        await session.commit()
+        return Response(body, status_code=status_code, media_type="application/json")
+
+    cache_key = (scope, key)
+    request_hash = request_fingerprint(payload)
+    while True:
+        stored = await load_stored_response(session, scope, key)
+        if stored is not None:
+            return replay_response(stored, request_hash)
+        flight = idempotency_store.in_flight.get(cache_key)
+        if flight is None:
+            break
+        idempotency_store.collapsed += 1
+        await asyncio.shield(flight)
+
+    flight = asyncio.get_running_loop().create_future()
+    idempotency_store.in_flight[cache_key] = flight
+    try:
+        stored = StoredResponse(
+            request_hash,
+            status_code,
+            orjson.dumps(await handler()),
+            utc_now() + timedelta(seconds=IDEMPOTENCY_TTL)
+        )
+        if not await save_stored_response(session, scope, key, stored):
+            # Another worker committed this key first, drop our writes and replay its response
+            await session.rollback()
+            return replay_response(await load_stored_response(session, scope, key), request_hash)
+        await session.commit()
+        idempotency_store.put(cache_key, stored)
+    finally:
+        idempotency_store.in_flight.pop(cache_key, None)
+        flight.set_result(None)
+    return Response(stored.body, status_code=status_code, media_type="application/json")
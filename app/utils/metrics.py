@@ -0,0 +1,179 @@
+# ./app/utils/metrics.py
+import logging
+import os
+import random
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from sqlalchemy import event
+
+# Upper bounds (seconds) of the latency histogram buckets, +Inf is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Fraction of requests logged with their timing and DB usage, 0 disables tracing
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+trace_logger = logging.getLogger("app.trace")
+
+# [query count, query seconds] of the request being handled
+_request_db_stats: ContextVar[list | None] = ContextVar("request_db_stats", default=None)
+
+
+class RouteStats:
+    """
+    Counters for one (method, route) pair. The histogram buckets are allocated
+    once and only incremented afterwards; everything runs on the event loop
+    thread so no locking is needed.
+    """
+    __slots__ = ("buckets", "total_seconds", "count", "statuses")
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total_seconds = 0.0
+        self.count = 0
+        self.statuses: dict[int, int] = {}
+
+    def observe(self, seconds: float, status_code: int):
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total_seconds += seconds
+        self.count += 1
+        self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+
+
+class Metrics:
+    def __init__(self):
+        self.routes: dict[tuple[str, str], RouteStats] = {}
+        self.in_flight = 0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        # Extra text blocks contributed by other modules (cache, queues, ...)
+        self.collectors = []
+
+    def route(self, method: str, path: str) -> RouteStats:
+        stats = self.routes.get((method, path))
+        if stats is None:
+            stats = self.routes[(method, path)] = RouteStats()
+        return stats
+
+    def render(self) -> str:
+        """
+        Renders every counter in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_request_duration_seconds Request latency per route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, path), stats in self.routes.items():
+            labels = f'method="{method}",route="{_escape(path)}"'
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += bucket
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {stats.total_seconds}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {stats.count}")
+        lines += [
+            "# HELP http_responses_total Responses per route and status code.",
+            "# TYPE http_responses_total counter",
+        ]
+        for (method, path), stats in self.routes.items():
+            for status_code, count in stats.statuses.items():
+                lines.append(
+                    f'http_responses_total{{method="{method}",route="{_escape(path)}",status="{status_code}"}} {count}'
+                )
+        lines += [
+            "# HELP db_queries_total SQL statements executed.",
+            "# TYPE db_queries_total counter",
+            f"db_queries_total {self.db_queries}",
+            "# HELP db_query_duration_seconds_total Time spent executing SQL statements.",
+            "# TYPE db_query_duration_seconds_total counter",
+            f"db_query_duration_seconds_total {self.db_seconds}",
+        ]
+        for collector in self.collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency, status codes, in-flight requests
+    and DB usage per route, and logging a sample of requests as traces.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        db_stats = [0, 0.0]
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = _request_db_stats.set(db_stats)
+        metrics.in_flight += 1
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - start
+            metrics.in_flight -= 1
+            _request_db_stats.reset(token)
+            # The router stores the matched route in the scope, use its template
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            metrics.route(scope["method"], path).observe(elapsed, status_code)
+            if TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE:
+                trace_logger.info(
+                    "%s %s status=%s duration_ms=%.2f db_queries=%d db_ms=%.2f",
+                    scope["method"], scope["path"], status_code,
+                    elapsed * 1000, db_stats[0], db_stats[1] * 1000
+                )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_start"].pop()
+    metrics.db_queries += 1
+    metrics.db_seconds += elapsed
+    db_stats = _request_db_stats.get()
+    if db_stats is not None:
+        db_stats[0] += 1
+        db_stats[1] += elapsed
+
+
+def _handle_error(context):
+    # after_cursor_execute doesn't fire for a failed statement, drop its start time
+    # here or every IntegrityError leaves one behind on the pooled connection
+    connection = context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """
+    Counts queries and query time of a sync engine (for async engines pass
+    `async_engine.sync_engine`).
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
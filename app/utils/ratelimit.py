@@ -0,0 +1,364 @@
+# ./app/utils/ratelimit.py
+import base64
+import binascii
+import math
+import os
+import time
+from array import array
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+
+import orjson
+from fastapi import HTTPException, status
+from fastapi.responses import ORJSONResponse
+
+# "0" turns every rule off, e.g. for load tests sent from a single address
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# "memory" (per process), "local" (serializing stand-in for tests) or "redis"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "redis://localhost:6379/0")
+RATE_LIMIT_KEY_PREFIX = "ratelimit:"
+# Buckets kept by the memory backend before idle ones are dropped
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0") == "1"
+# Password checks allowed to run at once for the same account
+MAX_CONCURRENT_VERIFICATIONS = int(os.getenv("MAX_CONCURRENT_VERIFICATIONS", "2"))
+
+
+class RateLimitRule(NamedTuple):
+    name: str
+    method: str
+    path: str
+    # "ip" (per client address), "route" (one bucket for everyone) or "account"
+    key: str
+    limit: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.limit / self.period
+
+
+def parse_rule(name: str, method: str, path: str, key: str, default: str) -> RateLimitRule | None:
+    """
+    Reads a "<requests>/<seconds>" limit from RATE_LIMIT_<NAME>, "0" disables the rule.
+    """
+    spec = os.getenv(f"RATE_LIMIT_{name.upper()}", default)
+    limit, _, period = spec.partition("/")
+    if int(limit) <= 0:
+        return None
+    return RateLimitRule(name, method, path, key, int(limit), float(period or 1))
+
+
+def take_token(tokens: float, updated_at: float, now: float, rule: RateLimitRule) -> tuple[float, float]:
+    """
+    Refills a bucket for the time since `updated_at` and takes one token.
+    Returns the tokens left and 0, or the unchanged tokens and the seconds
+    until a token is available.
+    """
+    tokens = min(rule.limit, tokens + (now - updated_at) * rule.rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rule.rate
+
+
+class MemoryBucketStore:
+    """
+    Buckets of this process. Each key maps to a slot in one flat array of
+    (tokens, updated_at, full_at) doubles, so a bucket costs a dict entry and
+    24 bytes. When the key limit is reached, buckets that have refilled
+    completely are dropped, as they carry no state.
+    """
+    name = "memory"
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._slots: dict[str, int] = {}
+        self._state = array("d")
+
+    async def take(self, key: str, rule: RateLimitRule) -> float:
+        now = time.monotonic()
+        slot = self._slots.get(key)
+        if slot is None:
+            if len(self._slots) >= self.max_keys:
+                self._compact(now)
+            slot = self._slots[key] = len(self._slots)
+            self._state.extend((rule.limit, now, now))
+        offset = slot * 3
+        tokens, retry_after = take_token(self._state[offset], self._state[offset + 1], now, rule)
+        self._state[offset] = tokens
+        self._state[offset + 1] = now
+        self._state[offset + 2] = now + (rule.limit - tokens) / rule.rate
+        return retry_after
+
+    def _compact(self, now: float):
+        live = [
+            (self._state[slot * 3 + 2], key, slot)
+            for key, slot in self._slots.items()
+            if self._state[slot * 3 + 2] > now
+        ]
+        if len(live) >= self.max_keys:
+            # Still full of active buckets, keep the half that stays limited the longest
+            live = sorted(live, reverse=True)[:self.max_keys // 2]
+        state = array("d")
+        slots = {}
+        for _, key, slot in live:
+            slots[key] = len(slots)
+            state.extend(self._state[slot * 3:slot * 3 + 3])
+        self._slots, self._state = slots, state
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    async def clear(self):
+        self._slots.clear()
+        self._state = array("d")
+
+
+class LocalSharedBucketStore:
+    """
+    Stand-in for the shared backend: buckets go through JSON with wall-clock
+    timestamps like they would in Redis, so tests cover the same code path.
+    """
+    name = "local"
+
+    def __init__(self):
+        self._entries: dict[str, bytes] = {}
+
+    async def take(self, key: str, rule: RateLimitRule) -> float:
+        now = time.time()
+        raw = self._entries.get(key)
+        tokens, updated_at = (rule.limit, now) if raw is None else orjson.loads(raw)
+        tokens, retry_after = take_token(tokens, updated_at, now, rule)
+        self._entries[key] = orjson.dumps([tokens, now])
+        return retry_after
+
+    async def clear(self):
+        self._entries.clear()
+
+
+# Same arithmetic as take_token, run atomically inside Redis
+_REDIS_TAKE_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or limit
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(limit, tokens + (now - updated_at) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(limit / rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RedisBucketStore:
+    """
+    Buckets shared by every worker. Needs the optional `redis` package.
+    """
+    name = "redis"
+
+    def __init__(self, url: str = RATE_LIMIT_URL):
+        try:
+            import redis.asyncio as redis
+        except ImportError as exc:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from exc
+        self._client = redis.from_url(url)
+        self._take = self._client.register_script(_REDIS_TAKE_SCRIPT)
+
+    async def take(self, key: str, rule: RateLimitRule) -> float:
+        retry_after = await self._take(
+            keys=[RATE_LIMIT_KEY_PREFIX + key], args=[rule.limit, rule.rate, time.time()]
+        )
+        return float(retry_after)
+
+    async def clear(self):
+        async for key in self._client.scan_iter(match=RATE_LIMIT_KEY_PREFIX + "*"):
+            await self._client.delete(key)
+
+
+def create_bucket_store(name: str = RATE_LIMIT_BACKEND):
+    if name == "redis":
+        return RedisBucketStore()
+    if name == "local":
+        return LocalSharedBucketStore()
+    return MemoryBucketStore()
+
+
+class RateLimiter:
+    """
+    Token-bucket limits looked up by (method, path), with allowed and
+    rejected counters per rule.
+    """
+
+    def __init__(self, store, rules: list[RateLimitRule]):
+        self.store = store
+        self.rules: dict[tuple[str, str], list[RateLimitRule]] = {}
+        for rule in rules:
+            self.rules.setdefault((rule.method, rule.path), []).append(rule)
+        self.allowed: dict[str, int] = {rule.name: 0 for rule in rules}
+        self.rejected: dict[str, int] = {rule.name: 0 for rule in rules}
+
+    def rule(self, name: str) -> RateLimitRule | None:
+        for rules in self.rules.values():
+            for rule in rules:
+                if rule.name == name:
+                    return rule
+        return None
+
+    async def hit(self, rule: RateLimitRule, identity: str) -> float:
+        """
+        Takes a token from the rule's bucket for `identity` and returns 0, or
+        the seconds to wait when the bucket is empty.
+        """
+        retry_after = await self.store.take(f"{rule.name}:{identity}", rule)
+        if retry_after:
+            self.rejected[rule.name] += 1
+        else:
+            self.allowed[rule.name] += 1
+        return retry_after
+
+    async def check(self, name: str, identity: str):
+        """
+        Raises a 429 when the named rule rejects `identity`, for limits that
+        need data only the endpoint has (e.g. the account in a login body).
+        """
+        rule = self.rule(name)
+        if rule is None:
+            return
+        retry_after = await self.hit(rule, identity)
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+    async def clear(self):
+        await self.store.clear()
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# HELP rate_limit_requests_total Requests checked against each rate limit rule.",
+            "# TYPE rate_limit_requests_total counter",
+        ]
+        for name in self.allowed:
+            lines.append(f'rate_limit_requests_total{{rule="{name}",result="allowed"}} {self.allowed[name]}')
+            lines.append(f'rate_limit_requests_total{{rule="{name}",result="rejected"}} {self.rejected[name]}')
+        return lines
+
+
+def default_rules() -> list[RateLimitRule]:
+    if not RATE_LIMIT_ENABLED:
+        return []
+    rules = [
+        parse_rule("login_ip", "POST", "/customers/login", "ip", "20/60"),
+        parse_rule("login_route", "POST", "/customers/login", "route", "200/1"),
+        # Checked by login_customer, the account is only known once the body is read
+        parse_rule("login_account", "POST", "/customers/login", "account", "10/60"),
+        parse_rule("root_ip", "GET", "/", "ip", "20/60"),
+        parse_rule("root_account", "GET", "/", "account", "10/60"),
+    ]
+    return [rule for rule in rules if rule is not None]
+
+
+rate_limiter = RateLimiter(create_bucket_store(), default_rules())
+
+
+def client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def basic_auth_username(scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            auth_scheme, _, credentials = value.decode("latin-1").partition(" ")
+            if auth_scheme.lower() != "basic":
+                return None
+            try:
+                return base64.b64decode(credentials).decode().partition(":")[0]
+            except (binascii.Error, UnicodeDecodeError):
+                return None
+    return None
+
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware applying the limiter's rules before the request body
+    is read, so rejected requests never reach validation, the database or
+    bcrypt. Account rules use the Basic-auth username when there is one.
+    """
+
+    def __init__(self, app, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rules = self.limiter.rules.get((scope["method"], scope["path"]))
+        if rules:
+            for rule in rules:
+                if rule.key == "ip":
+                    identity = client_ip(scope)
+                elif rule.key == "route":
+                    identity = "*"
+                else:
+                    identity = basic_auth_username(scope)
+                    if identity is None:
+                        continue
+                retry_after = await self.limiter.hit(rule, identity)
+                if retry_after:
+                    response = ORJSONResponse(
+                        {"detail": "Too many requests, try again later"},
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        headers={"Retry-After": str(math.ceil(retry_after))}
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+class ConcurrencyGate:
+    """
+    Caps how many operations run at once per key, used to keep a single
+    account from tying up the bcrypt pool with parallel login attempts.
+    """
+
+    def __init__(self, limit: int = MAX_CONCURRENT_VERIFICATIONS):
+        self.limit = limit
+        self._active: dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        active = self._active.get(key, 0)
+        if active >= self.limit:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts in progress for this account",
+                headers={"Retry-After": "1"}
+            )
+        self._active[key] = active + 1
+        try:
+            yield
+        finally:
+            if self._active[key] == 1:
+                del self._active[key]
+            else:
+                self._active[key] -= 1
+
+
+verification_gate = ConcurrencyGate()
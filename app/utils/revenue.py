@@ -0,0 +1,148 @@
+# ./app/utils/revenue.py
+
+# Importing External Modules
+from sqlalchemy import String, cast, inspect
+from sqlmodel import Session, delete, func, insert, select
+
+# Importing Internal Modules
+from models import RevenueDaily, RevenueDayTotal, RevenueMonthTotal, Transaction
+from app.utils.archive import iter_archived_rows, load_segments_sync
+from app.utils.utils import dialect_insert
+
+
+def aggregate_revenue(rows) -> list[dict]:
+    """
+    Folds inserted transaction rows (customer_id, ammount, id, created_at)
+    into one revenue_daily delta per customer and UTC day.
+    """
+    deltas = {}
+    for customer_id, ammount, _, created_at in rows:
+        day = created_at.date()
+        delta = deltas.get((day, customer_id))
+        if delta is None:
+            deltas[(day, customer_id)] = {
+                "day": day,
+                "customer_id": customer_id,
+                "month": day.strftime("%Y-%m"),
+                "total": ammount,
+                "transaction_count": 1,
+            }
+            continue
+        delta["total"] += ammount
+        delta["transaction_count"] += 1
+    return list(deltas.values())
+
+
+def fold_revenue_deltas(deltas: list[dict], key: str) -> list[dict]:
+    """
+    Sums per customer deltas into one delta per `key` ("day" or "month")
+    for the customer-agnostic rollups.
+    """
+    folded = {}
+    for delta in deltas:
+        bucket = folded.get(delta[key])
+        if bucket is None:
+            bucket = folded[delta[key]] = {"month": delta["month"], "total": 0, "transaction_count": 0}
+            if key == "day":
+                bucket["day"] = delta["day"]
+        bucket["total"] += delta["total"]
+        bucket["transaction_count"] += delta["transaction_count"]
+    return list(folded.values())
+
+
+def _revenue_upsert(session, model=RevenueDaily, index_elements=("day", "customer_id")):
+    table = model.__table__
+    statement = dialect_insert(session)(table)
+    return statement.on_conflict_do_update(
+        index_elements=list(index_elements),
+        set_={
+            "total": table.c.total + statement.excluded.total,
+            "transaction_count": table.c.transaction_count + statement.excluded.transaction_count,
+        },
+    )
+
+
+def _revenue_upserts(session, deltas: list[dict]):
+    # revenue_daily, then the day and month totals folded from the same deltas
+    yield _revenue_upsert(session), deltas
+    yield _revenue_upsert(session, RevenueDayTotal, ["day"]), fold_revenue_deltas(deltas, "day")
+    yield _revenue_upsert(session, RevenueMonthTotal, ["month"]), fold_revenue_deltas(deltas, "month")
+
+
+async def apply_revenue_deltas(session, deltas: list[dict]):
+    """
+    Adds per-day deltas to revenue_daily and the day and month totals with
+    one upsert each inside the session's transaction, so the rollups commit
+    together with the transactions.
+    """
+    if not deltas:
+        return
+    connection = await session.connection()
+    for statement, parameters in _revenue_upserts(session, deltas):
+        await connection.execute(statement, parameters)
+
+
+def rebuild_revenue_totals(session: Session):
+    """
+    Recomputes the day and month totals from revenue_daily with set-based
+    INSERT ... SELECT statements. Doesn't commit.
+    """
+    session.exec(delete(RevenueDayTotal))
+    session.exec(delete(RevenueMonthTotal))
+    session.exec(
+        insert(RevenueDayTotal).from_select(
+            ["day", "month", "total", "transaction_count"],
+            select(
+                RevenueDaily.day,
+                RevenueDaily.month,
+                func.sum(RevenueDaily.total),
+                func.sum(RevenueDaily.transaction_count),
+            ).group_by(RevenueDaily.day, RevenueDaily.month),
+        )
+    )
+    session.exec(
+        insert(RevenueMonthTotal).from_select(
+            ["month", "total", "transaction_count"],
+            select(
+                RevenueDaily.month,
+                func.sum(RevenueDaily.total),
+                func.sum(RevenueDaily.transaction_count),
+            ).group_by(RevenueDaily.month),
+        )
+    )
+
+
+def rebuild_revenue_daily(session: Session) -> int:
+    """
+    Recomputes the whole revenue_daily rollup from the transaction table with
+    one set-based INSERT ... SELECT, adds the archived transactions on top,
+    refreshes the day and month totals and returns the revenue_daily row count.
+    """
+    day = func.date(Transaction.created_at)
+    month = func.substr(cast(day, String), 1, 7)
+    daily_totals = select(
+        day,
+        Transaction.customer_id,
+        month,
+        func.sum(Transaction.ammount),
+        func.count(),
+    ).group_by(day, Transaction.customer_id, month)
+
+    session.exec(delete(RevenueDaily))
+    session.exec(
+        insert(RevenueDaily).from_select(
+            ["day", "customer_id", "month", "total", "transaction_count"],
+            daily_totals,
+        )
+    )
+    archived = aggregate_revenue(
+        (customer_id, ammount, transaction_id, created_at)
+        for transaction_id, customer_id, _, ammount, created_at in iter_archived_rows(load_segments_sync(session))
+    )
+    if archived:
+        session.connection().execute(_revenue_upsert(session), archived)
+    # Also called from the migration that runs before the totals tables exist
+    if inspect(session.connection()).has_table("revenue_month_total"):
+        rebuild_revenue_totals(session)
+    session.commit()
+    return session.exec(select(func.count()).select_from(RevenueDaily)).one()
@@ -0,0 +1,100 @@
+# ./app/utils/streaming.py
+import csv
+import io
+from itertools import islice
+import orjson
+from fastapi.responses import StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Importing Internal Modules
+from models import ExportFormatEnum
+
+# Rows fetched per round trip while streaming an export
+EXPORT_FETCH_SIZE = 1000
+
+MEDIA_TYPES = {
+    ExportFormatEnum.NDJSON: "application/x-ndjson",
+    ExportFormatEnum.CSV: "text/csv",
+}
+
+
+def _ndjson_chunk(columns: list[str], rows) -> bytes:
+    # orjson encodes datetimes as ISO 8601 itself
+    return b"".join(
+        orjson.dumps(dict(zip(columns, row)), option=orjson.OPT_APPEND_NEWLINE)
+        for row in rows
+    )
+
+
+def _csv_chunk(columns: list[str] | None, rows) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if columns:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+async def merge_partitions(partitions, merge_rows):
+    """
+    Interleaves an id-ordered row iterator into id-ordered result partitions
+    (both keyed on their first column), yielding at most EXPORT_FETCH_SIZE
+    rows at a time. A merged row with the same id as a partition row is
+    dropped, the partition row wins.
+    """
+    pending = next(merge_rows, None)
+    async for partition in partitions:
+        rows = []
+        for row in partition:
+            while pending is not None and pending[0] <= row[0]:
+                if pending[0] < row[0]:
+                    rows.append(pending)
+                pending = next(merge_rows, None)
+                if len(rows) >= EXPORT_FETCH_SIZE:
+                    yield rows
+                    rows = []
+            rows.append(row)
+        yield rows
+    while pending is not None:
+        rows = [pending]
+        rows.extend(islice(merge_rows, EXPORT_FETCH_SIZE - 1))
+        yield rows
+        pending = next(merge_rows, None)
+
+
+async def stream_query(bind, query, columns: list[str], export_format: ExportFormatEnum, load_merge_rows=None):
+    """
+    Yields the rows of a column query as NDJSON or CSV, fetching them in
+    EXPORT_FETCH_SIZE chunks. Rows are plain tuples, no model is built per row.
+    `load_merge_rows(session)` optionally returns rows from outside the
+    database (archive segments), sorted on the same first column as the
+    query. It is awaited once the query has started, so rows that move out
+    of the database after that show up in both and are merged once.
+    Uses its own session because the request session is closed before the
+    response body is sent.
+    """
+    if export_format == ExportFormatEnum.CSV:
+        yield _csv_chunk(columns, [])
+    query = query.execution_options(yield_per=EXPORT_FETCH_SIZE)
+    async with AsyncSession(bind) as session:
+        result = await session.stream(query)
+        partitions = result.partitions()
+        if load_merge_rows is not None:
+            partitions = merge_partitions(partitions, iter(await load_merge_rows(session)))
+        async for partition in partitions:
+            if not partition:
+                continue
+            if export_format == ExportFormatEnum.CSV:
+                yield _csv_chunk(None, partition)
+            else:
+                yield _ndjson_chunk(columns, partition)
+
+
+def export_response(
+    bind, query, columns: list[str], export_format: ExportFormatEnum, filename: str, load_merge_rows=None
+):
+    return StreamingResponse(
+        stream_query(bind, query, columns, export_format, load_merge_rows),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format.value}"'}
+    )
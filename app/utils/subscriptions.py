@@ -0,0 +1,104 @@
+# ./app/utils/subscriptions.py
+
+# Importing External Modules
+from sqlmodel import Session, delete, func, insert, select
+
+# Importing Internal Modules
+from models import CustomerPlan, CurrentCustomerPlan
+from app.utils.utils import dialect_insert
+
+
+async def upsert_current_plans(session, records: list[dict]):
+    """
+    Upserts rows of the current_customer_plan projection inside the session's
+    transaction, so they commit together with the CustomerPlan history rows.
+    Each record needs customer_id, plan_id, status and customer_plan_id.
+    """
+    if not records:
+        return
+    statement = dialect_insert(session)(CurrentCustomerPlan.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["customer_id", "plan_id"],
+        set_={
+            "status": statement.excluded.status,
+            "customer_plan_id": statement.excluded.customer_plan_id,
+        },
+    )
+    connection = await session.connection()
+    await connection.execute(statement, records)
+
+
+async def record_plan_status(session, customer_id: int, plan_id: int, plan_status) -> CustomerPlan:
+    """
+    Appends a CustomerPlan history row and updates the projection in the same
+    transaction. The caller commits.
+    """
+    customer_plan = CustomerPlan(
+        customer_id=customer_id,
+        plan_id=plan_id,
+        status=plan_status
+    )
+    session.add(customer_plan)
+    await session.flush()
+    await upsert_current_plans(session, [{
+        "customer_id": customer_id,
+        "plan_id": plan_id,
+        "status": plan_status,
+        "customer_plan_id": customer_plan.id,
+    }])
+    return customer_plan
+
+
+async def record_plan_statuses(session, rows: list[dict]):
+    """
+    Batched record_plan_status: appends the history rows (customer_id,
+    plan_id, status) in order with one batched INSERT ... RETURNING and points the projection
+    at the newest row of each pair with one upsert. The caller commits.
+    """
+    if not rows:
+        return
+    table = CustomerPlan.__table__
+    connection = await session.connection()
+    # RETURNING hands back exactly these rows' ids, in row order, whatever other
+    # sessions insert meanwhile
+    ids = (await connection.execute(
+        insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+    )).scalars().all()
+    # Later rows of a pair overwrite earlier ones, so each pair keeps its latest status
+    latest = {
+        (row["customer_id"], row["plan_id"]): {
+            "customer_id": row["customer_id"],
+            "plan_id": row["plan_id"],
+            "status": row["status"],
+            "customer_plan_id": customer_plan_id,
+        }
+        for row, customer_plan_id in zip(rows, ids)
+    }
+    await upsert_current_plans(session, list(latest.values()))
+
+
+def rebuild_current_customer_plans(session: Session) -> int:
+    """
+    Recomputes the whole current_customer_plan projection from the CustomerPlan
+    history with one set-based INSERT ... SELECT and returns the row count.
+    """
+    latest_ids = (
+        select(func.max(CustomerPlan.id))
+        .group_by(CustomerPlan.customer_id, CustomerPlan.plan_id)
+    )
+    latest_records = select(
+        CustomerPlan.customer_id,
+        CustomerPlan.plan_id,
+        CustomerPlan.status,
+        CustomerPlan.id,
+    ).where(CustomerPlan.id.in_(latest_ids))
+
+    session.exec(delete(CurrentCustomerPlan))
+    session.exec(
+        insert(CurrentCustomerPlan).from_select(
+            ["customer_id", "plan_id", "status", "customer_plan_id"],
+            latest_records,
+        )
+    )
+    session.commit()
+    return session.exec(select(func.count()).select_from(CurrentCustomerPlan)).one()
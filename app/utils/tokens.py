@@ -0,0 +1,131 @@
+# ./app/utils/tokens.py
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from typing import Annotated
+
+import orjson
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+# Seconds a session token stays valid
+TOKEN_TTL = int(os.getenv("TOKEN_TTL", "900"))
+# "kid:secret" pairs separated by commas. The first key signs new tokens and
+# every key still verifies, so a key is rotated by prepending its successor
+# and removed once the tokens it signed have expired. Without it a random
+# key is generated, so tokens don't survive a restart.
+TOKEN_SIGNING_KEYS = os.getenv("TOKEN_SIGNING_KEYS", "")
+
+
+def parse_signing_keys(spec: str) -> dict[str, bytes]:
+    keys = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        kid, separator, secret = entry.partition(":")
+        if not separator or not kid or not secret:
+            raise RuntimeError("TOKEN_SIGNING_KEYS entries must look like kid:secret")
+        keys[kid] = secret.encode()
+    return keys or {"local": secrets.token_bytes(32)}
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class TokenDenylist:
+    """
+    Token ids revoked before they expire, kept until their expiry. Per
+    process, which is enough for tokens that only live TOKEN_TTL seconds.
+    """
+
+    def __init__(self):
+        self._revoked: dict[str, int] = {}
+
+    def add(self, token_id: str, expires_at: int):
+        now = int(time.time())
+        if len(self._revoked) > 1000:
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+        self._revoked[token_id] = expires_at
+
+    def __contains__(self, token_id: str) -> bool:
+        return token_id in self._revoked
+
+    def clear(self):
+        self._revoked.clear()
+
+
+class TokenSigner:
+    """
+    Issues and verifies HMAC-SHA256 signed tokens of the form
+    `<kid>.<base64 claims>.<base64 signature>`. Verifying one is a hash and a
+    dict lookup, no database or bcrypt work.
+    """
+
+    def __init__(self, keys: dict[str, bytes], ttl: int = TOKEN_TTL):
+        self.keys = keys
+        self.active_kid = next(iter(keys))
+        self.ttl = ttl
+        self.denylist = TokenDenylist()
+
+    def _sign(self, key: bytes, message: str) -> str:
+        return _b64encode(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+    def issue(self, customer_id: int) -> tuple[str, dict]:
+        now = int(time.time())
+        claims = {"sub": customer_id, "iat": now, "exp": now + self.ttl, "jti": secrets.token_urlsafe(12)}
+        message = f"{self.active_kid}.{_b64encode(orjson.dumps(claims))}"
+        return f"{message}.{self._sign(self.keys[self.active_kid], message)}", claims
+
+    def verify(self, token: str) -> dict:
+        """
+        Returns the claims of a valid token, raises a 401 otherwise.
+        """
+        try:
+            kid, encoded_claims, signature = token.split(".")
+            key = self.keys[kid]
+        except (ValueError, KeyError):
+            raise invalid_token()
+        # Bytes, because compare_digest raises TypeError on non-ASCII str
+        expected = self._sign(key, f"{kid}.{encoded_claims}").encode()
+        if not hmac.compare_digest(signature.encode(), expected):
+            raise invalid_token()
+        claims = orjson.loads(_b64decode(encoded_claims))
+        if claims["exp"] <= time.time() or claims["jti"] in self.denylist:
+            raise invalid_token()
+        return claims
+
+    def revoke(self, claims: dict):
+        self.denylist.add(claims["jti"], claims["exp"])
+
+
+def invalid_token() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired token",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+
+token_signer = TokenSigner(parse_signing_keys(TOKEN_SIGNING_KEYS))
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def get_token_claims(
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(bearer_scheme)]
+) -> dict:
+    """
+    Dependency returning the claims of the request's bearer token.
+    """
+    if credentials is None:
+        raise invalid_token()
+    return token_signer.verify(credentials.credentials)
+
+
+# Annotated dependency to require a session token on a route
+TokenClaimsDep = Annotated[dict, Depends(get_token_claims)]
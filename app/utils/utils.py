@@ -1,10 +1,157 @@
 # ./app/utils/utils.py
+import asyncio
+import json
+from datetime import datetime, timezone
+import os
 import bcrypt
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException, Request, status
+from sqlalchemy.dialects import postgresql, sqlite
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
+# bcrypt cost factor for new hashes (every +1 doubles the CPU time)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# "thread" relies on bcrypt releasing the GIL, "process" isolates it completely
+BCRYPT_EXECUTOR = os.getenv("BCRYPT_EXECUTOR", "thread")
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+# Hashing jobs allowed to run or wait in the pool before new ones get a 503
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", str(BCRYPT_WORKERS * 4)))
+BCRYPT_RETRY_AFTER = os.getenv("BCRYPT_RETRY_AFTER", "1")
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+_password_executor: Executor | None = None
+_pending_password_jobs = 0
+
+
+def hash_password(password: str, rounds: int | None = None) -> str:
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
\ No newline at end of file
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def password_needs_rehash(hashed_password: str, rounds: int | None = None) -> bool:
+    # bcrypt hashes look like $2b$12$<salt><hash>, the cost is the third field
+    try:
+        return int(hashed_password.split("$")[2]) != (rounds or BCRYPT_ROUNDS)
+    except (IndexError, ValueError):
+        return True
+
+
+def get_password_executor() -> Executor:
+    """
+    Returns the shared pool used for bcrypt work, created on first use.
+    """
+    global _password_executor
+    if _password_executor is None:
+        if BCRYPT_EXECUTOR == "process":
+            _password_executor = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS)
+        else:
+            _password_executor = ThreadPoolExecutor(
+                max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt"
+            )
+    return _password_executor
+
+
+async def run_password_job(func, *args):
+    """
+    Runs a bcrypt function in the password pool without blocking the event loop.
+    Raises a 503 with Retry-After when the pool already has too many jobs queued.
+    """
+    global _pending_password_jobs
+    if _pending_password_jobs >= BCRYPT_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password operations in progress, try again later",
+            headers={"Retry-After": BCRYPT_RETRY_AFTER}
+        )
+    _pending_password_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_password_executor(), func, *args)
+    finally:
+        _pending_password_jobs -= 1
+
+
+async def hash_password_async(password: str) -> str:
+    return await run_password_job(hash_password, password, BCRYPT_ROUNDS)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_job(verify_password, plain_password, hashed_password)
+
+
+def _parse_ndjson_line(line: bytes):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as exc:
+        return exc
+
+
+async def iter_request_records(request: Request):
+    """
+    Yields the records of a request body. NDJSON bodies are parsed line by line
+    while they stream in, anything else must be a JSON array. Malformed NDJSON
+    lines are yielded as the JSONDecodeError so callers can report them per row.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in NDJSON_MEDIA_TYPES:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield _parse_ndjson_line(line)
+        if buffer.strip():
+            yield _parse_ndjson_line(buffer)
+        return
+
+    try:
+        records = json.loads(await request.body())
+    except json.JSONDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array or NDJSON"
+        )
+    if not isinstance(records, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array or NDJSON"
+        )
+    for record in records:
+        yield record
+
+
+async def iter_chunks(records, size: int):
+    """
+    Groups an async iterable of records into lists of at most `size` items.
+    """
+    chunk = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def to_utc_naive(value: datetime | None) -> datetime | None:
+    """
+    Converts timezone-aware query parameters to the naive UTC datetimes
+    stored in the database.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def dialect_insert(session):
+    """
+    Returns the insert() construct of the session's dialect, both of which
+    support INSERT ... ON CONFLICT DO UPDATE.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
@@ -0,0 +1,19 @@
+import os
+import sys
+from datetime import timedelta
+
+from sqlmodel import Session
+
+from db import engine
+from models import utc_now
+from app.utils.archive import archive_transactions
+
+# Moves transactions older than N days (first argument, default ARCHIVE_AFTER_DAYS or 365)
+# into compressed segment files under ARCHIVE_DIR
+days = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+with Session(engine) as session:
+    report = archive_transactions(session, utc_now() - timedelta(days=days))
+print(
+    f"Archived {report['archived']} transactions into {report['segments']} segments"
+    f" ({report['orphans_removed']} orphan files removed)"
+)
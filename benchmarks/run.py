@@ -0,0 +1,250 @@
+# ./benchmarks/run.py
+"""
+Benchmarks the API's hot endpoints against a freshly seeded database.
+
+    python -m benchmarks.run --customers 1000 --transactions 100000 \
+        --requests 500 --concurrency 16 --mode asgi --output results.json \
+        --baseline benchmarks/baseline.json --tolerance 0.25
+
+`--mode asgi` drives the app in-process through httpx's ASGI transport,
+`--mode uvicorn` starts a local uvicorn server and goes through real sockets.
+With `--baseline` the run exits with status 1 when a scenario's p95 or RPS
+regresses by more than the tolerance; `--save-baseline` writes a new one.
+"""
+
+# Importing External Modules
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import sys
+import threading
+import time
+
+BENCH_DATABASE = "bench.sqlite3"
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns one message per scenario whose p95 latency grew or whose RPS
+    dropped by more than `tolerance` (0.25 = 25%) against the baseline.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']:.2f}ms > baseline {previous['p95_ms']:.2f}ms")
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {current['rps']:.1f} < baseline {previous['rps']:.1f}")
+    return regressions
+
+
+def build_scenarios(args) -> dict:
+    from benchmarks.seed import BENCH_PASSWORD, customer_email
+
+    rng = random.Random(args.seed)
+    max_transaction_id = max(args.transactions - 50, 0)
+    return {
+        "list_transactions": lambda: ("GET", f"/transactions?after_id={rng.randint(0, max_transaction_id)}&limit=50", None),
+        "customer_plans": lambda: ("GET", f"/customers/{rng.randint(1, args.customers)}/plans", None),
+        "login": lambda: ("POST", "/customers/login", {
+            "email": customer_email(rng.randint(1, args.customers)),
+            "password": BENCH_PASSWORD,
+        }),
+        "list_customers": lambda: ("GET", "/customers", None),
+        "revenue_by_month": lambda: ("GET", "/analytics/revenue?group_by=month", None),
+        "revenue_by_customer": lambda: ("GET", "/analytics/revenue?group_by=customer&limit=100", None),
+    }
+
+
+async def run_scenario(client, make_request, total: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, body = make_request()
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_benchmarks(args) -> dict:
+    import httpx
+    from fastapi import Request
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    from app.main import app
+    from benchmarks.seed import seed_database
+    import db
+    from db import (
+        get_async_read_session,
+        get_async_session,
+        create_database_engine,
+        create_async_database_engine,
+        DB_WRITE_POOL_SIZE,
+        DB_READ_POOL_SIZE,
+        READ_ONLY_METHODS,
+    )
+
+    seed_start = time.perf_counter()
+    seed_engine = create_database_engine(f"sqlite:///{args.database}", DB_WRITE_POOL_SIZE)
+    try:
+        seed_database(seed_engine, args.customers, args.plans, args.subscriptions, args.transactions, args.seed)
+    finally:
+        seed_engine.dispose()
+    seed_seconds = time.perf_counter() - seed_start
+
+    # Same tuning and read/write split as the application's own engines
+    bench_url = f"sqlite+aiosqlite:///{args.database}"
+    bench_engine = create_async_database_engine(bench_url, DB_WRITE_POOL_SIZE)
+    bench_read_engine = create_async_database_engine(bench_url, DB_READ_POOL_SIZE, read_only=True)
+
+    async def get_bench_session(request: Request):
+        bind = bench_read_engine if request.method in READ_ONLY_METHODS else bench_engine
+        async with AsyncSession(bind, expire_on_commit=False) as session:
+            yield session
+
+    async def get_bench_read_session():
+        async with AsyncSession(bench_read_engine, expire_on_commit=False) as session:
+            yield session
+
+    # Every session dependency goes to the bench database, never to the app's own db.sqlite3
+    app.dependency_overrides[get_async_session] = get_bench_session
+    app.dependency_overrides[get_async_read_session] = get_bench_read_session
+    server = None
+    try:
+        if args.mode == "uvicorn":
+            import uvicorn
+
+            port = _free_port()
+            server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning", lifespan="off"))
+            threading.Thread(target=server.run, daemon=True).start()
+            while not server.started:
+                await asyncio.sleep(0.05)
+            client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60)
+        else:
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+        scenarios = {}
+        async with client:
+            for name, make_request in build_scenarios(args).items():
+                if args.only and name not in args.only:
+                    continue
+                total = args.login_requests if name == "login" else args.requests
+                scenarios[name] = await run_scenario(client, make_request, total, args.concurrency)
+    finally:
+        app.dependency_overrides.pop(get_async_session, None)
+        app.dependency_overrides.pop(get_async_read_session, None)
+        if server is not None:
+            server.should_exit = True
+        # aiosqlite connection threads keep the process alive until their engine is disposed,
+        # the app's own engines included in case anything reached them
+        await bench_engine.dispose()
+        await bench_read_engine.dispose()
+        await db.async_engine.dispose()
+        await db.async_read_engine.dispose()
+
+    return {
+        "mode": args.mode,
+        "scale": {
+            "customers": args.customers,
+            "plans": args.plans,
+            "subscriptions": args.subscriptions,
+            "transactions": args.transactions,
+        },
+        "concurrency": args.concurrency,
+        "seed_seconds": seed_seconds,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "scenarios": scenarios,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API's hot endpoints")
+    parser.add_argument("--mode", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--database", default=BENCH_DATABASE)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--plans", type=int, default=10)
+    parser.add_argument("--subscriptions", type=int, default=5000)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=50, help="Requests for the bcrypt-bound login scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--bcrypt-rounds", type=int, default=None)
+    parser.add_argument("--only", nargs="*", help="Run only these scenarios")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Fail when results regress against this report")
+    parser.add_argument("--save-baseline", help="Write the JSON report as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.bcrypt_rounds is not None:
+        # Read when app.utils.utils is imported, so set it before importing the app
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    # Every benchmark request comes from one address, which the login limits would throttle
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+    results = asyncio.run(run_benchmarks(args))
+    report = json.dumps(results, indent=2)
+    print(report)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as file:
+            file.write(report)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_to_baseline(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# ./benchmarks/seed.py
+
+# Importing External Modules
+import random
+from datetime import timedelta
+from sqlmodel import Session, SQLModel, insert
+
+# Importing Internal Modules
+from models import Customer, Plan, CustomerPlan, Transaction, StatusEnum, utc_now
+from app.utils.balances import reconcile_customer_balances
+from app.utils.revenue import rebuild_revenue_daily
+from app.utils.subscriptions import rebuild_current_customer_plans
+from migrations import migrate, schema_metadata
+from app.utils.utils import hash_password
+
+BENCH_PASSWORD = "benchmark"
+SEED_CHUNK_SIZE = 10000
+# Transactions are spread over this many days so the revenue rollup has a realistic shape
+SEED_DAYS = 365
+
+
+def customer_email(customer_id: int) -> str:
+    return f"bench{customer_id}@example.com"
+
+
+def seed_database(engine, customers: int, plans: int, subscriptions: int, transactions: int, seed: int = 42):
+    """
+    Recreates the schema through the migrations and fills them with deterministic data at the given
+    scale using executemany inserts. Every customer shares one password hash
+    so seeding doesn't spend minutes in bcrypt.
+    """
+    rng = random.Random(seed)
+    SQLModel.metadata.drop_all(engine)
+    schema_metadata.drop_all(engine)
+    migrate(engine)
+    password_hash = hash_password(BENCH_PASSWORD)
+    now = utc_now()
+
+    with Session(engine) as session:
+        session.exec(insert(Plan), params=[
+            {"id": plan_id, "name": f"Plan {plan_id}", "price": 10 * plan_id, "description": "Benchmark plan"}
+            for plan_id in range(1, plans + 1)
+        ])
+        for start in range(1, customers + 1, SEED_CHUNK_SIZE):
+            session.exec(insert(Customer), params=[
+                {
+                    "id": customer_id,
+                    "name": f"Customer {customer_id}",
+                    "email": customer_email(customer_id),
+                    "age": 18 + customer_id % 60,
+                    "password_hash": password_hash,
+                }
+                for customer_id in range(start, min(start + SEED_CHUNK_SIZE, customers + 1))
+            ])
+        for start in range(0, subscriptions, SEED_CHUNK_SIZE):
+            session.exec(insert(CustomerPlan), params=[
+                {
+                    "customer_id": rng.randint(1, customers),
+                    "plan_id": rng.randint(1, plans),
+                    "status": rng.choice((StatusEnum.ACTIVE, StatusEnum.INACTIVE)),
+                }
+                for _ in range(start, min(start + SEED_CHUNK_SIZE, subscriptions))
+            ])
+        for start in range(0, transactions, SEED_CHUNK_SIZE):
+            session.exec(insert(Transaction), params=[
+                {
+                    "customer_id": rng.randint(1, customers),
+                    "description": f"Transaction {number}",
+                    "ammount": rng.randint(1, 1000),
+                    "created_at": now - timedelta(seconds=rng.randint(0, SEED_DAYS * 86400)),
+                }
+                for number in range(start, min(start + SEED_CHUNK_SIZE, transactions))
+            ])
+        session.commit()
+        rebuild_current_customer_plans(session)
+        # Aggregates the API maintains on insert, rebuilt in bulk for the seeded rows
+        reconcile_customer_balances(session)
+        rebuild_revenue_daily(session)
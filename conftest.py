@@ -1,15 +1,31 @@
+import asyncio
+import os
 import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.pool import StaticPool
 from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Cheap bcrypt cost factor so tests don't spend seconds hashing passwords
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
 
 from app.main import app
-from db import get_session
+from app.utils.archive import close_segments
+from app.utils.cache import cache, create_backend
+from app.utils.idempotency import idempotency_store
+from app.utils.ratelimit import rate_limiter
+from app.utils.tokens import token_signer
+from app.utils.metrics import instrument_engine
+import db
+from db import get_async_read_session, get_async_session
 
 sqlite_name = "db.sqlite3"
 sqlite_url = f"sqlite:///{sqlite_name}"
+async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_name}"
 
 engine = create_engine(
     sqlite_url,
@@ -17,6 +33,13 @@ engine = create_engine(
     poolclass=StaticPool,
 )
 
+async_engine = create_async_engine(
+    async_sqlite_url,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+instrument_engine(async_engine.sync_engine)
+
 
 @pytest.fixture(name="session")
 def session_fixture():
@@ -28,10 +51,64 @@ def session_fixture():
 
 @pytest.fixture(name="client")
 def client_fixture(session: Session):
-    def get_session_override():
-        return session
+    async def get_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as async_session:
+            yield async_session
 
-    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_async_session] = get_session_override
+    app.dependency_overrides[get_async_read_session] = get_session_override
     client = TestClient(app)
     yield client
-    app.dependency_overrides.clear()
\ No newline at end of file
+    app.dependency_overrides.clear()
+    # Cached rows would outlive the tables dropped between tests
+    asyncio.run(cache.clear())
+    idempotency_store.clear()
+    asyncio.run(rate_limiter.clear())
+    token_signer.denylist.clear()
+    close_segments()
+
+
+@pytest.fixture(name="cache_backend", params=["memory", "local"])
+def cache_backend_fixture(request, monkeypatch):
+    """
+    Runs a test once per in-process cache backend. "local" sends values
+    through JSON like Redis would, so a cached value that doesn't
+    serialize fails the test instead of production.
+    """
+    monkeypatch.setattr(cache, "backend", create_backend(request.param))
+    yield request.param
+    asyncio.run(cache.clear())
+
+
+@pytest.fixture(name="pooled_app")
+def pooled_app_fixture(tmp_path, monkeypatch):
+    """
+    The app on a file database with the production pool shape: one writer
+    connection and a reader pool, unlike the StaticPool above where every
+    session shares a single connection. Drive it with an httpx AsyncClient
+    so requests overlap on one event loop.
+    """
+    path = tmp_path / "pooled.sqlite3"
+    SQLModel.metadata.create_all(create_engine(f"sqlite:///{path}"))
+    # Fail fast instead of waiting 30 seconds for a connection that never frees up
+    monkeypatch.setattr(db, "DB_POOL_TIMEOUT", 2)
+    writer = db.create_async_database_engine(f"sqlite+aiosqlite:///{path}", 1)
+    reader = db.create_async_database_engine(f"sqlite+aiosqlite:///{path}", 2, read_only=True)
+
+    async def get_session_override(request: Request):
+        bind = reader if request.method in db.READ_ONLY_METHODS else writer
+        async with AsyncSession(bind, expire_on_commit=False) as async_session:
+            yield async_session
+
+    async def get_read_session_override():
+        async with AsyncSession(reader, expire_on_commit=False) as async_session:
+            yield async_session
+
+    app.dependency_overrides[get_async_session] = get_session_override
+    app.dependency_overrides[get_async_read_session] = get_read_session_override
+    yield app
+    app.dependency_overrides.clear()
+    asyncio.run(cache.clear())
+    asyncio.run(rate_limiter.clear())
+    asyncio.run(writer.dispose())
+    asyncio.run(reader.dispose())
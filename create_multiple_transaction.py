@@ -1,4 +1,4 @@
-from sqlmodel import Session
+from sqlmodel import Session, insert
 
 from db import engine
 from models import Customer, Transaction
@@ -13,12 +13,16 @@ customer = Customer(
 session.add(customer)
 session.commit()
 
-for x in range(100):
-    session.add(
-        Transaction(
-            customer_id=customer.id,
-            description=f"Test number {x}",
-            ammount=10 * x,
-        )
-    )
+# One executemany insert instead of one ORM object per row
+session.exec(
+    insert(Transaction),
+    params=[
+        {
+            "customer_id": customer.id,
+            "description": f"Test number {x}",
+            "ammount": 10 * x,
+        }
+        for x in range(100)
+    ],
+)
 session.commit()
\ No newline at end of file
@@ -1,30 +1,154 @@
-from fastapi import FastAPI, Depends
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Request
 from typing import Annotated
-from sqlmodel import Session, create_engine, SQLModel
+from sqlalchemy import event
+from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
 
 
 # SQLite database configuration
 sqlite_name = "db.sqlite3"
 sqlite_url = f"sqlite:///{sqlite_name}"
+# Same database through the aiosqlite driver (use postgresql+asyncpg:// in production)
+async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_name}"
 
+# Every setting can be overridden from the environment, so the same code targets Postgres
+DATABASE_URL = os.getenv("DATABASE_URL", sqlite_url)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", async_sqlite_url)
+# Optional replica URLs, by default readers open the primary database
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", DATABASE_URL)
+ASYNC_DATABASE_READ_URL = os.getenv("ASYNC_DATABASE_READ_URL", ASYNC_DATABASE_URL)
+# SQLite allows a single writer, so writes queue in the pool instead of failing with "database is locked"
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "1"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
 
-# Create database engine
-engine = create_engine(sqlite_url)
+# SQLite pragmas applied to every new connection
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    # Negative values are KiB, -65536 is a 64 MiB page cache per connection
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    "foreign_keys": os.getenv("SQLITE_FOREIGN_KEYS", "OFF"),
+}
 
 
-def create_all_tables(app: FastAPI):
-    SQLModel.metadata.create_all(engine)
+def apply_sqlite_pragmas(engine, read_only: bool = False):
+    """
+    Registers a connect hook that tunes every SQLite connection of `engine`.
+    Reader connections are additionally made query_only. Other dialects are
+    left untouched.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            # journal_mode is stored in the database file, the writer sets it
+            if read_only and name == "journal_mode":
+                continue
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+def _pool_options(url: str, pool_size: int) -> dict:
+    # In-memory SQLite databases use a single static connection, nothing to size
+    if url.startswith("sqlite") and ":memory:" in url:
+        return {}
+    return {"pool_size": pool_size, "max_overflow": 0, "pool_timeout": DB_POOL_TIMEOUT}
+
+
+def create_database_engine(url: str, pool_size: int, read_only: bool = False):
+    engine = create_engine(url, **_pool_options(url, pool_size))
+    apply_sqlite_pragmas(engine, read_only)
+    return engine
+
+
+def create_async_database_engine(url: str, pool_size: int, read_only: bool = False):
+    async_engine = create_async_engine(url, **_pool_options(url, pool_size))
+    apply_sqlite_pragmas(async_engine.sync_engine, read_only)
+    return async_engine
+
+
+# Create database engines, one writer pool and one reader pool per driver
+engine = create_database_engine(DATABASE_URL, DB_WRITE_POOL_SIZE)
+read_engine = create_database_engine(DATABASE_READ_URL, DB_READ_POOL_SIZE, read_only=True)
+
+# Create async database engines used by the API routers
+async_engine = create_async_database_engine(ASYNC_DATABASE_URL, DB_WRITE_POOL_SIZE)
+async_read_engine = create_async_database_engine(ASYNC_DATABASE_READ_URL, DB_READ_POOL_SIZE, read_only=True)
+
+# Run pending migrations at startup instead of only checking the schema version
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "0") == "1"
+
+# Requests with these methods never write and are served by the reader pool
+READ_ONLY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+@asynccontextmanager
+async def check_database_schema(app: FastAPI):
+    # Schema changes are applied by `python migrations.py`, startup only checks the version
+    from migrations import check_schema_version, migrate
+
+    if DB_AUTO_MIGRATE:
+        migrate(engine)
+    else:
+        check_schema_version(engine)
     yield
+    from app.utils.group_commit import transaction_writer
 
+    # Queued transactions are committed before the engines go away
+    await transaction_writer.stop()
+    # aiosqlite runs each connection in a thread that lives until it is closed
+    await async_engine.dispose()
+    await async_read_engine.dispose()
 
-def get_session():
+
+def get_session(request: Request):
     """
     Dependency function to get a SQLModel session.
     Ensures that the session is properly opened and closed.
     """
-    with Session(engine) as session:
+    bind = read_engine if request.method in READ_ONLY_METHODS else engine
+    with Session(bind) as session:
+        yield session
+
+
+async def get_async_session(request: Request):
+    """
+    Dependency function to get an async SQLModel session. Reads go to the
+    reader pool and everything else to the single writer. Objects are not
+    expired on commit so handlers can return them without triggering a lazy
+    load outside the event loop.
+    """
+    bind = async_read_engine if request.method in READ_ONLY_METHODS else async_engine
+    async with AsyncSession(bind, expire_on_commit=False) as session:
+        yield session
+
+
+async def get_async_read_session():
+    """
+    Dependency function to get an async session on the reader pool inside
+    write requests. Handlers use it for lookups that precede slow work
+    (bcrypt, reading a request body) so the single writer connection is
+    only checked out for the write itself. Close it before that work.
+    """
+    async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
         yield session
 
 
 # Annotated dependency to inject session into routes
 SessionDep = Annotated[Session, Depends(get_session)]
+
+# Annotated dependency to inject an async session into routes
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+AsyncReadSessionDep = Annotated[AsyncSession, Depends(get_async_read_session)]
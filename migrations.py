@@ -0,0 +1,253 @@
+# ./migrations.py
+"""
+Versioned, idempotent schema migrations.
+
+    python migrations.py           # apply every pending migration
+    python migrations.py --check   # exit with status 1 when the database is behind
+
+The API only compares the stored version with LATEST_VERSION at startup (set
+DB_AUTO_MIGRATE=1 to migrate on boot instead). Every step checks what already
+exists, so re-running a migration against a partially migrated database is safe.
+"""
+
+# Importing External Modules
+import sys
+from typing import Callable, NamedTuple
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlmodel import Session, SQLModel
+
+# Importing Internal Modules
+from models import (
+    ArchiveSegment,
+    Customer,
+    Plan,
+    CustomerPlan,
+    CurrentCustomerPlan,
+    CustomerBalance,
+    IdempotencyKey,
+    ResourceVersion,
+    RevenueDaily,
+    RevenueDayTotal,
+    RevenueMonthTotal,
+    Transaction,
+    utc_now
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable
+    # Non-transactional steps run in autocommit mode, required for online index builds
+    transactional: bool = True
+
+
+schema_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    schema_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def create_index(connection, name: str, table: str, columns: list[str], unique: bool = False):
+    """
+    Creates an index if it doesn't exist. On Postgres the build runs
+    CONCURRENTLY so large tables keep accepting writes; on SQLite, WAL keeps
+    readers going while the writer lock is held.
+    """
+    concurrently = " CONCURRENTLY" if connection.dialect.name == "postgresql" else ""
+    unique_sql = "UNIQUE " if unique else ""
+    column_sql = ", ".join(f'"{column}"' for column in columns)
+    connection.execute(text(
+        f'CREATE {unique_sql}INDEX{concurrently} IF NOT EXISTS "{name}" ON "{table}" ({column_sql})'
+    ))
+
+
+def add_column(connection, table: str, column: str, ddl_type: str):
+    existing = {info["name"] for info in inspect(connection).get_columns(table)}
+    if column not in existing:
+        connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl_type}'))
+
+
+def create_base_tables(connection):
+    SQLModel.metadata.create_all(
+        connection,
+        tables=[Customer.__table__, Plan.__table__, CustomerPlan.__table__, Transaction.__table__],
+    )
+
+
+def add_transaction_created_at(connection):
+    add_column(connection, "transaction", "created_at", "TIMESTAMP")
+    # The real creation time of older rows is unknown, stamp them with the migration time
+    connection.execute(
+        text('UPDATE "transaction" SET created_at = :now WHERE created_at IS NULL'),
+        {"now": utc_now()},
+    )
+
+
+def create_current_customer_plan(connection):
+    from app.utils.subscriptions import rebuild_current_customer_plans
+
+    SQLModel.metadata.create_all(connection, tables=[CurrentCustomerPlan.__table__])
+    with Session(bind=connection) as session:
+        rebuild_current_customer_plans(session)
+
+
+def create_secondary_indexes(connection):
+    create_index(connection, "ix_customer_email", "customer", ["email"], unique=True)
+    create_index(connection, "ix_transaction_customer_id", "transaction", ["customer_id"])
+    create_index(
+        connection, "ix_customerplan_customer_id_plan_id_id", "customerplan",
+        ["customer_id", "plan_id", "id"]
+    )
+    create_index(
+        connection, "ix_current_customer_plan_plan_id_status", "current_customer_plan",
+        ["plan_id", "status"]
+    )
+
+
+def create_transaction_customer_timeline_index(connection):
+    create_index(
+        connection, "ix_transaction_customer_id_created_at_id", "transaction",
+        ["customer_id", "created_at", "id"]
+    )
+    # Superseded by the composite index, which has customer_id as its prefix
+    connection.execute(text('DROP INDEX IF EXISTS "ix_transaction_customer_id"'))
+
+
+def extend_transaction_customer_timeline_index(connection):
+    create_index(
+        connection, "ix_transaction_customer_id_created_at_id_ammount", "transaction",
+        ["customer_id", "created_at", "id", "ammount"]
+    )
+    # Superseded by the extended index, which has the same prefix
+    connection.execute(text('DROP INDEX IF EXISTS "ix_transaction_customer_id_created_at_id"'))
+
+
+def create_customer_balance(connection):
+    from app.utils.balances import reconcile_customer_balances
+
+    SQLModel.metadata.create_all(connection, tables=[CustomerBalance.__table__])
+    with Session(bind=connection) as session:
+        reconcile_customer_balances(session)
+
+
+def create_idempotency_key(connection):
+    SQLModel.metadata.create_all(connection, tables=[IdempotencyKey.__table__])
+
+
+def create_resource_version(connection):
+    SQLModel.metadata.create_all(connection, tables=[ResourceVersion.__table__])
+
+
+def create_revenue_daily(connection):
+    from app.utils.revenue import rebuild_revenue_daily
+
+    SQLModel.metadata.create_all(connection, tables=[RevenueDaily.__table__])
+    with Session(bind=connection) as session:
+        rebuild_revenue_daily(session)
+
+
+def create_archive_segment(connection):
+    SQLModel.metadata.create_all(connection, tables=[ArchiveSegment.__table__])
+
+
+def create_revenue_totals(connection):
+    from app.utils.revenue import rebuild_revenue_totals
+
+    SQLModel.metadata.create_all(connection, tables=[RevenueDayTotal.__table__, RevenueMonthTotal.__table__])
+    with Session(bind=connection) as session:
+        rebuild_revenue_totals(session)
+        session.commit()
+
+
+MIGRATIONS = [
+    Migration(1, "create_base_tables", create_base_tables),
+    Migration(2, "add_transaction_created_at", add_transaction_created_at),
+    Migration(3, "create_current_customer_plan", create_current_customer_plan),
+    Migration(4, "create_secondary_indexes", create_secondary_indexes, transactional=False),
+    Migration(
+        5, "create_transaction_customer_timeline_index",
+        create_transaction_customer_timeline_index, transactional=False
+    ),
+    Migration(6, "create_customer_balance", create_customer_balance),
+    Migration(7, "create_idempotency_key", create_idempotency_key),
+    Migration(8, "create_resource_version", create_resource_version),
+    Migration(9, "create_revenue_daily", create_revenue_daily),
+    Migration(10, "create_archive_segment", create_archive_segment),
+    Migration(11, "create_revenue_totals", create_revenue_totals),
+    Migration(
+        12, "extend_transaction_customer_timeline_index",
+        extend_transaction_customer_timeline_index, transactional=False
+    ),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(connection) -> int:
+    if not inspect(connection).has_table("schema_version"):
+        return 0
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def _record_migration(connection, migration: Migration):
+    connection.execute(
+        schema_version.insert().values(version=migration.version, name=migration.name, applied_at=utc_now())
+    )
+
+
+def migrate(engine) -> list[int]:
+    """
+    Applies every migration newer than the stored schema version, each in its
+    own transaction, and returns the versions that were applied.
+    """
+    with engine.begin() as connection:
+        schema_metadata.create_all(connection)
+        current_version = get_schema_version(connection)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current_version:
+            continue
+        if migration.transactional:
+            with engine.begin() as connection:
+                migration.upgrade(connection)
+                _record_migration(connection, migration)
+        else:
+            with engine.connect() as connection:
+                connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+                migration.upgrade(connection)
+                _record_migration(connection, migration)
+        applied.append(migration.version)
+    return applied
+
+
+def check_schema_version(engine):
+    """
+    Startup check: one indexed read, raises if migrations are pending.
+    """
+    with engine.connect() as connection:
+        version = get_schema_version(connection)
+    if version < LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}. "
+            "Run `python migrations.py` to upgrade it."
+        )
+
+
+if __name__ == "__main__":
+    from db import engine
+
+    if "--check" in sys.argv[1:]:
+        try:
+            check_schema_version(engine)
+        except RuntimeError as exc:
+            print(exc)
+            sys.exit(1)
+        print(f"Database schema is up to date (version {LATEST_VERSION})")
+    else:
+        applied = migrate(engine)
+        print(f"Applied migrations: {applied}" if applied else "No pending migrations")
@@ -2,30 +2,73 @@
 
 # Importing External Modules
 import bcrypt
+from datetime import date, datetime, timezone
 from enum import Enum
-from pydantic import BaseModel, EmailStr, field_validator
-from sqlmodel import SQLModel, Field, Relationship, Session, select
+from pydantic import BaseModel, EmailStr
+from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index
 from typing import Optional
+from typing_extensions import TypedDict
 from sqlalchemy.orm import Session as SQLSession
 
-# Importing Internal Modules
-from db import engine
-
 
 class StatusEnum(str, Enum):
     ACTIVE = "active"
     INACTIVE = "inactive"
 
 
+def utc_now() -> datetime:
+    # Naive UTC, which is what SQLite's DATETIME columns round-trip
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CountModeEnum(str, Enum):
+    EXACT = "exact"
+    CACHED = "cached"
+    ESTIMATED = "estimated"
+    NONE = "none"
+
+
+class ExportFormatEnum(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+class RevenueGroupByEnum(str, Enum):
+    DAY = "day"
+    MONTH = "month"
+    CUSTOMER = "customer"
+    PLAN = "plan"
+
+
 class CustomerPlan(SQLModel, table= True):
+    # Latest-record-per-plan lookups read (customer_id, plan_id, MAX(id)) from this index
+    __table_args__ = (
+        Index("ix_customerplan_customer_id_plan_id_id", "customer_id", "plan_id", "id"),
+    )
+
     id: int = Field(primary_key=True)
     plan_id: int = Field(foreign_key="plan.id")
     customer_id: int = Field(foreign_key="customer.id")
     status: StatusEnum = Field(default=StatusEnum.ACTIVE)
 
 
+# Current status of each (customer, plan) pair, maintained next to the CustomerPlan history
+class CurrentCustomerPlan(SQLModel, table= True):
+    __tablename__ = "current_customer_plan"
+    # "Customers per plan" lookups filter by plan and status
+    __table_args__ = (
+        Index("ix_current_customer_plan_plan_id_status", "plan_id", "status"),
+    )
+
+    customer_id: int = Field(foreign_key="customer.id", primary_key=True)
+    plan_id: int = Field(foreign_key="plan.id", primary_key=True)
+    status: StatusEnum = Field(default=StatusEnum.ACTIVE)
+    customer_plan_id: int = Field(foreign_key="customerplan.id")
+
+
 class Plan(SQLModel, table= True):
-    id: int | None = Field(primary_key=True)
+    id: int | None = Field(default=None, primary_key=True)
     name: str = Field(default=None)
     price: int = Field(default=None)
     description: str = Field(default=None)
@@ -34,22 +77,21 @@ class Plan(SQLModel, table= True):
     )
 
 
+# Read-only plan shape, built from plain dicts or row tuples without loading relationships
+class PlanPublic(SQLModel):
+    id: int
+    name: str | None = None
+    price: int | None = None
+    description: str | None = None
+
+
 class CustomerBase(SQLModel):
     name: str = Field(default= None)
     description: str | None = Field(default= None)
-    email: EmailStr = Field(default= None)
+    # Uniqueness is enforced by the database index, see ensure_email_available
+    email: EmailStr = Field(default= None, unique= True, index= True)
     age: int = Field(default= None)
 
-    @field_validator("email")
-    @classmethod
-    def validate_email(cls, value):
-        session = Session(engine)
-        query = select(Customer).where(Customer.email == value)
-        result = session.exec(query).first()
-        if result:
-            raise ValueError("This email is already registered")
-        return value
-
 
 class CustomerCreate(CustomerBase):
     password: str 
@@ -64,6 +106,16 @@ class Customer(CustomerBase, table= True):
     )
 
 
+# Read-only customer shape, never carries password_hash
+class CustomerPublic(CustomerBase):
+    id: int
+
+
+# Column order used when customers and plans are serialized straight from row tuples
+CUSTOMER_PUBLIC_FIELDS = ("id", "name", "description", "email", "age")
+PLAN_PUBLIC_FIELDS = ("id", "name", "price", "description")
+
+
 class CustomerUpdate(SQLModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -83,15 +135,127 @@ class TransactionBase(SQLModel):
 
 # Model representing a single transaction
 class Transaction(TransactionBase, table= True):
+    # Per-customer pages walk (created_at, id) in index order and test amount filters on the
+    # index entry, so only matching rows are read from the table; also serves customer_id lookups
+    __table_args__ = (
+        Index("ix_transaction_customer_id_created_at_id_ammount", "customer_id", "created_at", "id", "ammount"),
+    )
+
     id: int | None = Field(default=None, primary_key = True)
     customer_id: int = Field(foreign_key="customer.id")
+    # Also used as the column default, so bulk Core inserts get a timestamp too
+    created_at: datetime = Field(default_factory=utc_now)
     customer: Customer = Relationship(back_populates="transactions")
 
 
+# Running totals per customer, updated in the same commit as each transaction insert
+class CustomerBalance(SQLModel, table= True):
+    __tablename__ = "customer_balance"
+
+    customer_id: int = Field(foreign_key="customer.id", primary_key=True)
+    total: int = Field(default=0)
+    transaction_count: int = Field(default=0)
+    last_transaction_id: int | None = Field(default=None)
+    last_transaction_at: datetime | None = Field(default=None)
+
+
+# Revenue per customer and UTC day, updated in the same commit as each transaction insert
+class RevenueDaily(SQLModel, table= True):
+    __tablename__ = "revenue_daily"
+    # Covering indexes: month and customer reports are answered from the index alone
+    __table_args__ = (
+        Index("ix_revenue_daily_month_totals", "month", "total", "transaction_count"),
+        Index("ix_revenue_daily_customer_id_day_totals", "customer_id", "day", "total", "transaction_count"),
+    )
+
+    day: date = Field(primary_key=True)
+    customer_id: int = Field(foreign_key="customer.id", primary_key=True)
+    # "YYYY-MM", stored so monthly buckets need no dialect-specific date functions
+    month: str
+    total: int = Field(default=0)
+    transaction_count: int = Field(default=0)
+
+
+# Revenue of all customers per UTC day and per month, updated in the same upsert as
+# revenue_daily, so day and month reports read one row per bucket
+class RevenueDayTotal(SQLModel, table= True):
+    __tablename__ = "revenue_day_total"
+
+    day: date = Field(primary_key=True)
+    month: str
+    total: int = Field(default=0)
+    transaction_count: int = Field(default=0)
+
+
+class RevenueMonthTotal(SQLModel, table= True):
+    __tablename__ = "revenue_month_total"
+
+    month: str = Field(primary_key=True)
+    total: int = Field(default=0)
+    transaction_count: int = Field(default=0)
+
+
+# Transactions moved out of the hot table into a segment file, see app/utils/archive.py.
+# A segment only counts once its row here commits, together with the deletion of its rows
+class ArchiveSegment(SQLModel, table= True):
+    __tablename__ = "archive_segment"
+
+    name: str = Field(primary_key=True)
+    min_id: int
+    max_id: int
+    min_customer_id: int
+    max_customer_id: int
+    min_created_at: datetime
+    max_created_at: datetime
+    row_count: int
+    total: int
+    archived_at: datetime = Field(default_factory=utc_now)
+
+
+# Write counters behind the ETags of cached reads, see app/utils/http_cache.py
+class ResourceVersion(SQLModel, table= True):
+    __tablename__ = "resource_version"
+
+    key: str = Field(primary_key=True)
+    version: int = Field(default=0)
+
+
+# Stored responses of writes sent with an Idempotency-Key header, see app/utils/idempotency.py
+class IdempotencyKey(SQLModel, table= True):
+    __tablename__ = "idempotency_key"
+    # Expired keys are purged with a range delete on this index
+    __table_args__ = (
+        Index("ix_idempotency_key_expires_at", "expires_at"),
+    )
+
+    scope: str = Field(primary_key=True)
+    key: str = Field(primary_key=True)
+    request_hash: str
+    status_code: int
+    response_body: str
+    created_at: datetime = Field(default_factory=utc_now)
+    expires_at: datetime
+
+
 class TransactionCreate(TransactionBase):
     customer_id: int = Field(foreign_key="customer.id")
 
 
+# Same fields as TransactionCreate validated into a plain dict, used by bulk
+# ingestion where building a model per row dominates the insert cost
+class TransactionCreateRow(TypedDict):
+    ammount: int
+    description: str
+    customer_id: int
+
+
+# One (customer, plan, status) change of the batch subscription endpoint
+class CustomerPlanBatchRow(TypedDict):
+    customer_id: int
+    plan_id: int
+    status: StatusEnum
+
+
 # Model representing an invoice that contains a list of transactions
 class Invoice(BaseModel):
     id: int
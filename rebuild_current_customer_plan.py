@@ -0,0 +1,9 @@
+from sqlmodel import Session
+
+from db import engine
+from app.utils.subscriptions import rebuild_current_customer_plans
+
+# Recomputes the current_customer_plan projection from the CustomerPlan history
+with Session(engine) as session:
+    total = rebuild_current_customer_plans(session)
+print(f"current_customer_plan rebuilt with {total} rows")
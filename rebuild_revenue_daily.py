@@ -0,0 +1,9 @@
+from sqlmodel import Session
+
+from db import engine
+from app.utils.revenue import rebuild_revenue_daily
+
+# Recomputes the revenue_daily rollup from the transaction table
+with Session(engine) as session:
+    total = rebuild_revenue_daily(session)
+print(f"revenue_daily rebuilt with {total} rows")
@@ -0,0 +1,16 @@
+import sys
+
+from sqlmodel import Session
+
+from db import engine
+from app.utils.balances import reconcile_customer_balances
+
+# Rebuilds customer_balance from the transaction table; pass --dry-run to only report drift
+with Session(engine) as session:
+    report = reconcile_customer_balances(session, fix="--dry-run" not in sys.argv[1:])
+print(
+    f"Checked {report['customers_checked']} customers, "
+    f"{report['drifted']} drifted{' and were fixed' if report['fixed'] else ''}"
+)
+for drift in report["drift"]:
+    print(drift)